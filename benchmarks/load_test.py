@@ -0,0 +1,434 @@
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from urllib.parse import quote
+
+import numpy as np
+from bokeh.protocol import Protocol
+from bokeh.protocol.receiver import Receiver
+from tornado.httpclient import AsyncHTTPClient
+from tornado.websocket import websocket_connect
+
+"""
+Load test of the plot apps. Starts a number of simulated students per app, each
+of them opens a session the same way the website embeds the plots (by loading
+autoload.js, which is what the script of server_document does, and connecting to
+the websocket of the session) and then drags sliders like a student would, one
+step of the slider after the other.
+
+Measured per app are
+    - the latency of creating a session (autoload.js until the document has
+      been pulled),
+    - the round trip of a slider change, i.e., the time from sending the new
+      value until the server has run the callbacks and all resulting changes
+      have arrived,
+    - the size of the messages the server sends in response,
+    - the CPU time the server process spent during the test of the app.
+
+By default a local bokeh server is started for the plots under test, use --url
+(and --server-pid for the CPU time) to test an already running server. Run it
+from the root of the repository:
+
+    python3 benchmarks/load_test.py --students 20 einfache_funktionen wellen
+"""
+
+PLOTS_DIR = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), "plots")
+
+PROTOCOL_VERSION = "1.0"
+
+# The sliders (by title) a student drags in an app. Sliders of apps not listed
+# here are all dragged one after the other. A title that matches no slider of
+# the app aborts the test.
+SCENARIOS = {
+        "einfache_funktionen": ["Parameter a"],
+        "wellen": ["Zeit"],
+        "waermeleitung": ["Zeit"],
+        "schwingungen": ["Zeit t"],
+        "phasen_plot": ["Zeit"],
+        }
+
+# The websocket limit of the bokeh server, documents with large data sources
+# exceed the default of tornado
+MAX_MESSAGE_SIZE = 20 * 1024 * 1024
+
+SESSION_ID = re.compile(r'"sessionid"\s*:\s*"([^"]+)"')
+
+
+class AppStatistics(object):
+    def __init__(self, app):
+        self.app = app
+        self.session_latencies = []
+        self.round_trips = []
+        self.message_sizes = []
+        self.errors = defaultdict(int)
+        self.cpu_time = None
+        self.duration = None
+
+
+class StudentConnection(object):
+    """
+    A websocket connection to one session speaking the bokeh protocol.
+    """
+    def __init__(self, websocket, timeout):
+        self.websocket = websocket
+        self.timeout = timeout
+        self.protocol = Protocol(PROTOCOL_VERSION)
+        self.receiver = Receiver(self.protocol)
+        self.message_id = 0
+
+    async def read_message(self):
+        """
+        Returns the next complete message together with its size in bytes
+        (summed over all of its fragments, i.e., including the binary buffers).
+        """
+        size = 0
+        while True:
+            fragment = await asyncio.wait_for(self.websocket.read_message(),
+                    self.timeout)
+            if fragment is None:
+                raise ConnectionError("websocket closed by the server")
+            size += len(fragment)
+            message = await self.receiver.consume(fragment)
+            if message is not None:
+                return message, size
+
+    async def send(self, msgtype, content):
+        self.message_id += 1
+        message_id = str(self.message_id)
+        header = {"msgid": message_id, "msgtype": msgtype}
+        await self.websocket.write_message(json.dumps(header))
+        await self.websocket.write_message("{}")
+        await self.websocket.write_message(json.dumps(content))
+        return message_id
+
+    async def pull_document(self):
+        await self.send("PULL-DOC-REQ", {})
+        while True:
+            message, _ = await self.read_message()
+            if message.msgtype == "PULL-DOC-REPLY":
+                return message.content["doc"]
+            if message.msgtype == "ERROR":
+                raise RuntimeError(message.content["text"])
+
+    async def drain(self, duration):
+        """
+        Reads the messages arriving within the given number of seconds (e.g.,
+        late updates of the previous change) so that they are not taken for the
+        reply to the next change. Returns the sizes of the received patches.
+        """
+        sizes = []
+        deadline = time.perf_counter() + duration
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return sizes
+            try:
+                message, size = await asyncio.wait_for(self.read_message(),
+                        remaining)
+            except asyncio.TimeoutError:
+                return sizes
+            if message.msgtype == "PATCH-DOC":
+                sizes.append(size)
+
+    async def change_value(self, model, value, settle):
+        """
+        Sends a new value of a widget and waits for the reply of the server.
+        Changes caused by the callbacks are sent (as PATCH-DOC) before the
+        server acknowledges the change with OK. Callbacks that are run later
+        (e.g., debounced ones) are waited for at most settle seconds.
+
+        Returns the round trip time and the sizes of the received patches.
+        """
+        started = time.perf_counter()
+        message_id = await self.send("PATCH-DOC", {
+                "events": [{
+                    "kind": "ModelChanged",
+                    "model": {"id": model["id"], "type": model["type"]},
+                    "attr": "value",
+                    "new": value,
+                    }],
+                "references": [],
+                })
+        sizes = []
+        finished = None
+        acknowledged = False
+        while not acknowledged or not sizes:
+            try:
+                if acknowledged:
+                    message, size = await asyncio.wait_for(
+                            self.read_message(), settle)
+                else:
+                    message, size = await self.read_message()
+            except asyncio.TimeoutError:
+                break
+            if message.msgtype == "PATCH-DOC":
+                sizes.append(size)
+                finished = time.perf_counter()
+            elif message.msgtype == "OK" and \
+                    message.header.get("reqid") == message_id:
+                acknowledged = True
+                finished = finished or time.perf_counter()
+            elif message.msgtype == "ERROR":
+                raise RuntimeError(message.content["text"])
+        return finished - started, sizes
+
+
+def find_sliders(doc_json, titles=None):
+    sliders = [reference for reference in doc_json["roots"]["references"]
+            if reference["type"] == "Slider"]
+    sliders = [slider for slider in sliders
+            if slider["attributes"].get("step", 1) and
+            slider["attributes"].get("start") != slider["attributes"].get("end")]
+    if titles is None:
+        return sliders
+    missing = set(titles) - set(slider["attributes"].get("title")
+            for slider in sliders)
+    if missing:
+        raise LookupError("No slider titled %s" % ", ".join(
+                repr(title) for title in sorted(missing)))
+    return [slider for slider in sliders
+            if slider["attributes"].get("title") in titles]
+
+
+def drag_values(slider, steps):
+    """
+    The values of a drag over the given number of steps of the slider, starting
+    at its current value and turning around at its ends.
+    """
+    attributes = slider["attributes"]
+    start = attributes.get("start", 0)
+    end = attributes.get("end", 1)
+    step = attributes.get("step", 1)
+    value = attributes.get("value", start)
+    direction = 1
+    values = []
+    for _ in range(steps):
+        if not start <= value + direction * step <= end:
+            direction = -direction
+        value = round(value + direction * step, 10)
+        values.append(value)
+    return values
+
+
+async def run_student(base_url, app, arguments, statistics):
+    app_url = base_url + "/" + app
+    autoload_url = (app_url + "/autoload.js?bokeh-autoload-element=1000"
+            "&bokeh-app-path=/" + app +
+            "&bokeh-absolute-url=" + quote(app_url, safe=""))
+    try:
+        started = time.perf_counter()
+        response = await AsyncHTTPClient().fetch(autoload_url,
+                request_timeout=arguments.timeout)
+        session_id = SESSION_ID.search(response.body.decode("utf-8")).group(1)
+        websocket = await websocket_connect(
+                app_url.replace("http", "ws", 1) + "/ws?bokeh-protocol-version="
+                + PROTOCOL_VERSION + "&bokeh-session-id=" + session_id,
+                max_message_size=MAX_MESSAGE_SIZE)
+        # Like a browser, send the fragments of a message without waiting for
+        # the acknowledgement of the previous one (Nagle's algorithm)
+        websocket.protocol.set_nodelay(True)
+        connection = StudentConnection(websocket, arguments.timeout)
+        await connection.read_message()
+        doc_json = await connection.pull_document()
+        statistics.session_latencies.append(time.perf_counter() - started)
+        # Updates scheduled while the document was created
+        await connection.drain(arguments.settle)
+    except Exception as error:
+        statistics.errors["session: " + type(error).__name__] += 1
+        return
+
+    try:
+        sliders = find_sliders(doc_json, SCENARIOS.get(app))
+    except LookupError as error:
+        # A scenario that does not fit the app would measure nothing
+        websocket.close()
+        raise LookupError("%s: %s" % (app, error))
+
+    try:
+        for slider in sliders:
+            for value in drag_values(slider, arguments.steps):
+                round_trip, sizes = await connection.change_value(slider,
+                        value, arguments.settle)
+                statistics.round_trips.append(round_trip)
+                statistics.message_sizes.extend(sizes)
+                statistics.message_sizes.extend(
+                        await connection.drain(arguments.interval))
+    except Exception as error:
+        statistics.errors["callback: " + type(error).__name__] += 1
+    finally:
+        websocket.close()
+
+
+def server_cpu_time(pid):
+    """
+    User and system CPU time (in seconds) of a process, read from /proc.
+    """
+    if pid is None:
+        return None
+    try:
+        with open("/proc/%d/stat" % pid) as stat_file:
+            fields = stat_file.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    # utime and stime are the 14th and 15th field of the stat file
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def run_app(base_url, app, arguments, server_pid):
+    statistics = AppStatistics(app)
+    cpu_before = server_cpu_time(server_pid)
+    started = time.perf_counter()
+
+    async def delayed_student(delay):
+        await asyncio.sleep(delay)
+        await run_student(base_url, app, arguments, statistics)
+
+    await asyncio.gather(*[
+            delayed_student(random.uniform(0, arguments.ramp_up))
+            for _ in range(arguments.students)])
+
+    statistics.duration = time.perf_counter() - started
+    cpu_after = server_cpu_time(server_pid)
+    if cpu_before is not None and cpu_after is not None:
+        statistics.cpu_time = cpu_after - cpu_before
+    return statistics
+
+
+def format_milliseconds(values, percentiles):
+    if not values:
+        return " ".join("%8s" % "-" for _ in percentiles)
+    return " ".join("%8.1f" % (1000 * value)
+            for value in np.percentile(values, percentiles))
+
+
+def print_report(all_statistics, arguments):
+    print()
+    print("%d students per app, %d steps per slider, %.0fms between steps" %
+            (arguments.students, arguments.steps, 1000 * arguments.interval))
+    print()
+    print("%-28s %9s %17s %8s %26s %19s %15s" % ("app", "sessions",
+            "session p50/p95", "changes", "round trip p50/p95/p99",
+            "bytes/msg mean/max", "server cpu"))
+    for statistics in all_statistics:
+        errors = sum(statistics.errors.values())
+        sizes = statistics.message_sizes
+        if statistics.cpu_time is None:
+            cpu = "-"
+        else:
+            cpu = "%.2fs %3.0f%%" % (statistics.cpu_time,
+                    100 * statistics.cpu_time / statistics.duration)
+        print("%-28s %4d/%-4d %17s %8d %26s %19s %15s" % (
+                statistics.app,
+                len(statistics.session_latencies), errors,
+                format_milliseconds(statistics.session_latencies, [50, 95]),
+                len(statistics.round_trips),
+                format_milliseconds(statistics.round_trips, [50, 95, 99]),
+                "%9.0f %9d" % (np.mean(sizes), max(sizes)) if sizes else "-",
+                cpu))
+        for error, count in sorted(statistics.errors.items()):
+            print("    %dx %s" % (count, error))
+    print()
+    print("sessions: created/failed, times in ms")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(apps, port):
+    """
+    Starts a local bokeh server for the apps (from within the plots folder so
+    that the extensions can be imported) and waits until it accepts requests.
+    """
+    command = [sys.executable, "-m", "bokeh", "serve"] + \
+            [app + ".py" for app in apps] + \
+            ["--port", str(port), "--allow-websocket-origin", "*"]
+    server = subprocess.Popen(command, cwd=PLOTS_DIR,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(600):
+        if server.poll() is not None:
+            raise RuntimeError("The bokeh server exited with code %d" %
+                    server.returncode)
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("The bokeh server did not start")
+
+
+async def run(arguments):
+    if arguments.apps:
+        apps = arguments.apps
+    else:
+        apps = sorted(os.path.splitext(os.path.basename(path))[0]
+                for path in glob.glob(os.path.join(PLOTS_DIR, "*.py")))
+
+    server = None
+    if arguments.url:
+        base_url = arguments.url.rstrip("/")
+        server_pid = arguments.server_pid
+    else:
+        port = free_port()
+        server = start_server(apps, port)
+        base_url = "http://127.0.0.1:%d" % port
+        server_pid = server.pid
+
+    try:
+        all_statistics = []
+        for app in apps:
+            print("Testing %s ..." % app, file=sys.stderr)
+            all_statistics.append(
+                    await run_app(base_url, app, arguments, server_pid))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    print_report(all_statistics, arguments)
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(
+            description="Load test of the plot apps with simulated students.")
+    parser.add_argument("apps", nargs="*", metavar="APP",
+            help="names of the apps to test (default: all scripts in plots/)")
+    parser.add_argument("--students", type=int, default=10,
+            help="number of concurrent students per app (default: "
+            "%(default)s)")
+    parser.add_argument("--steps", type=int, default=30,
+            help="number of slider steps per dragged slider (default: "
+            "%(default)s)")
+    parser.add_argument("--interval", type=float, default=0.05,
+            help="seconds between two steps of a drag (default: %(default)s)")
+    parser.add_argument("--ramp-up", type=float, default=1.0,
+            help="the students start within this many seconds (default: "
+            "%(default)s)")
+    parser.add_argument("--settle", type=float, default=0.5,
+            help="seconds to wait for changes that arrive after the server "
+            "acknowledged a slider change (default: %(default)s)")
+    parser.add_argument("--timeout", type=float, default=60.0,
+            help="seconds to wait for the server before a session or a "
+            "slider change is counted as failed (default: %(default)s)")
+    parser.add_argument("--url",
+            help="test an already running server, e.g. http://127.0.0.1:9001")
+    parser.add_argument("--server-pid", type=int,
+            help="process id of the server given by --url to measure its "
+            "CPU time")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_arguments()))
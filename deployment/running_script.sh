@@ -1,5 +1,8 @@
 # Num-Procs 0 will bokeh look up the number of cores available and multithread appropriately
-nohup bokeh serve /var/www/expmath/plots/*.py \
+# Only the plots enabled in website/__init__.py are served, each one is loaded on
+# its first request
+cd /var/www/expmath/plots && nohup python3 -m extensions.server \
+    --topics /var/www/expmath/website/__init__.py \
     --num-procs 0 \
     --port 9001 \
     --address=0.0.0.0 \
@@ -6,6 +6,8 @@ from bokeh.models import ColumnDataSource
 from bokeh.models.widgets import Slider, RadioButtonGroup
 from bokeh.plotting import figure
 
+from extensions.sampling import sample_function
+
 # Geometry constants of the plot
 HEIGHT = 400
 WIDTH_PLOT = 600
@@ -43,16 +45,9 @@ functions = [FUNC_1, FUNC_2, FUNC_3]
 
 
 def calculate_new_function_value_pairs(function_active):
-    if function_active == 1:
-        x_left = np.linspace(LEFT, - 0.0001, 100)
-        x_right = np.linspace(0.0001, RIGHT, 100)
-        x = np.concatenate([x_left, x_right])
-    else:
-        x = np.linspace(LEFT, RIGHT, 200)
-
-    y = functions[function_active](x)
-
-    return x, y
+    # The sampler refines around the kinks on its own
+    return sample_function(functions[function_active], LEFT, RIGHT,
+            [LEFT, RIGHT], [BOTTOM, TOP], WIDTH_PLOT, HEIGHT)
     
 def calculate_new_secant_value_pairs(function_active, point_location, spacing):
     x_positions = np.array([point_location - (spacing + EPSILON),
@@ -1,13 +1,21 @@
+import logging
 import queue
 import numpy as np
 
 from bokeh.layouts import Row, WidgetBox
 from bokeh.io import curdoc
-from bokeh.models import ColumnDataSource
+from bokeh.models import ColumnDataSource, CustomJS, Span
 from bokeh.models.widgets import Slider, Dropdown, Toggle
 from bokeh.plotting import Figure
 
 from extensions.Latex import LatexLabel
+from extensions.cache import memoize
+from extensions.incremental import update_source
+from extensions.jsexpr import JsCompileError, compile_table
+from extensions.payload import screen_array
+from extensions.sampling import SAMPLER_CODE
+from extensions.viewport import DEFAULT_DELAY, VIEWPORT_CODE, Viewport, \
+        sample_window
 
 # Some functions are not defined for negative values or zero. Numpy will give
 # out an warning. However, we simply don't want to draw this value. Therefore,
@@ -26,18 +34,23 @@ change parameter to them. The user can select between all major function groups:
     Inverse Trigonometrics
     Inverse Hyperbolics
     Specials (Absolute, Heaviside ...)
+
+The definitions of the functions are compiled to javascript (see
+extensions/jsexpr.py), so that the browser recalculates the value pairs and the
+Latex label itself whenever a widget changes. The python callbacks are only
+used if the compilation fails.
+
+The curves are calculated over the visible part of the plot (see
+extensions/viewport.py) and again whenever the user pans or zooms.
 """
 
+log = logging.getLogger(__name__)
+
 # Constants for the geometry of the plot, similar to other plots
 HEIGHT = 400
 WIDTH_PLOT = 600
 WIDTH_TOTAL = 800
 
-# Left-most and right-most points to still contain value pairs. They form the
-# interval over which the function is drawn.
-X_LEFT = -10
-X_RIGHT = 10
-
 # Initial vieport of the plot. The plain X by Y that the user sees intially.
 X_RANGE_INITIAL = [-5, 5]
 Y_RANGE_INTIAL = [-4, 4]
@@ -415,21 +428,22 @@ functions = {
     }
 
 
-def update_plot(function_active, a, b, c, d):
-    if function_active == "absolute":
-        x_left_of_c = np.linspace(X_LEFT, c - 0.0001, 200)
-        x_right_of_c = np.linspace(c + 0.0001, X_RIGHT, 200)
-        x = np.concatenate([x_left_of_c, np.array([c, ]), x_right_of_c])
-    elif function_active == "heaviside":
-        x_left_of_b = np.linspace(X_LEFT, b - 0.0001, 200)
-        x_right_of_b = np.linspace(b + 0.0001, X_RIGHT, 200)
-        x = np.concatenate([x_left_of_b, x_right_of_b])
-    else:
-        x = np.linspace(X_LEFT, X_RIGHT, 400)
+# The value pairs only depend on the arguments, therefore all sessions can share
+# them
+@memoize()
+def update_plot(function_active, a, b, c, d, window):
+    # The sampler refines at kinks (absolute) and interrupts the line at jumps
+    # (heaviside) and poles (tangent)
+    definition = functions[function_active]["definition"]
+    x, y = sample_window(lambda x: definition(a, b, c, d, x), window)
+
+    return screen_array(x), screen_array(y)
 
-    y = functions[function_active]["definition"](a, b, c, d, x)
 
-    return x, y
+# The compiled javascript is the same for all sessions
+@memoize()
+def compile_functions():
+    return compile_table(functions)
 
 
 def update_latex(function_active, a, b, c, d):
@@ -464,8 +478,11 @@ plot.xaxis[0].ticker.desired_num_ticks =\
         2*plot.yaxis[0].ticker.desired_num_ticks
 
 # Indicate the x-axis and y_axis by thin black lines
-plot.line(x=[X_LEFT, X_RIGHT], y=[0, 0], color="black")
-plot.line(x=[0, 0], y=[X_LEFT, X_RIGHT], color="black")
+plot.add_layout(Span(location=0, dimension="width", line_color="black"))
+plot.add_layout(Span(location=0, dimension="height", line_color="black"))
+
+# The part of the plot the curves are calculated for
+viewport = Viewport(plot)
 
 # The first function is plotted right away, the second will be visible, once the
 # toggle is activated
@@ -503,11 +520,12 @@ def update_all():
     the the Latex Label.
     """
     x, y = update_plot(function_selector.value, parameter_a.value,
-            parameter_b.value, parameter_c.value, parameter_d.value)
+            parameter_b.value, parameter_c.value, parameter_d.value,
+            viewport.current)
     if not second_toggle.active:
-        data_source.data = {"x": x, "y": y}
+        update_source(data_source, {"x": x, "y": y})
     else:
-        data_source_second.data = {"x": x, "y": y}
+        update_source(data_source_second, {"x": x, "y": y})
 
     text_for_label = update_latex(function_selector.value,
             parameter_a.value, parameter_b.value, parameter_c.value,
@@ -520,6 +538,21 @@ def update_all():
         function_latex_second.text = text_for_label_second
 
 
+def update_viewport(window):
+    """
+    Recalculates both functions for the new part of the plot, the one not
+    controlled by the widgets with its saved parameters.
+    """
+    update_all()
+
+    other_source = data_source if second_toggle.active else data_source_second
+    if len(other_source.data["x"]) > 0:
+        other = saved_parameters_from_other_function.queue[0]
+        x, y = update_plot(other["function_active"], other["a"], other["b"],
+                other["c"], other["d"], window)
+        update_source(other_source, {"x": x, "y": y})
+
+
 def update_slider(attr, old, new):
     update_all()
 
@@ -572,16 +605,149 @@ def toggle_callback(source):
     update_all()
 
 
+# The same routines as above running in the browser. The value pairs are changed
+# in place followed by an emit, so that they are not sent back to the server.
+# The curve is sampled like in update_plot. Pans and zooms are debounced, every
+# change of the ranges cancels the pending recalculation. $functions is replaced
+# by the compiled functions (see compile_functions).
+CLIENT_CODE = """
+    var functions = $functions;
+    """ + SAMPLER_CODE + VIEWPORT_CODE + """
+
+    function update_latex(function_active, values) {
+        var index = 0;
+        return templates[function_active].replace(/%1\\.2f/g, function () {
+            return values[index++].toFixed(2);
+        });
+    }
+
+    // The window each source was last calculated for
+    var drawn = window._expmath_drawn = window._expmath_drawn || {};
+
+    function draw(source, parameters) {
+        var view = viewport_window(x_range.start, x_range.end, y_range.start,
+            y_range.end, width, height);
+        var definition = functions[parameters["function_active"]];
+        var a = parameters["a"], b = parameters["b"], c = parameters["c"],
+            d = parameters["d"];
+        var sampled = sample_function(function (x) {
+            return definition(a, b, c, d, x);
+        }, view.x_left, view.x_right, [view.x_left, view.x_right],
+            [view.y_bottom, view.y_top], view.width, view.height);
+        source.data["x"] = sampled.x;
+        source.data["y"] = sampled.y;
+        source.change.emit();
+        drawn[source.id] = JSON.stringify(view);
+    }
+
+    function current_parameters() {
+        return {
+            "function_active": selector.value,
+            "a": sliders[0].value,
+            "b": sliders[1].value,
+            "c": sliders[2].value,
+            "d": sliders[3].value,
+        };
+    }
+
+    function update_viewport() {
+        var view = JSON.stringify(viewport_window(x_range.start, x_range.end,
+            y_range.start, y_range.end, width, height));
+        var saved = (window._expmath_saved || {})[toggle.id];
+        var active = toggle.active ? source_second : source_first;
+        var other = toggle.active ? source_first : source_second;
+        if (drawn[active.id] !== view) {
+            draw(active, current_parameters());
+        }
+        if (saved && other.data["x"].length > 0 && drawn[other.id] !== view) {
+            draw(other, saved);
+        }
+    }
+
+    function update_all() {
+        var parameters = current_parameters();
+        var text = update_latex(parameters["function_active"], [
+            parameters["a"], parameters["b"], parameters["c"],
+            parameters["d"]]);
+
+        draw(toggle.active ? source_second : source_first, parameters);
+        if (toggle.active) {
+            latex_second.text = text.replace("f(x)", "g(x)");
+        } else {
+            latex_first.text = text;
+        }
+    }
+
+    if (cb_obj === x_range || cb_obj === y_range) {
+        var timers = window._expmath_zoom = window._expmath_zoom || {};
+        clearTimeout(timers[toggle.id]);
+        timers[toggle.id] = setTimeout(update_viewport, delay);
+        return;
+    }
+    if (cb_obj === selector) {
+        // Reset the sliders to the defaults of the selected function
+        var new_defaults = defaults[selector.value];
+        ["a", "b", "c", "d"].forEach(function (name, index) {
+            sliders[index].value = new_defaults[name];
+        });
+    } else if (cb_obj === toggle) {
+        // Swap the widget values with the ones of the other function
+        var saved = window._expmath_saved = window._expmath_saved || {};
+        var previous = saved[toggle.id] || initial_saved;
+        saved[toggle.id] = current_parameters();
+        selector.value = previous["function_active"];
+        ["a", "b", "c", "d"].forEach(function (name, index) {
+            sliders[index].value = previous[name];
+        });
+    }
+    update_all();
+    """
+
+
 # Call the callback function in advance to populate the plot
 update_all()
 
 # Connect the callbacks with the corresponding wigets
-for slider in parameter_sliders:
-    slider.on_change("value", update_slider)
-
-function_selector.on_change("value", update_dropdown)
-
-second_toggle.on_click(toggle_callback)
+try:
+    client_callback = CustomJS(args={
+            "selector": function_selector,
+            "sliders": list(parameter_sliders),
+            "toggle": second_toggle,
+            "source_first": data_source,
+            "source_second": data_source_second,
+            "latex_first": function_latex,
+            "latex_second": function_latex_second,
+            "templates": {name: function["latex"]
+                for name, function in functions.items()},
+            "defaults": {name: function["defaults"]
+                for name, function in functions.items()},
+            "initial_saved": saved_parameters_from_other_function.queue[0],
+            "x_range": plot.x_range,
+            "y_range": plot.y_range,
+            "delay": DEFAULT_DELAY,
+            "width": WIDTH_PLOT,
+            "height": HEIGHT,
+            },
+            code=CLIENT_CODE.replace("$functions", compile_functions()))
+
+    for slider in parameter_sliders:
+        slider.js_on_change("value", client_callback)
+    function_selector.js_on_change("value", client_callback)
+    second_toggle.js_on_click(client_callback)
+    for plot_range in (plot.x_range, plot.y_range):
+        plot_range.js_on_change("start", client_callback)
+        plot_range.js_on_change("end", client_callback)
+except JsCompileError as error:
+    log.warning("Using the python callbacks: %s", error)
+
+    for slider in parameter_sliders:
+        slider.on_change("value", update_slider)
+
+    function_selector.on_change("value", update_dropdown)
+
+    second_toggle.on_click(toggle_callback)
+
+    viewport.on_change(update_viewport)
 
 
 # Assemble the plot
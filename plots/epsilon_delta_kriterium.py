@@ -6,6 +6,8 @@ from bokeh.models import ColumnDataSource, Band
 from bokeh.models.widgets import Slider, RadioButtonGroup
 from bokeh.plotting import Figure
 
+from extensions.sampling import sample_function
+
 """
 This plot lets the user visually explore the Epsilon-Delta-criterium on the
 continuity property of functions.
@@ -51,44 +53,17 @@ Y_TOP = VIEWPORT_Y[1] + 0.5
 
 # Quadratic polynomial
 def FUNC_1(x):
-    y = 0.5 * x**2
-    xs = [x, ]
-    ys = [y, ]
-    return xs, ys
+    return 0.5 * x**2
 
 
 # Absolute function
 def FUNC_2(x):
-    y = np.absolute(x)
-    xs = [x, ]
-    ys = [y, ]
-    return xs, ys
+    return np.absolute(x)
 
 
 # Piecewise linear with jump
 def FUNC_3(x):
-    # Catch all 0-dimensional scalars
-    if isinstance(x, (int, float)):
-        if x < 1:
-            y = x + 0.5
-        else:
-            y = 2.5*x
-
-        xs = [x, ]
-        ys = [y, ]
-        return xs, ys
-    else:
-        xs = np.split(x, [np.where(x<1)[0][-1], ])
-        # Make sure that the line properly jumps without creating
-        # a undefined interval
-        xs[0][-1] = 1
-        xs[1][0] = 1
-
-        y_left = xs[0] + 0.5
-        y_right = 2.5 * xs[1]
-        
-        ys = [y_left, y_right]
-        return xs, ys
+    return np.where(x < 1, x + 0.5, 2.5 * x)
 
 
 functions = [FUNC_1, FUNC_2, FUNC_3, ]
@@ -96,21 +71,13 @@ function_names = ["Funktion 1", "Funktion 2", "Funktion 3", ]
 
 
 def calculate_new_value_pairs(function_active):
-    if function_active == 1:
-        x_left = np.linspace(X_LEFT, - 0.0001, 50)
-        x_right = np.linspace(0.0001, X_RIGHT, 50)
-        x = np.concatenate([x_left, np.array([0, ]), x_right])
-    else:
-        x = np.linspace(X_LEFT, X_RIGHT, 100)
-
-    xs, ys = functions[function_active](x)
-
-    return xs, ys
+    # The sampler interrupts the line at the jump of the third function
+    return sample_function(functions[function_active], X_LEFT, X_RIGHT,
+            VIEWPORT_X, VIEWPORT_Y, WIDTH_PLOT, HEIGHT)
 
 
 def update_horizontal_tunnel(function_active, position, epsilon):
-    xs, ys = functions[function_active](position)
-    y_position = ys[0]
+    y_position = float(functions[function_active](position))
     x = [X_LEFT, X_RIGHT]
     y_lower = [y_position - epsilon, y_position - epsilon]
     y_upper = [y_position + epsilon, y_position + epsilon]
@@ -148,8 +115,8 @@ plot.toolbar.active_drag = None  # For touchscreen users helpful
 plot.line(x=[X_LEFT, X_RIGHT], y=[0, 0], color="black")
 plot.line(x=[0, 0], y=[Y_BOTTOM, Y_TOP], color="black")
 
-# Use multi-line instead of single line to get proper jumps
-plot.multi_line(xs="xs", ys="ys", source=function_value_pairs, color="blue",
+# The value pairs contain a NaN at jumps, where the line is interrupted
+plot.line(x="x", y="y", source=function_value_pairs, color="blue",
         line_width=LINE_WIDTH)
 
 horizontal_band = Band(base="base", lower="y_lower", upper="y_upper",
@@ -202,8 +169,8 @@ def update_position_slider(attr, old, new):
     update_delta_slider(0, 0, 0)
 
 def update_selection(source):
-    xs, ys = calculate_new_value_pairs(function_selector.active)
-    function_value_pairs.data = {"xs": xs, "ys": ys}
+    x, y = calculate_new_value_pairs(function_selector.active)
+    function_value_pairs.data = {"x": x, "y": y}
 
     update_position_slider(0, 0, 0)
 
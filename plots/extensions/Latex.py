@@ -3,6 +3,12 @@ import os
 from bokeh.models import Label
 from bokeh.util.compiler import TypeScript
 
+from extensions.prebuilt import use_prebuilt_bundle
+
+# The TypeScript implementation is only compiled if no prebuilt bundle is
+# available (see extensions/prebuilt.py)
+use_prebuilt_bundle()
+
 class LatexLabel(Label):
     """A subclass of the Bokeh built-in `Label` that supports rendering
     LaTex using the KaTex typesetting library.
@@ -0,0 +1,148 @@
+import numpy as np
+
+from bokeh.models import ColumnDataSource, CustomJS
+
+"""
+Client-side playback of precomputed animation frames.
+
+Instead of registering a periodic callback on the server that advances the time
+slider every 100ms (and therefore recalculates and resends the whole
+ColumnDataSource on every tick for every connected user), all frames for the
+current range of the time slider are calculated in one vectorized pass. They are
+sent to the browser once and played back there by a small javascript timer. The
+server only has to recalculate the frames whenever a parameter changes while the
+animation is running.
+
+The frames are stored flattened (frame after frame) in a single column of a
+separate ColumnDataSource. The javascript player copies the slice of the current
+frame into the "y" column of the plotted ColumnDataSource. Its "x" column (and
+therefore the number of points per frame) has to stay the same for all frames.
+For an image, the frames are whole images of the same shape as the one plotted,
+the slice replaces it.
+
+Several players can be attached to the same toggle (e.g., one per mode of an
+app). A player whose frames are empty stays idle and leaves the time slider
+alone when it is stopped.
+"""
+
+# The interval (in milliseconds) between two frames, similar to the period that
+# was used for the server-side periodic callbacks
+FRAME_INTERVAL = 100
+
+# The javascript timer has to be stored somewhere so that it can be stopped by
+# the next click on the toggle. We use a global dictionary keyed by the id of the
+# plotted ColumnDataSource, so that several animations can run side by side.
+_PLAYER_CODE = """
+    var players = window._expmath_players = window._expmath_players || {};
+    var key = data_source.id;
+
+    function frame_of_time(value) {
+        return Math.round((value - time.start) / time.step);
+    }
+
+    if (players[key] != null) {
+        clearInterval(players[key].timer);
+        // Only report the time the animation stopped at back to the server.
+        // This is a single message that makes the plot consistent with the
+        // slider again.
+        var stopped = players[key];
+        delete players[key];
+        if (stopped.played) {
+            time.value = Math.min(time.start + stopped.frame * time.step,
+                    time.end);
+        }
+    }
+
+    if (!toggle.active) {
+        return;
+    }
+
+    var player = {frame: frame_of_time(time.value), played: false,
+            timer: null};
+    player.timer = setInterval(function() {
+        // Always read the frames anew, the server replaces them whenever a
+        // parameter changes while the animation is running
+        var frames = frame_source.data[column];
+        var current = data_source.data[y];
+        var n_points = image ? (current.length ? current[0].length : 0) :
+                data_source.data[x].length;
+        if (n_points == 0 || frames.length < n_points) {
+            return;
+        }
+        var n_frames = Math.floor(frames.length / n_points);
+
+        player.frame += 1;
+        if (player.frame >= n_frames) {
+            player.frame = 0;
+        }
+        player.played = true;
+
+        // Changing the data in place followed by an emit only updates the
+        // client, nothing is sent back to the server. An image keeps its shape
+        // (stored with the data source), only its values are replaced.
+        var frame = frames.slice(player.frame * n_points,
+                (player.frame + 1) * n_points);
+        data_source.data[y] = image ? [frame] : frame;
+        data_source.change.emit();
+    }, interval);
+    players[key] = player;
+    """
+
+
+def frame_times(time_slider):
+    """
+    All points in time the time slider can reach, i.e., the times the frames
+    are calculated for. The result is a column vector so that it broadcasts
+    against the spatial grid of the compute functions, which then return one
+    frame per row.
+    """
+    number_of_frames = int(round((time_slider.end - time_slider.start) /
+            time_slider.step)) + 1
+    times = time_slider.start + time_slider.step * np.arange(number_of_frames)
+    return times[:, np.newaxis]
+
+
+def create_frame_source():
+    """
+    The ColumnDataSource holding the flattened frames. It stays empty as long as
+    the animation is not running.
+    """
+    return ColumnDataSource(data={"frames": []})
+
+
+def update_frames(frame_source, frames):
+    """
+    Sends all frames to the client at once. Frames is a two-dimensional array
+    with one frame per row (or None to clear the frames once the animation is
+    stopped).
+    """
+    if frames is None:
+        frame_source.data = {"frames": []}
+    else:
+        frame_source.data = {"frames": np.ravel(frames)}
+
+
+def attach_client_animation(animation_toggle, time_slider, data_source,
+        frame_source, x="x", y="y", column="frames", interval=FRAME_INTERVAL,
+        image=False):
+    """
+    Connects the animation toggle with the javascript player. The python side of
+    the app still has to (re-)calculate the frames by calling update_frames
+    whenever the toggle is activated or a parameter changes during the
+    animation.
+    With image, the frames are played into the (single) image in the column y of
+    the data source instead of a line.
+    """
+    player = CustomJS(args={
+            "toggle": animation_toggle,
+            "time": time_slider,
+            "data_source": data_source,
+            "frame_source": frame_source,
+            "x": x,
+            "y": y,
+            "column": column,
+            "interval": interval,
+            "image": image,
+            },
+            code=_PLAYER_CODE)
+    animation_toggle.js_on_click(player)
@@ -0,0 +1,65 @@
+import io
+import json
+import os
+import sys
+
+import bokeh
+from bokeh.util.compiler import CustomModel, nodejs_compile
+
+from extensions.Latex import LatexLabel
+from extensions.surface3d import Surface3d
+from extensions.vector3d import Vector3d
+from extensions.prebuilt import DIST_DIR, bundle_path, implementation_hash
+
+"""
+Build step compiling the TypeScript implementations of all custom extensions
+into a versioned bundle (see extensions/prebuilt.py). This is the only place
+nodejs is needed. Run it from within the plots folder whenever a .ts file or the
+bokeh version changes:
+
+    python3 -m extensions.build
+"""
+
+# All models with a custom TypeScript implementation
+CUSTOM_MODELS = [LatexLabel, Surface3d, Vector3d]
+
+
+def compile_models(models):
+    compiled_models = {}
+    for cls in models:
+        model = CustomModel(cls)
+        implementation = model.implementation
+        print("Compiling %s" % model.full_name)
+        compiled = nodejs_compile(implementation.code, lang=implementation.lang,
+                file=implementation.file)
+        if "error" in compiled:
+            raise RuntimeError("Compilation of %s failed:\n%s" %
+                    (model.full_name, compiled["error"]))
+        compiled_models[model.full_name] = {
+                "hash": implementation_hash(implementation.code),
+                "code": compiled["code"],
+                "deps": compiled["deps"],
+                }
+    return compiled_models
+
+
+def build(path=None):
+    path = path or bundle_path()
+    models = compile_models(CUSTOM_MODELS)
+    if not os.path.isdir(DIST_DIR):
+        os.makedirs(DIST_DIR)
+    with io.open(path, "w", encoding="utf-8") as bundle_file:
+        bundle_file.write(json.dumps({
+                "bokeh_version": bokeh.__version__,
+                "models": models,
+                }, indent=1, sort_keys=True))
+    print("Wrote %d models to %s" % (len(models), path))
+    return path
+
+
+if __name__ == "__main__":
+    try:
+        build()
+    except RuntimeError as error:
+        print(error, file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,233 @@
+import functools
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+"""
+Process-wide memoization of the functions calculating the value pairs of the
+plots.
+
+The sliders move in discrete steps (mostly 0.1) and during a lecture a whole
+class moves through the same values. Therefore, the result of a calculation is
+stored in a bounded LRU cache keyed by the quantized tuple of arguments.
+
+The bokeh server executes the script of an app anew for every session, i.e.,
+every session has its own copy of the decorated function. Hence, the caches are
+not stored in the decorated function but in this module (which is imported only
+once per process) and are looked up by the file and the name of the function.
+This way all sessions of an app share one cache.
+
+If several sessions (running in different threads) request the same arguments
+at the same time, only the first one calculates the value pairs. The others wait
+for this calculation and receive the same result.
+
+Cached results are shared between sessions and must be treated as immutable.
+Numpy arrays in the results are therefore set to read-only. Callers that want to
+modify a result have to copy it first.
+"""
+
+# Number of results stored per function before the least recently used one is
+# dropped
+DEFAULT_MAXSIZE = 256
+
+# Slider values are rounded to this number of decimals before they are used as a
+# key. This merges values like 0.30000000000000004 and 0.3 that arise from
+# stepping the slider on the client.
+DEFAULT_DECIMALS = 6
+
+CacheInfo = namedtuple("CacheInfo",
+        ["hits", "misses", "merged", "maxsize", "currsize"])
+
+# All caches of this process by their name, e.g.
+# "einfache_funktionen.py:update_plot"
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def _function_name(function):
+    """
+    Name of a function that is the same for all sessions of an app (the module
+    name of a bokeh app script is random for every session).
+    """
+    code = getattr(function, "__code__", None)
+    if code is None:
+        return getattr(function, "__qualname__", repr(function))
+    return os.path.basename(code.co_filename) + ":" + function.__qualname__
+
+
+def quantize(value, decimals=DEFAULT_DECIMALS):
+    """
+    Turns the arguments of a call into a hashable key. Floats are rounded, dicts
+    (e.g., the parameters of the phase plot) become sorted tuples, functions are
+    identified by their file and name and numpy arrays by their content.
+    """
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return round(float(value), decimals)
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (tuple, list)):
+        return tuple(quantize(ele, decimals) for ele in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, quantize(ele, decimals))
+                for key, ele in value.items()))
+    if isinstance(value, np.ndarray):
+        return ("ndarray", value.shape, value.dtype.str,
+                np.round(value, decimals).tobytes())
+    if callable(value):
+        # Lambdas all share the same name, the line number tells them apart
+        code = getattr(value, "__code__", None)
+        return ("callable", _function_name(value),
+                code.co_firstlineno if code is not None else None)
+    # Everything else has to be hashable by itself
+    hash(value)
+    return value
+
+
+def freeze(result):
+    """
+    Sets all numpy arrays within the result to read-only so that the shared
+    result can not be changed by one session for all the others.
+    """
+    if isinstance(result, np.ndarray):
+        result.flags.writeable = False
+    elif isinstance(result, (tuple, list)):
+        for ele in result:
+            freeze(ele)
+    elif isinstance(result, dict):
+        for ele in result.values():
+            freeze(ele)
+    return result
+
+
+class _InFlight(object):
+    """
+    A calculation that is currently running. Other threads requesting the same
+    key wait for its event.
+    """
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Cache(object):
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.merged = 0
+
+    def get_or_compute(self, key, compute):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            pending = self.in_flight.get(key)
+            if pending is not None:
+                self.merged += 1
+                is_owner = False
+            else:
+                pending = self.in_flight[key] = _InFlight()
+                self.misses += 1
+                is_owner = True
+
+        if not is_owner:
+            pending.event.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.result
+
+        try:
+            pending.result = freeze(compute())
+        except BaseException as error:
+            pending.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+                if pending.error is None:
+                    self.entries[key] = pending.result
+                    while len(self.entries) > self.maxsize:
+                        self.entries.popitem(last=False)
+            pending.event.set()
+
+        return pending.result
+
+    def info(self):
+        with self.lock:
+            return CacheInfo(self.hits, self.misses, self.merged, self.maxsize,
+                    len(self.entries))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.merged = 0
+
+
+def _get_cache(name, maxsize):
+    with _caches_lock:
+        cache = _caches.get(name)
+        if cache is None:
+            cache = _caches[name] = _Cache(name, maxsize)
+        return cache
+
+
+def memoize(maxsize=DEFAULT_MAXSIZE, decimals=DEFAULT_DECIMALS):
+    """
+    Decorator caching the results of a (pure) function calculating value pairs.
+    Similar to functools.lru_cache, the decorated function provides
+    cache_info() and cache_clear().
+
+        @memoize()
+        def update_plot(function_active, a, b, c, d):
+            ...
+    """
+    def decorator(function):
+        cache = _get_cache(_function_name(function), maxsize)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            key = (quantize(args, decimals),
+                    quantize(sorted(kwargs.items()), decimals))
+            return cache.get_or_compute(key,
+                    lambda: function(*args, **kwargs))
+
+        wrapper.cache_info = cache.info
+        wrapper.cache_clear = cache.clear
+        return wrapper
+
+    return decorator
+
+
+def cache_statistics():
+    """
+    The hit/miss counters of all caches in this process by their name.
+    """
+    with _caches_lock:
+        caches = list(_caches.values())
+    return {cache.name: cache.info() for cache in caches}
+
+
+def drop_caches(filename):
+    """
+    Removes the caches of all functions defined in the given file (e.g., once
+    the app of this file has been unloaded by the server).
+    """
+    prefix = filename + ":"
+    with _caches_lock:
+        for name in [name for name in _caches if name.startswith(prefix)]:
+            _caches[name].clear()
+            del _caches[name]
@@ -0,0 +1,98 @@
+import functools
+import time
+
+from bokeh.io import curdoc
+
+"""
+Coalescing of widget callbacks.
+
+Dragging a slider sends a new value for every step the slider passes, and every
+value triggers the python callback of the app. If a callback takes longer than
+the time between two steps, the values queue up on the server and the plot lags
+behind the slider, while most of the computed values are outdated by the time
+they arrive in the browser.
+
+A coalesced callback does not run for every change. A change after a quiet
+period is run right away (on the next tick of the document's IOLoop, so that
+other changes made by the same callback, e.g., resetting several sliders, are
+merged into it). Changes arriving within a short delay after a run only replace
+the pending value, which is run once the delay has passed. Hence a single change
+is computed without waiting, while during a drag only the values the user
+actually stops at (or passes at the rate of the delay) are computed, and the
+plot always ends up with the final value.
+
+All callbacks of a session run on the IOLoop with the lock of its document, so
+there is at most one computation per session at a time.
+
+    update = coalesce(parameter_sliders_update)
+    for parameter_slider in (slider_1, slider_2):
+        parameter_slider.on_change("value", update)
+
+Connecting several widgets to the same coalesced callback (instead of coalescing
+the callback once per widget) also merges the changes of different widgets,
+e.g., when all sliders are reset at once.
+"""
+
+# Minimum milliseconds between the end of a run and the next one
+DEFAULT_DELAY = 50
+
+
+def coalesce(callback, delay=DEFAULT_DELAY):
+    """
+    Wraps a property callback (attr, old, new) so that a burst of changes only
+    runs it for the first and the latest value. The old value passed on is the
+    one before the first change that was not run yet.
+    """
+    # The pending arguments, whether a run is already scheduled and when the
+    # last run ended. Every session executes the script of the app anew, so
+    # this state is per session.
+    state = {"pending": None, "scheduled": False, "last_run": -float("inf")}
+
+    @functools.wraps(callback)
+    def run_latest():
+        attr, old, new = state["pending"]
+        state["pending"] = None
+        state["scheduled"] = False
+        try:
+            callback(attr, old, new)
+        finally:
+            state["last_run"] = time.monotonic()
+
+    @functools.wraps(callback)
+    def coalesced(attr, old, new):
+        document = curdoc()
+        if document.session_context is None:
+            # Not served by a bokeh server (e.g., the script is run directly),
+            # there is no IOLoop that would run the scheduled callback
+            callback(attr, old, new)
+            return
+
+        if state["pending"] is not None:
+            old = state["pending"][1]
+        state["pending"] = (attr, old, new)
+        if not state["scheduled"]:
+            state["scheduled"] = True
+            wait = state["last_run"] + delay / 1000 - time.monotonic()
+            if wait <= 0:
+                document.add_next_tick_callback(run_latest)
+            else:
+                document.add_timeout_callback(run_latest, 1000 * wait)
+
+    return coalesced
+
+
+def on_slider_change(sliders, callback, throttled=False, delay=DEFAULT_DELAY):
+    """
+    Connects one coalesced callback to the value of all the sliders.
+
+    With throttled the callback is connected to value_throttled instead, i.e.,
+    it only runs when the user releases the slider. This is meant for heavy
+    computations that would not keep up with a drag at all. Note that changes of
+    the value made on the server (e.g., by resetting the slider) do not trigger
+    value_throttled.
+    """
+    attr = "value_throttled" if throttled else "value"
+    coalesced = coalesce(callback, delay)
+    for slider in sliders:
+        slider.on_change(attr, coalesced)
+    return coalesced
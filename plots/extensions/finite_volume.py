@@ -0,0 +1,165 @@
+import logging
+from collections import namedtuple
+
+import numpy as np
+
+"""
+Numerical solution of scalar conservation laws u_t + f(u, x)_x = 0.
+
+The solution is approximated by the averages of u over the cells of a uniform
+grid. In every step, each cell exchanges the numerical fluxes with its neighbours
+(a conservative finite-volume method of first order). The numerical flux at an
+interface is the one of Godunov's method, i.e., the flux of the exact solution
+of the Riemann problem between the two cells. For a flux that is convex in u it
+is
+    min f(u) over [u_left, u_right]   if u_left <= u_right,
+    max f(u) over [u_right, u_left]   otherwise,
+which is attained at the ends of the interval or at the sonic point (where
+f'(u) = 0). For a linear flux this is plain upwinding. Shocks move at the right
+speed and rarefaction waves open up without special treatment of the initial
+condition.
+
+The step size follows the CFL condition from the largest wave speed |f'(u)|.
+The steps are shortened to end exactly at the requested times, the solution at
+these times is returned as frames (one per row), e.g., all values of a time
+slider at once:
+
+    flux = Flux(lambda u, x: u**2 / 2, lambda u, x: u, 0.)
+    x, frames = solve(flux, initial, -5., 5., 400, np.linspace(0, 10, 101))
+
+The grid is extended beyond the interval by the distance waves can travel into
+it until the last time, so that the boundaries (the values of the outermost
+cells are continued) do not disturb the solution within the interval.
+
+The work of a solution is the number of steps (which grows with the wave speed
+and the number of cells) times the cost of a step. Fast waves over a long time
+would take seconds, blocking all sessions of the server. The number of cells is
+therefore halved until the estimated work is within MAX_WORK (about 0.3 s), the
+solution then has fewer cells than requested. If even the coarsest grid would
+take more than MAX_STEPS steps, the solution stops there: the frames of the
+times not reached are NaN (hidden by bokeh) and a warning is logged.
+"""
+
+log = logging.getLogger(__name__)
+
+# The fraction of a cell the fastest wave travels per step
+CFL = 0.9
+
+# Upper bound on the number of cells of the extended grid and on the number of
+# steps, e.g., for very fast waves
+MAX_CELLS = 4000
+MAX_STEPS = 100000
+
+# Upper bound on the work of a solution, the number of steps times the number of
+# cells plus STEP_COST (the overhead of a step costs about as much as updating
+# that many cells), and the number of cells the grid is not coarsened below
+MAX_WORK = 3e7
+STEP_COST = 5000
+MIN_CELLS = 50
+
+# A flux f(u, x) convex in u, its derivative by u (the wave speed) and the sonic
+# point (u with f'(u) = 0, None for a flux linear in u). All functions are
+# called with arrays.
+Flux = namedtuple("Flux", ["flux", "speed", "sonic"])
+
+
+def godunov_flux(flux, u_left, u_right, x):
+    """
+    The numerical fluxes at the interfaces x between the cells with the values
+    u_left and u_right.
+    """
+    f_left = flux.flux(u_left, x)
+    f_right = flux.flux(u_right, x)
+    lowest = np.minimum(f_left, f_right)
+    if flux.sonic is not None:
+        lowest = np.minimum(lowest, flux.flux(np.clip(flux.sonic,
+                np.minimum(u_left, u_right), np.maximum(u_left, u_right)), x))
+    return np.where(u_left <= u_right, lowest, np.maximum(f_left, f_right))
+
+
+def _value_range(initial, left, right):
+    values = initial(np.linspace(left, right, 100))
+    return np.array([np.min(values), np.max(values)])
+
+
+def _margins(flux, u, left, right, duration):
+    """
+    How far waves can travel into the interval from the left and from the right
+    (estimated with the range u of the initial values within the interval).
+    """
+    into_right = np.max(flux.speed(u, np.full(2, left)))
+    into_left = -np.min(flux.speed(u, np.full(2, right)))
+    return max(into_right, 0.) * duration, max(into_left, 0.) * duration
+
+
+def _grid(flux, u, left, right, cells, duration, cfl):
+    """
+    The number of cells within the interval and of the extra cells on either
+    side, coarsened until the estimated work is within MAX_WORK.
+    """
+    margin_left, margin_right = _margins(flux, u, left, right, duration)
+    while True:
+        dx = (right - left) / cells
+        # Whole cells on either side, bounded by the size of the grid
+        extra = max(MAX_CELLS - cells, 0)
+        cells_left = int(np.ceil(margin_left / dx)) + 1
+        cells_right = int(np.ceil(margin_right / dx)) + 1
+        if cells_left + cells_right > extra:
+            scale = extra / (cells_left + cells_right)
+            cells_left = int(cells_left * scale)
+            cells_right = int(cells_right * scale)
+        # The largest wave speed on the extended grid, the flux is convex in u
+        # (the extremes are attained by the extreme values) and at most linear
+        # in x
+        ends = np.array([left - cells_left * dx, right + cells_right * dx])
+        speed = max(np.max(np.abs(flux.speed(np.full(2, value), ends)))
+                for value in u)
+        steps = np.ceil(speed * duration / (cfl * dx))
+        work = steps * (cells + cells_left + cells_right + STEP_COST)
+        if work <= MAX_WORK or cells // 2 < MIN_CELLS:
+            return cells, cells_left, cells_right
+        cells //= 2
+
+
+def solve(flux, initial, left, right, cells, times, cfl=CFL):
+    """
+    The cell centers within [left, right] (divided into the number of cells,
+    or fewer, see MAX_WORK) and the cell averages at the given times
+    (ascending, from t=0) as one row per time. initial is the initial condition
+    as a function of x. The rows of times after MAX_STEPS steps are NaN.
+    """
+    times = np.asarray(times, dtype=float)
+    cells, cells_left, cells_right = _grid(flux,
+            _value_range(initial, left, right), left, right, cells, times[-1],
+            cfl)
+    dx = (right - left) / cells
+
+    x = left + dx * (np.arange(-cells_left, cells + cells_right) + 0.5)
+    interfaces = left + dx * np.arange(-cells_left, cells + cells_right + 1)
+    u = np.asarray(initial(x), dtype=float)
+
+    frames = np.empty((len(times), cells))
+    visible = slice(cells_left, cells_left + cells)
+    t = 0.
+    steps = 0
+    for i, time in enumerate(times):
+        while t < time and steps < MAX_STEPS:
+            # The outermost values are continued beyond the boundaries
+            padded = np.concatenate((u[:1], u, u[-1:]))
+            u_left, u_right = padded[:-1], padded[1:]
+            speed = max(np.max(np.abs(flux.speed(u_left, interfaces))),
+                    np.max(np.abs(flux.speed(u_right, interfaces))))
+            dt = time - t
+            if speed > 0:
+                dt = min(dt, cfl * dx / speed)
+            fluxes = godunov_flux(flux, u_left, u_right, interfaces)
+            u = u - dt / dx * np.diff(fluxes)
+            t = time if dt == time - t else t + dt
+            steps += 1
+        if t < time:
+            log.warning("Stopped the solution at t=%g after %d steps, the "
+                    "frames from t=%g on are not calculated", t, steps, time)
+            frames[i:] = np.nan
+            break
+        frames[i] = u[visible]
+    return x[visible], frames
@@ -0,0 +1,77 @@
+import numpy as np
+
+"""
+Fourier series of periodic functions that are only known by samples, e.g.,
+sketched by the user.
+
+The strokes of the sketch (lists of x and y values, as drawn by bokeh's
+FreehandDrawTool) are resampled at the points of a uniform grid over one period:
+
+    samples = resample_strokes(strokes, period, 1024)
+
+A stroke sets the samples in the part of the period it covers, later strokes
+overwrite earlier ones and parts that are not covered at all stay zero. A stroke
+longer than a period wraps around, so it can start anywhere on the x-axis.
+
+The complex coefficients c_k of the series follow from one real FFT of the
+samples. Up to half the number of samples they are those of the trigonometric
+interpolation, i.e., a_k = 2 Re(c_k) and b_k = -2 Im(c_k):
+
+    coefficients = fourier_coefficients(samples)
+
+The partial sum of any order is then evaluated on a (finer) grid over the period
+by an inverse real FFT of the truncated coefficients, which costs about as much
+as summing up the series at a single point per harmonic:
+
+    y = partial_sum(coefficients, order, 4096)
+"""
+
+
+def resample_strokes(strokes, period, samples):
+    """
+    The strokes (pairs of x and y values) sampled at the points k period /
+    samples for k = 0, ..., samples - 1.
+    """
+    grid = np.arange(samples) * period / samples
+    y = np.zeros(samples)
+    for xs, ys in strokes:
+        xs = np.asarray(xs, dtype=float)
+        ys = np.asarray(ys, dtype=float)
+        finite = np.isfinite(xs) & np.isfinite(ys)
+        if finite.sum() < 2:
+            continue
+        order = np.argsort(xs[finite], kind="stable")
+        xs = xs[finite][order]
+        ys = ys[finite][order]
+        # The first copy of every grid point at or right of the start of the
+        # stroke
+        images = xs[0] + (grid - xs[0]) % period
+        covered = images <= xs[-1]
+        y[covered] = np.interp(images[covered], xs, ys)
+    return y
+
+
+def fourier_coefficients(samples):
+    """
+    The complex Fourier coefficients c_0, ..., c_(n/2) of the samples of one
+    period.
+    """
+    return np.fft.rfft(samples) / len(samples)
+
+
+def amplitude_spectrum(coefficients, harmonics):
+    """
+    The amplitudes of the harmonics 0, ..., harmonics, i.e., |a_0 / 2| and
+    sqrt(a_k^2 + b_k^2).
+    """
+    amplitudes = 2 * np.abs(coefficients[:harmonics + 1])
+    amplitudes[0] /= 2
+    return amplitudes
+
+
+def partial_sum(coefficients, order, points):
+    """
+    The partial sum of the series up to the order (below half the number of
+    samples) at the points k / points of a period of length 1.
+    """
+    return np.fft.irfft(coefficients[:order + 1] * points, n=points)
@@ -0,0 +1,107 @@
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+
+from extensions.cache import memoize
+
+"""
+Heat conduction in a square plate (u_t = k (u_xx + u_yy)) with fixed
+temperatures at the edges, solved by finite differences.
+
+The plate is sampled at the points of a uniform grid, the second derivatives are
+approximated by the five-point stencil, i.e., a sparse matrix L acting on the
+temperatures of the interior points. The time is discretized by the implicit
+Crank-Nicolson method
+    (I - a L) u(t + dt) = (I + a L) u(t) + 2 a b,   a = k dt / 2,
+where b holds the contributions of the fixed edges. The method is stable for any
+time step, so a step can be as long as the step of the time slider.
+
+The matrix I - a L is factorized (sparse LU) once for every combination of grid,
+conductivity and time step. The factorization is shared by all sessions of the
+process (see extensions/cache.py), every time step is then only a
+back-substitution.
+
+Sharp initial temperatures (e.g., a hot block) excite modes far beyond the
+resolution of the time step, which Crank-Nicolson only damps slowly and lets
+oscillate. As proposed by Rannacher, the first steps are therefore replaced by
+two implicit Euler steps of half the length each. These need the same matrix.
+
+    frames = simulate(initial, edges, spacing, conductivity, dt, 100)
+
+A simulation can be continued from its last frame, e.g., to advance the
+temperatures shown step by step:
+
+    frames = simulate(frames[-1], edges, spacing, conductivity, dt, 5,
+            start=100)
+"""
+
+# Number of (full) time steps at the start that are taken by implicit Euler
+RANNACHER_STEPS = 2
+
+
+def laplacian(points, spacing):
+    """
+    The five-point stencil for the interior points of a grid of points by points
+    as a sparse matrix (the interior points are ordered row by row).
+    """
+    n = points - 2
+    second = scipy.sparse.diags([np.ones(n - 1), -2 * np.ones(n),
+            np.ones(n - 1)], [-1, 0, 1])
+    identity = scipy.sparse.identity(n)
+    return (scipy.sparse.kron(identity, second) +
+            scipy.sparse.kron(second, identity)).tocsc() / spacing**2
+
+
+@memoize(maxsize=16)
+def crank_nicolson_factors(points, spacing, conductivity, time_step):
+    """
+    The factorized matrix of the implicit side and the matrix of the explicit
+    side of a Crank-Nicolson step.
+    """
+    a = conductivity * time_step / 2
+    stencil = laplacian(points, spacing)
+    identity = scipy.sparse.identity(stencil.shape[0], format="csc")
+    implicit = scipy.sparse.linalg.splu(identity - a * stencil)
+    return implicit, (identity + a * stencil).tocsr()
+
+
+def edge_contributions(edges, spacing):
+    """
+    The contributions of the fixed temperatures at the edges (the outermost
+    rows and columns of the grid edges) to the stencil of the interior points.
+    """
+    contributions = np.zeros((edges.shape[0] - 2, edges.shape[1] - 2))
+    contributions[0, :] += edges[0, 1:-1]
+    contributions[-1, :] += edges[-1, 1:-1]
+    contributions[:, 0] += edges[1:-1, 0]
+    contributions[:, -1] += edges[1:-1, -1]
+    return contributions.ravel() / spacing**2
+
+
+def simulate(initial, edges, spacing, conductivity, time_step, steps, start=0):
+    """
+    The temperatures of the whole plate at the start and after every time step
+    (one frame per step). The temperatures at the edges are taken from edges
+    (the interior of this array is ignored). Start is the number of steps the
+    initial temperatures have already been advanced by (only the first steps
+    of a simulation are implicit Euler steps).
+    """
+    points = initial.shape[0]
+    implicit, explicit = crank_nicolson_factors(points, spacing, conductivity,
+            time_step)
+    a = conductivity * time_step / 2
+    boundary = 2 * a * edge_contributions(edges, spacing)
+
+    frames = np.empty((steps + 1, ) + initial.shape)
+    frames[:] = edges
+    frames[0] = initial
+    u = initial[1:-1, 1:-1].ravel()
+    for step in range(1, steps + 1):
+        if start + step <= RANNACHER_STEPS:
+            # Two implicit Euler steps of half the length, (I - a L) u = u + a b
+            for _ in range(2):
+                u = implicit.solve(u + boundary / 2)
+        else:
+            u = implicit.solve(explicit @ u + boundary)
+        frames[step, 1:-1, 1:-1] = u.reshape(points - 2, points - 2)
+    return frames
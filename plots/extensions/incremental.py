@@ -0,0 +1,191 @@
+import logging
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from bokeh.core.json_encoder import serialize_json
+
+"""
+Incremental updates of ColumnDataSources.
+
+Assigning a new dict to ColumnDataSource.data sends all of its columns to the
+browser, even the ones that did not change (e.g., the x grid of a function plot
+only changes with the range, not with the parameters). update_source compares
+the new data with the current data of the source and only sends what changed:
+    - unchanged columns are not sent at all,
+    - changed columns are assigned one by one (only these columns are sent),
+    - a column that only changed within a small range is patched,
+    - if all columns only grew by new values at their end, these are streamed.
+If the columns are renamed or change their length otherwise, the whole data is
+assigned as before.
+
+The columns of the source may be read-only arrays shared through the
+memoization cache (see extensions/cache.py). They are copied before they are
+patched in place.
+"""
+
+log = logging.getLogger(__name__)
+
+# A column is patched instead of sent completely if the patch is smaller than
+# this fraction of the column. Patches are sent as JSON (about 20 bytes per
+# float) while whole numpy columns are sent as binary buffers (8 bytes).
+PATCH_FRACTION = 0.5
+
+UpdateReport = namedtuple("UpdateReport", ["mode", "sent_bytes", "full_bytes"])
+UpdateReport.saved_bytes = property(
+        lambda report: report.full_bytes - report.sent_bytes)
+
+_statistics = {"updates": 0, "sent_bytes": 0, "full_bytes": 0}
+_statistics_lock = threading.Lock()
+
+
+def payload_size(value):
+    """
+    Approximate number of bytes a column occupies in a message. Numeric numpy
+    arrays are sent as binary buffers, everything else as JSON.
+    """
+    if isinstance(value, np.ndarray) and value.dtype.kind in "biuf":
+        return value.nbytes
+    return len(serialize_json(value))
+
+
+def columns_equal(old, new):
+    if old is new:
+        return True
+    if not isinstance(old, np.ndarray) and not isinstance(new, np.ndarray):
+        # Lists, possibly nested (e.g., the lines of a multi_line)
+        try:
+            return bool(old == new)
+        except ValueError:
+            return False
+    old = np.asarray(old)
+    new = np.asarray(new)
+    if old.shape != new.shape:
+        return False
+    if old.dtype.kind == "f" and new.dtype.kind == "f":
+        return bool(np.array_equal(old, new, equal_nan=True))
+    try:
+        return bool(np.array_equal(old, new))
+    except (TypeError, ValueError):
+        return False
+
+
+def _changed_range(old, new):
+    """
+    The slice of a one-dimensional numeric column covering all changed values or
+    None if the column can not be patched.
+    """
+    if not isinstance(old, np.ndarray) or old.ndim != 1 or \
+            old.dtype.kind not in "biuf":
+        return None
+    new = np.asarray(new)
+    if new.shape != old.shape or new.dtype.kind not in "biuf":
+        return None
+    if old.dtype.kind == "f" and new.dtype.kind == "f":
+        same = (old == new) | (np.isnan(old) & np.isnan(new))
+    else:
+        same = old == new
+    changed = np.flatnonzero(~same)
+    if len(changed) == 0:
+        return None
+    return slice(int(changed[0]), int(changed[-1]) + 1)
+
+
+def _streamed_columns(current, data):
+    """
+    The new values at the end of every column if all columns start with their
+    current values, otherwise None.
+    """
+    appended = {}
+    for name, column in data.items():
+        old = current[name]
+        if len(column) <= len(old) or \
+                not columns_equal(old, column[:len(old)]):
+            return None
+        appended[name] = column[len(old):]
+    return appended
+
+
+def _record(report):
+    with _statistics_lock:
+        _statistics["updates"] += 1
+        _statistics["sent_bytes"] += report.sent_bytes
+        _statistics["full_bytes"] += report.full_bytes
+    log.debug("%s update, sent %d of %d bytes", report.mode,
+            report.sent_bytes, report.full_bytes)
+    return report
+
+
+def update_source(source, data, rollover=None):
+    """
+    Updates the data of the ColumnDataSource to the given dict of columns and
+    only sends the columns (or ranges of columns) that changed. Returns an
+    UpdateReport with the mode of the update ("full", "columns", "patch",
+    "stream" or "unchanged") and the bytes sent compared to a full update.
+
+        update_source(data_source, {"x": x, "y": y})
+    """
+    full_bytes = sum(payload_size(column) for column in data.values())
+    current = source.data
+
+    lengths = set(len(column) for column in data.values())
+    current_lengths = set(len(column) for column in current.values())
+    if set(current) != set(data) or len(lengths) != 1 or \
+            len(current_lengths) != 1:
+        source.data = data
+        return _record(UpdateReport("full", full_bytes, full_bytes))
+
+    if lengths != current_lengths:
+        appended = _streamed_columns(current, data)
+        if appended is None:
+            source.data = data
+            return _record(UpdateReport("full", full_bytes, full_bytes))
+        source.stream(appended, rollover)
+        return _record(UpdateReport("stream",
+                sum(payload_size(column) for column in appended.values()),
+                full_bytes))
+
+    columns = {}
+    patches = {}
+    for name, column in data.items():
+        old = current[name]
+        if columns_equal(old, column):
+            continue
+        changed = _changed_range(old, column)
+        if changed is not None:
+            values = np.asarray(column)[changed]
+            if len(serialize_json(values.tolist())) < \
+                    PATCH_FRACTION * payload_size(column):
+                patches[name] = [(changed, values)]
+                continue
+        columns[name] = column
+
+    sent_bytes = sum(payload_size(column) for column in columns.values()) + \
+            sum(len(serialize_json(values.tolist()))
+                for patch in patches.values() for _, values in patch)
+    if columns:
+        source.data.update(columns)
+    if patches:
+        for name in patches:
+            if not current[name].flags.writeable:
+                # Replace the shared read-only array by a copy without
+                # notifying the browser, it already has these values
+                dict.__setitem__(current, name, np.array(current[name]))
+        source.patch(patches)
+
+    if columns:
+        mode = "columns"
+    elif patches:
+        mode = "patch"
+    else:
+        mode = "unchanged"
+    return _record(UpdateReport(mode, sent_bytes, full_bytes))
+
+
+def incremental_statistics():
+    """
+    Number of updates and the bytes sent by them compared to full updates.
+    """
+    with _statistics_lock:
+        return dict(_statistics)
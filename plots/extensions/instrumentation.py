@@ -0,0 +1,340 @@
+import functools
+import os
+import threading
+import time
+from collections import defaultdict
+
+from bokeh.document import Document
+from bokeh.io import curdoc
+from bokeh.server.connection import ServerConnection
+from bokeh.util.callback_manager import (EventCallbackManager,
+        PropertyCallbackManager)
+from tornado.web import RequestHandler
+
+from extensions.cache import cache_statistics
+from extensions.incremental import incremental_statistics
+
+"""
+Instrumentation of the python callbacks of the plot apps.
+
+Every callback registered with on_change, on_event (on_click) and every
+periodic, timeout and next tick callback of a document is wrapped and records
+    - the number of calls,
+    - the wall time and the compute (CPU) time of the calls,
+    - the number and the size of the PATCH-DOC messages created during the
+      calls, i.e., what the callback costs to send to the browsers.
+
+The metrics are kept per app (the url of the app) and callback (its name within
+the script) and are served in the Prometheus text format by the MetricsHandler,
+which the server entry point (extensions/server.py) adds under /metrics. With
+several worker processes (--num-procs) every process counts for itself and the
+endpoint reports the metrics of the process that answers the request.
+"""
+
+# Upper bounds (in seconds) of the buckets of the wall time histogram
+WALL_TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+        2.5, 5.0)
+
+
+class CallbackMetrics(object):
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.wall_time = 0.0
+        self.compute_time = 0.0
+        self.bucket_counts = [0] * len(WALL_TIME_BUCKETS)
+        self.payload_messages = 0
+        self.payload_bytes = 0
+
+    def add_call(self, wall_time, compute_time, failed):
+        self.calls += 1
+        self.errors += failed
+        self.wall_time += wall_time
+        self.compute_time += compute_time
+        for index, bound in enumerate(WALL_TIME_BUCKETS):
+            if wall_time <= bound:
+                self.bucket_counts[index] += 1
+                break
+
+
+# The name of the lambdas the handlers of on_click are wrapped in by bokeh
+BOKEH_ON_CLICK = "on_click.<locals>.<lambda>"
+
+# Metrics by (app, callback, kind)
+_metrics = defaultdict(CallbackMetrics)
+_metrics_lock = threading.Lock()
+
+# The key of the callback that is currently running in this thread, the
+# messages created meanwhile are attributed to it
+_running = threading.local()
+
+
+def _unwrapped(callback):
+    """
+    The function behind partials, functools.wraps and the lambdas bokeh wraps
+    the handlers of on_click in (e.g., of a Toggle or a RadioButtonGroup).
+    """
+    while True:
+        while isinstance(callback, functools.partial):
+            callback = callback.func
+        callback = getattr(callback, "__wrapped__", callback)
+        code = getattr(callback, "__code__", None)
+        closure = getattr(callback, "__closure__", None)
+        name = getattr(callback, "__qualname__", "")
+        if code is None or closure is None or \
+                not name.endswith(BOKEH_ON_CLICK) or \
+                "handler" not in code.co_freevars:
+            return callback
+        callback = closure[code.co_freevars.index("handler")].cell_contents
+
+
+def _callback_name(callback):
+    callback = _unwrapped(callback)
+    name = getattr(callback, "__qualname__", None) or repr(callback)
+    code = getattr(callback, "__code__", None)
+    if name == "<lambda>" and code is not None:
+        name += ":%d" % code.co_firstlineno
+    return name
+
+
+def _app_name(callback):
+    """
+    The url of the app whose document runs the callback. Outside of a session
+    (e.g., when running the script directly) the file the callback is defined
+    in is used instead.
+    """
+    try:
+        context = curdoc().session_context
+        return context.server_context.application_context.url.lstrip("/")
+    except AttributeError:
+        pass
+    code = getattr(_unwrapped(callback), "__code__", None)
+    if code is None:
+        return "unknown"
+    return os.path.splitext(os.path.basename(code.co_filename))[0]
+
+
+def instrument(callback, kind):
+    """
+    Wraps a callback to record its metrics. The wrapper keeps the signature of
+    the callback (bokeh inspects it to decide which arguments to pass).
+    """
+    name = _callback_name(callback)
+
+    @functools.wraps(callback)
+    def wrapper(*args, **kwargs):
+        key = (_app_name(callback), name, kind)
+        outer = getattr(_running, "key", None)
+        _running.key = key
+        started = time.perf_counter()
+        started_compute = time.thread_time()
+        failed = True
+        try:
+            result = callback(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            wall_time = time.perf_counter() - started
+            compute_time = time.thread_time() - started_compute
+            _running.key = outer
+            with _metrics_lock:
+                _metrics[key].add_call(wall_time, compute_time, failed)
+
+    wrapper._instrumented = callback
+    return wrapper
+
+
+def _record_payload(size):
+    key = getattr(_running, "key", None)
+    if key is None:
+        return
+    with _metrics_lock:
+        metrics = _metrics[key]
+        metrics.payload_messages += 1
+        metrics.payload_bytes += size
+
+
+def _message_size(message):
+    return len(message.header_json) + len(message.metadata_json) + \
+            len(message.content_json) + \
+            sum(len(header) + len(payload)
+                for header, payload in message.buffers)
+
+
+def _registered_wrapper(registered, callback):
+    """
+    The wrapper registered for a callback, used to remove callbacks by the
+    function they were registered with.
+    """
+    for wrapper in registered:
+        if getattr(wrapper, "_instrumented", None) is callback:
+            return wrapper
+    return callback
+
+
+_installed = False
+_install_lock = threading.Lock()
+
+def install():
+    """
+    Patches bokeh to instrument all callbacks registered from now on. Called by
+    the server entry point before any app is created, it is only installed
+    once per process.
+    """
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        _installed = True
+
+    on_change = PropertyCallbackManager.on_change
+    remove_on_change = PropertyCallbackManager.remove_on_change
+    on_event = EventCallbackManager.on_event
+    add_session_callback = Document._add_session_callback
+
+    def instrumented_on_change(self, attr, *callbacks):
+        on_change(self, attr,
+                *[instrument(callback, "property") for callback in callbacks])
+
+    def instrumented_remove_on_change(self, attr, *callbacks):
+        registered = self._callbacks.get(attr, [])
+        remove_on_change(self, attr,
+                *[_registered_wrapper(registered, callback)
+                    for callback in callbacks])
+
+    def instrumented_on_event(self, event, *callbacks):
+        on_event(self, event,
+                *[instrument(callback, "event") for callback in callbacks])
+
+    def instrumented_add_session_callback(self, callback_obj, callback,
+            one_shot, originator):
+        # Periodic, timeout or next tick callback
+        kind = type(callback_obj).__name__.replace("Callback", "").lower()
+        wrapper = instrument(callback, kind)
+        result = add_session_callback(self, callback_obj, wrapper, one_shot,
+                originator)
+        # The callbacks can still be removed by the original function
+        by_callable = self._callback_objs_by_callable[originator]
+        by_callable[callback].update(by_callable.pop(wrapper))
+        return result
+
+    def instrumented_send_patch_document(self, event):
+        message = self.protocol.create("PATCH-DOC", [event])
+        _record_payload(_message_size(message))
+        return self._socket.send_message(message)
+
+    PropertyCallbackManager.on_change = instrumented_on_change
+    PropertyCallbackManager.remove_on_change = instrumented_remove_on_change
+    EventCallbackManager.on_event = instrumented_on_event
+    Document._add_session_callback = instrumented_add_session_callback
+    ServerConnection.send_patch_document = instrumented_send_patch_document
+
+
+def _labels(**labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('%s="%s"' % (key, str(value).replace("\\", "\\\\")
+            .replace('"', '\\"')) for key, value in sorted(labels.items())) + "}"
+
+
+def _format_bound(bound):
+    return "%g" % bound
+
+
+def render_metrics(bokeh_tornado=None):
+    """
+    All metrics of this process in the Prometheus text exposition format.
+    """
+    lines = []
+
+    def metric(name, kind, description, samples):
+        lines.append("# HELP %s %s" % (name, description))
+        lines.append("# TYPE %s %s" % (name, kind))
+        for suffix, labels, value in samples:
+            lines.append("%s%s%s %s" % (name, suffix, _labels(**labels),
+                    repr(float(value)) if isinstance(value, float) else value))
+
+    with _metrics_lock:
+        snapshot = sorted((key, (metrics.calls, metrics.errors,
+                metrics.wall_time, metrics.compute_time,
+                list(metrics.bucket_counts), metrics.payload_messages,
+                metrics.payload_bytes)) for key, metrics in _metrics.items())
+
+    def samples(index):
+        return [("", dict(app=app, callback=callback, kind=kind), values[index])
+                for (app, callback, kind), values in snapshot]
+
+    metric("expmath_callback_calls_total", "counter",
+            "Number of calls of the callback.", samples(0))
+    metric("expmath_callback_errors_total", "counter",
+            "Number of calls of the callback that raised an exception.",
+            samples(1))
+
+    histogram = []
+    for (app, callback, kind), values in snapshot:
+        labels = dict(app=app, callback=callback, kind=kind)
+        cumulative = 0
+        for bound, count in zip(WALL_TIME_BUCKETS, values[4]):
+            cumulative += count
+            histogram.append(("_bucket",
+                    dict(labels, le=_format_bound(bound)), cumulative))
+        histogram.append(("_bucket", dict(labels, le="+Inf"), values[0]))
+        histogram.append(("_sum", labels, values[2]))
+        histogram.append(("_count", labels, values[0]))
+    metric("expmath_callback_wall_seconds", "histogram",
+            "Wall time of the calls of the callback.", histogram)
+
+    metric("expmath_callback_compute_seconds_total", "counter",
+            "CPU time of the thread running the callback.", samples(3))
+    metric("expmath_callback_payload_messages_total", "counter",
+            "Number of PATCH-DOC messages created by the callback.",
+            samples(5))
+    metric("expmath_callback_payload_bytes_total", "counter",
+            "Serialized size of the PATCH-DOC messages created by the "
+            "callback.", samples(6))
+
+    if bokeh_tornado is not None:
+        metric("expmath_sessions", "gauge", "Number of open sessions.",
+                [("", dict(app=app_path.lstrip("/")),
+                    len(bokeh_tornado.get_sessions(app_path)))
+                    for app_path in sorted(bokeh_tornado.app_paths)])
+
+    statistics = sorted(cache_statistics().items())
+    metric("expmath_cache_hits_total", "counter",
+            "Number of results taken from the memoization cache.",
+            [("", dict(cache=name), info.hits) for name, info in statistics])
+    metric("expmath_cache_misses_total", "counter",
+            "Number of results calculated for the memoization cache.",
+            [("", dict(cache=name), info.misses) for name, info in statistics])
+    metric("expmath_cache_merged_total", "counter",
+            "Number of requests that waited for the same calculation of "
+            "another session.",
+            [("", dict(cache=name), info.merged) for name, info in statistics])
+    metric("expmath_cache_entries", "gauge",
+            "Number of results in the memoization cache.",
+            [("", dict(cache=name), info.currsize)
+                for name, info in statistics])
+
+    incremental = incremental_statistics()
+    metric("expmath_incremental_updates_total", "counter",
+            "Number of incremental ColumnDataSource updates.",
+            [("", {}, incremental["updates"])])
+    metric("expmath_incremental_sent_bytes_total", "counter",
+            "Bytes sent by the incremental updates.",
+            [("", {}, incremental["sent_bytes"])])
+    metric("expmath_incremental_saved_bytes_total", "counter",
+            "Bytes saved by the incremental updates compared to sending all "
+            "columns.",
+            [("", {}, incremental["full_bytes"] - incremental["sent_bytes"])])
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(RequestHandler):
+    """
+    Tornado handler serving the metrics, added to the bokeh server with
+    extra_patterns=[("/metrics", MetricsHandler)].
+    """
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.write(render_metrics(self.application))
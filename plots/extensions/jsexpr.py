@@ -0,0 +1,579 @@
+import argparse
+import ast
+import json
+import linecache
+import math
+import runpy
+import subprocess
+import sys
+import types
+
+import numpy as np
+
+"""
+Compiler of the numpy expressions of the plots into javascript.
+
+Many plots are defined by small tables of lambdas like
+
+    "sine": {"definition": (lambda a, b, c, d, x: a * np.sin(b*x + c) + d)}
+
+and only evaluate these for the values of some sliders. Instead of duplicating
+the math by hand in the code of a CustomJS (see the prototype in
+with_js_callbacks/), compile_function translates such a lambda (or a function
+that only returns an expression) into an equivalent javascript function. The
+arguments holding arrays (by default the last one) are looped over element by
+element into a Float64Array, all other arguments are scalars:
+
+    function (a, b, c, d, x) {
+        var _n = x.length;
+        var _result = new Float64Array(_n);
+        for (var _i = 0; _i < _n; _i++) {
+            _result[_i] = a * Math.sin(b * x[_i] + c) + d;
+        }
+        return _result;
+    }
+
+The sliders of an app can then be connected with js_on_change and the browser
+calculates the value pairs itself, without any round trip to the server.
+
+Supported are arithmetic (with the floor semantics of numpy for // and %),
+comparisons, the element-wise functions of numpy listed in FUNCTIONS (and their
+Python builtins abs, min and max), np.where, np.piecewise (with constants or
+lambdas as functions), np.heaviside, np.clip, the array constructors np.ones,
+np.zeros, np.full (and their _like variants) and numeric constants of the
+module or the closure. The operators &, | and ~ are only meant for combining
+the conditions of np.where and np.piecewise. Everything else raises a
+JsCompileError, so an app can fall back to its python callbacks.
+
+The javascript versions are checked against the python versions by running both
+for random parameters (node.js has to be installed):
+
+    python3 -m extensions.jsexpr einfache_funktionen.py --table functions
+"""
+
+# Element-wise numpy functions and the javascript functions they map to
+FUNCTIONS = {
+        "sin": "Math.sin",
+        "cos": "Math.cos",
+        "tan": "Math.tan",
+        "arcsin": "Math.asin",
+        "arccos": "Math.acos",
+        "arctan": "Math.atan",
+        "arctan2": "Math.atan2",
+        "sinh": "Math.sinh",
+        "cosh": "Math.cosh",
+        "tanh": "Math.tanh",
+        "arcsinh": "Math.asinh",
+        "arccosh": "Math.acosh",
+        "arctanh": "Math.atanh",
+        "exp": "Math.exp",
+        "expm1": "Math.expm1",
+        "log": "Math.log",
+        "log10": "Math.log10",
+        "log2": "Math.log2",
+        "log1p": "Math.log1p",
+        "sqrt": "Math.sqrt",
+        "cbrt": "Math.cbrt",
+        "abs": "Math.abs",
+        "absolute": "Math.abs",
+        "fabs": "Math.abs",
+        "floor": "Math.floor",
+        "ceil": "Math.ceil",
+        "trunc": "Math.trunc",
+        "sign": "Math.sign",
+        "hypot": "Math.hypot",
+        "power": "Math.pow",
+        "minimum": "Math.min",
+        "maximum": "Math.max",
+        "isnan": "isNaN",
+        "isfinite": "isFinite",
+        }
+
+# Constants of numpy (and math)
+CONSTANTS = {
+        "pi": "Math.PI",
+        "e": "Math.E",
+        "inf": "Infinity",
+        "nan": "NaN",
+        }
+
+BUILTINS = {
+        abs: "Math.abs",
+        min: "Math.min",
+        max: "Math.max",
+        }
+
+# Helper functions that are only added to the javascript function if they are
+# used
+HELPERS = {
+        "_mod": "function (a, b) { return a - Math.floor(a / b) * b; }",
+        "_heaviside": "function (x, h) { return isNaN(x) ? NaN : "
+            "(x < 0 ? 0 : (x > 0 ? 1 : h)); }",
+        }
+
+BINARY_OPERATORS = {
+        ast.Add: "+",
+        ast.Sub: "-",
+        ast.Mult: "*",
+        ast.Div: "/",
+        ast.BitAnd: "&&",
+        ast.BitOr: "||",
+        }
+
+COMPARE_OPERATORS = {
+        ast.Lt: "<",
+        ast.LtE: "<=",
+        ast.Gt: ">",
+        ast.GtE: ">=",
+        ast.Eq: "==",
+        ast.NotEq: "!=",
+        }
+
+
+class JsCompileError(ValueError):
+    pass
+
+
+def _function_node(function):
+    """
+    The ast node (Lambda or FunctionDef) a function was defined by. The source
+    is read from the file of the function, which also works for the scripts of
+    the bokeh apps (their modules are not importable).
+    """
+    code = getattr(function, "__code__", None)
+    if code is None:
+        raise JsCompileError("%r is not a python function" % (function,))
+    lines = linecache.getlines(code.co_filename)
+    if not lines:
+        raise JsCompileError("The source of %s is not available" %
+                function.__qualname__)
+    tree = ast.parse("".join(lines), code.co_filename)
+
+    arguments = list(code.co_varnames[:code.co_argcount])
+    candidates = []
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Lambda, ast.FunctionDef)) and \
+                node.lineno == code.co_firstlineno and \
+                [arg.arg for arg in node.args.args] == arguments:
+            if isinstance(node, ast.FunctionDef) and \
+                    node.name != function.__name__:
+                continue
+            candidates.append(node)
+    if len(candidates) != 1:
+        raise JsCompileError("Can not find the definition of %s in %s:%d" %
+                (function.__qualname__, code.co_filename, code.co_firstlineno))
+    return candidates[0]
+
+
+def _returned_expression(node):
+    if isinstance(node, ast.Lambda):
+        return node.body
+    body = node.body
+    if body and isinstance(body[0], ast.Expr) and \
+            isinstance(body[0].value, ast.Constant) and \
+            isinstance(body[0].value.value, str):
+        # Docstring
+        body = body[1:]
+    if len(body) != 1 or not isinstance(body[0], ast.Return) or \
+            body[0].value is None:
+        raise JsCompileError("Function %s has to consist of a single return "
+                "statement" % node.name)
+    return body[0].value
+
+
+def _number(value):
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "Infinity" if value > 0 else "(-Infinity)"
+    if value == int(value) and abs(value) < 2**53:
+        literal = str(int(value))
+    else:
+        literal = repr(value)
+    return "(%s)" % literal if value < 0 else literal
+
+
+class _Translator(object):
+    """
+    Translates the expression of a function into a javascript expression for a
+    single element. Names are looked up in the arguments (array arguments are
+    indexed with _i), the closure and the globals of the function.
+    """
+    def __init__(self, function, arrays):
+        self.function = function
+        self.arrays = set(arrays)
+        code = function.__code__
+        self.arguments = set(code.co_varnames[:code.co_argcount])
+        self.closure = {}
+        if function.__closure__:
+            for name, cell in zip(code.co_freevars, function.__closure__):
+                self.closure[name] = cell.cell_contents
+        self.helpers = set()
+        # Parameters of nested lambdas (of np.piecewise) bound to expressions
+        self.bound = {}
+
+    def fail(self, node, message):
+        raise JsCompileError("%s (line %d of %s)" % (message,
+                getattr(node, "lineno", 0), self.function.__qualname__))
+
+    def lookup(self, node, name):
+        if name in self.closure:
+            return self.closure[name]
+        if name in self.function.__globals__:
+            return self.function.__globals__[name]
+        builtins = self.function.__globals__.get("__builtins__", {})
+        if isinstance(builtins, types.ModuleType):
+            builtins = vars(builtins)
+        if name in builtins:
+            return builtins[name]
+        self.fail(node, "Unknown name %r" % name)
+
+    def value(self, node):
+        """
+        The python object a name or an attribute (e.g., np.sin) refers to.
+        """
+        if isinstance(node, ast.Name):
+            if node.id in self.arguments or node.id in self.bound:
+                self.fail(node, "Argument %r is not callable" % node.id)
+            return self.lookup(node, node.id)
+        if isinstance(node, ast.Attribute):
+            owner = self.value(node.value)
+            if not isinstance(owner, types.ModuleType) or \
+                    not hasattr(owner, node.attr):
+                self.fail(node, "Unsupported attribute %r" % node.attr)
+            return getattr(owner, node.attr)
+        self.fail(node, "Unsupported expression %s" % type(node).__name__)
+
+    def constant(self, node, value):
+        if isinstance(value, (bool, np.bool_)):
+            return "true" if value else "false"
+        if isinstance(value, (int, float, np.integer, np.floating)):
+            return _number(value)
+        self.fail(node, "Unsupported value %r" % (value,))
+
+    def translate(self, node):
+        method = getattr(self, "translate_" + type(node).__name__, None)
+        if method is None:
+            self.fail(node, "Unsupported expression %s" % type(node).__name__)
+        return method(node)
+
+    def translate_Constant(self, node):
+        return self.constant(node, node.value)
+
+    def translate_Name(self, node):
+        if node.id in self.bound:
+            return self.bound[node.id]
+        if node.id in self.arguments:
+            if node.id in self.arrays:
+                return "%s[_i]" % node.id
+            return node.id
+        return self.constant(node, self.lookup(node, node.id))
+
+    def translate_Attribute(self, node):
+        owner = self.value(node.value)
+        if owner in (np, math) and node.attr in CONSTANTS:
+            return CONSTANTS[node.attr]
+        return self.constant(node, self.value(node))
+
+    def translate_BinOp(self, node):
+        left = self.translate(node.left)
+        right = self.translate(node.right)
+        operator = type(node.op)
+        if operator in BINARY_OPERATORS:
+            return "(%s %s %s)" % (left, BINARY_OPERATORS[operator], right)
+        if operator is ast.Pow:
+            return "Math.pow(%s, %s)" % (left, right)
+        if operator is ast.FloorDiv:
+            return "Math.floor(%s / %s)" % (left, right)
+        if operator is ast.Mod:
+            self.helpers.add("_mod")
+            return "_mod(%s, %s)" % (left, right)
+        if operator is ast.BitXor:
+            return "(!(%s) != !(%s))" % (left, right)
+        self.fail(node, "Unsupported operator %s" % operator.__name__)
+
+    def translate_UnaryOp(self, node):
+        operand = self.translate(node.operand)
+        if isinstance(node.op, ast.USub):
+            return "(-%s)" % operand
+        if isinstance(node.op, ast.UAdd):
+            return operand
+        # not and ~ (of a condition)
+        return "(!%s)" % operand
+
+    def translate_BoolOp(self, node):
+        operator = " && " if isinstance(node.op, ast.And) else " || "
+        return "(%s)" % operator.join(self.translate(value)
+                for value in node.values)
+
+    def translate_Compare(self, node):
+        parts = []
+        left = self.translate(node.left)
+        for operator, comparator in zip(node.ops, node.comparators):
+            if type(operator) not in COMPARE_OPERATORS:
+                self.fail(node, "Unsupported comparison %s" %
+                        type(operator).__name__)
+            right = self.translate(comparator)
+            parts.append("%s %s %s" % (left, COMPARE_OPERATORS[type(operator)],
+                    right))
+            left = right
+        return "(%s)" % " && ".join(parts)
+
+    def translate_IfExp(self, node):
+        return "(%s ? %s : %s)" % (self.translate(node.test),
+                self.translate(node.body), self.translate(node.orelse))
+
+    def translate_Call(self, node):
+        if node.keywords:
+            self.fail(node, "Keyword arguments are not supported")
+        callee = self.value(node.func)
+        arguments = node.args
+
+        if callee in BUILTINS:
+            return "%s(%s)" % (BUILTINS[callee],
+                    ", ".join(self.translate(arg) for arg in arguments))
+        name = getattr(callee, "__name__", None)
+        if not isinstance(callee, np.ufunc) and \
+                getattr(callee, "__module__", "").split(".")[0] != "numpy":
+            self.fail(node, "Unsupported function %r" % (name,))
+
+        if name in FUNCTIONS:
+            return "%s(%s)" % (FUNCTIONS[name],
+                    ", ".join(self.translate(arg) for arg in arguments))
+        if name in ("ones", "ones_like"):
+            return "1"
+        if name in ("zeros", "zeros_like"):
+            return "0"
+        if name in ("full", "full_like") and len(arguments) == 2:
+            return self.translate(arguments[1])
+        if name == "square" and len(arguments) == 1:
+            return "Math.pow(%s, 2)" % self.translate(arguments[0])
+        if name == "reciprocal" and len(arguments) == 1:
+            return "(1 / %s)" % self.translate(arguments[0])
+        if name == "clip" and len(arguments) == 3:
+            value, lower, upper = (self.translate(arg) for arg in arguments)
+            return "Math.min(Math.max(%s, %s), %s)" % (value, lower, upper)
+        if name == "heaviside" and len(arguments) == 2:
+            self.helpers.add("_heaviside")
+            return "_heaviside(%s, %s)" % tuple(self.translate(arg)
+                    for arg in arguments)
+        if name == "where" and len(arguments) == 3:
+            return "(%s ? %s : %s)" % tuple(self.translate(arg)
+                    for arg in arguments)
+        if name == "piecewise" and len(arguments) == 3:
+            return self.piecewise(node, *arguments)
+        self.fail(node, "Unsupported numpy function %r" % (name,))
+
+    def piecewise(self, node, x, conditions, functions):
+        """
+        np.piecewise(x, [c_1, ..., c_n], [f_1, ..., f_n(, otherwise)]). Like in
+        numpy the last true condition wins and values without a true condition
+        are zero.
+        """
+        if not isinstance(conditions, (ast.List, ast.Tuple)) or \
+                not isinstance(functions, (ast.List, ast.Tuple)):
+            self.fail(node, "np.piecewise needs literal lists")
+        conditions = conditions.elts
+        functions = functions.elts
+        if len(functions) not in (len(conditions), len(conditions) + 1):
+            self.fail(node, "np.piecewise needs a function per condition")
+        x = self.translate(x)
+
+        result = "0"
+        if len(functions) > len(conditions):
+            result = self.piece(functions[-1], x)
+        for condition, function in zip(conditions, functions):
+            result = "(%s ? %s : %s)" % (self.translate(condition),
+                    self.piece(function, x), result)
+        return result
+
+    def piece(self, node, x):
+        if not isinstance(node, ast.Lambda):
+            return self.translate(node)
+        parameters = [arg.arg for arg in node.args.args]
+        if len(parameters) != 1:
+            self.fail(node, "The functions of np.piecewise take one argument")
+        outer = self.bound.get(parameters[0])
+        self.bound[parameters[0]] = x
+        try:
+            return self.translate(node.body)
+        finally:
+            if outer is None:
+                del self.bound[parameters[0]]
+            else:
+                self.bound[parameters[0]] = outer
+
+
+def compile_function(function, arrays=None):
+    """
+    Compiles a python function (a lambda or a def that only returns an
+    expression) into the source of an equivalent javascript function. Arrays are
+    the names of the arguments that are arrays (default: the last argument), the
+    result then is a Float64Array of the same length.
+    """
+    code = getattr(function, "__code__", None)
+    if code is None:
+        raise JsCompileError("%r is not a python function" % (function,))
+    arguments = list(code.co_varnames[:code.co_argcount])
+    if arrays is None:
+        arrays = arguments[-1:]
+    for name in arguments:
+        if name.startswith("_"):
+            raise JsCompileError("Argument %r collides with the names of the "
+                    "compiled code" % name)
+
+    translator = _Translator(function, arrays)
+    expression = translator.translate(
+            _returned_expression(_function_node(function)))
+
+    lines = ["function (%s) {" % ", ".join(arguments)]
+    for helper in sorted(translator.helpers):
+        lines.append("    var %s = %s;" % (helper, HELPERS[helper]))
+    if arrays:
+        lines += [
+                "    var _n = %s.length;" % arrays[0],
+                "    var _result = new Float64Array(_n);",
+                "    for (var _i = 0; _i < _n; _i++) {",
+                "        _result[_i] = %s;" % expression,
+                "    }",
+                "    return _result;",
+                ]
+    else:
+        lines.append("    return %s;" % expression)
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def compile_table(table, key="definition", arrays=None):
+    """
+    Compiles the functions of a table like the one of einfache_funktionen.py
+    into the source of a javascript object with the same keys.
+    """
+    entries = ["    %s: %s" % (json.dumps(name),
+            compile_function(entry[key], arrays).replace("\n", "\n    "))
+            for name, entry in table.items()]
+    return "{\n" + ",\n".join(entries) + "\n}"
+
+
+# Evaluates the compiled function for all samples, non-finite values are sent
+# back as strings since JSON has no representation for them
+_PARITY_SCRIPT = """
+var f = %s;
+var input = require("fs").readFileSync(0, "utf8");
+var samples = JSON.parse(input);
+var results = samples.map(function (args) {
+    var values = f.apply(null, args.map(function (arg) {
+        return Array.isArray(arg) ? Float64Array.from(arg) : arg;
+    }));
+    return Array.from(values.length === undefined ? [values] : values,
+        function (value) {
+            return isFinite(value) ? Number(value) : String(value);
+        });
+});
+process.stdout.write(JSON.stringify(results));
+"""
+
+
+def evaluate_javascript(source, samples, node="node"):
+    """
+    Evaluates the source of a compiled function with node.js for every tuple of
+    arguments in samples.
+    """
+    samples = [[np.asarray(arg).tolist() for arg in args] for args in samples]
+    completed = subprocess.run([node, "-e", _PARITY_SCRIPT % source],
+            input=json.dumps(samples), capture_output=True, text=True,
+            check=True)
+    return [np.array([float(value) for value in result])
+            for result in json.loads(completed.stdout)]
+
+
+def check_parity(function, samples, arrays=None, rtol=1e-9, atol=1e-12,
+        node="node"):
+    """
+    Compares the python function and its compiled javascript version for every
+    tuple of arguments in samples. Returns the samples (with the largest
+    difference) the two disagree on. Samples for which python raises an
+    exception (e.g., a division by a zero slider value) are skipped.
+    """
+    source = compile_function(function, arrays)
+    expected = []
+    checked = []
+    with np.errstate(all="ignore"):
+        for args in samples:
+            try:
+                result = function(*args)
+            except ArithmeticError:
+                continue
+            expected.append(np.ravel(np.asarray(result, dtype=float)))
+            checked.append(args)
+    actual = evaluate_javascript(source, checked, node)
+
+    mismatches = []
+    for args, python, javascript in zip(checked, expected, actual):
+        python = np.broadcast_to(python, javascript.shape)
+        if not np.allclose(python, javascript, rtol=rtol, atol=atol,
+                equal_nan=True):
+            with np.errstate(all="ignore"):
+                difference = np.nanmax(np.abs(python - javascript))
+            mismatches.append((args, difference))
+    return mismatches
+
+
+def random_samples(function, number, value_range, x, random):
+    """
+    Random tuples of slider values for the parameters of the function (all but
+    the first argument), each followed by the array argument x.
+    """
+    number_of_parameters = function.__code__.co_argcount - 1
+    # Slider values are multiples of 0.1, which hits the special cases (e.g.,
+    # zero) more often than arbitrary values
+    return [tuple(float(value) for value in np.round(random.uniform(
+            *value_range, number_of_parameters), 1)) + (x,)
+            for _ in range(number)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python3 -m extensions.jsexpr",
+            description="Checks the javascript versions of the functions in a "
+            "table of a plot against their python versions.")
+    parser.add_argument("script", help="the plot defining the table")
+    parser.add_argument("--table", default="functions")
+    parser.add_argument("--key", default="definition")
+    parser.add_argument("--samples", type=int, default=50,
+            help="number of random parameter sets per function")
+    parser.add_argument("--range", type=float, nargs=2, default=(-2, 2),
+            metavar=("LOW", "HIGH"), help="range of the parameters")
+    parser.add_argument("--x-range", type=float, nargs=2, default=(-10, 10),
+            metavar=("LOW", "HIGH"), help="range of the array argument")
+    parser.add_argument("--node", default="node")
+    arguments = parser.parse_args(argv)
+
+    namespace = runpy.run_path(arguments.script)
+    table = namespace[arguments.table]
+    random = np.random.default_rng(0)
+    x = np.linspace(*arguments.x_range, 401)
+
+    failed = False
+    for name, entry in table.items():
+        function = entry[arguments.key]
+        samples = random_samples(function, arguments.samples, arguments.range,
+                x, random)
+        try:
+            mismatches = check_parity(function, samples, node=arguments.node)
+        except JsCompileError as error:
+            print("%-30s not compiled: %s" % (name, error))
+            failed = True
+            continue
+        if mismatches:
+            args, difference = max(mismatches, key=lambda item: item[1])
+            print("%-30s %d of %d samples differ, e.g., by %g for %s" % (name,
+                    len(mismatches), len(samples), difference, args[:-1]))
+            failed = True
+        else:
+            print("%-30s ok" % name)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
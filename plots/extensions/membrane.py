@@ -0,0 +1,119 @@
+import math
+
+import numpy as np
+
+"""
+Simulation of a vibrating membrane (the wave equation u_tt = c^2 (u_xx + u_yy)
+on a rectangle with the edges held fixed) by finite differences.
+
+The second derivatives are approximated by the five-point stencil and the time
+by the leapfrog scheme
+    u(t + dt) = 2 u(t) - u(t - dt) + (c dt / h)^2 * laplace(u(t)),
+which is stable for c dt / h <= 1 / sqrt(2). The time step is fixed by the grid
+spacing and the speed, advance then takes as many steps as fit into the
+requested duration.
+
+The state is kept in preallocated buffers and every step is computed in place
+(numpy ufuncs with out=), so the simulation does not allocate any arrays while
+it runs. A step on a 200 by 200 grid takes about 0.25 ms, an animation at 20
+frames per second needs a few steps per frame.
+
+    membrane = Membrane(x, y, speed=1.)
+    membrane.reset(np.exp(-(X**2 + Y**2)))
+    membrane.advance(0.05)
+    surface_source.data = {..., "Z": membrane.displacement.ravel()}
+"""
+
+# The fraction of the largest stable time step that is used
+CFL = 0.9
+
+
+class Membrane(object):
+    """
+    A membrane sampled at the points of the uniform grids x and y (the
+    displacement is indexed [y, x] like a meshgrid). The outermost points are
+    the fixed edges.
+    """
+    def __init__(self, x, y, speed=1.):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.spacing = min(self.x[1] - self.x[0], self.y[1] - self.y[0])
+        shape = (len(self.y), len(self.x))
+        # The displacement at the current and the previous step, the next step
+        # overwrites the previous one
+        self._current = np.zeros(shape)
+        self._previous = np.zeros(shape)
+        # Work buffer for the stencil (interior points only)
+        self._laplace = np.zeros((shape[0] - 2, shape[1] - 2))
+        self.time = 0.
+        # The point in time the steps so far were requested up to, the steps lag
+        # behind it by less than one step
+        self._target = 0.
+        self.set_speed(speed)
+
+    @property
+    def displacement(self):
+        """
+        The current displacement. The array is overwritten by the next steps.
+        """
+        return self._current
+
+    def set_speed(self, speed):
+        self.speed = speed
+        self.step_size = CFL * self.spacing / (speed * math.sqrt(2))
+        self._courant = (speed * self.step_size / self.spacing)**2
+
+    def _stencil(self, u):
+        """
+        The five-point stencil of u at the interior points times the squared
+        Courant number, stored in the work buffer.
+        """
+        laplace = self._laplace
+        np.multiply(u[1:-1, 1:-1], -4., out=laplace)
+        laplace += u[2:, 1:-1]
+        laplace += u[:-2, 1:-1]
+        laplace += u[1:-1, 2:]
+        laplace += u[1:-1, :-2]
+        laplace *= self._courant
+        return laplace
+
+    def reset(self, displacement, velocity=None):
+        """
+        Restarts the simulation at t=0 with the initial displacement (and
+        velocity). The edges are set to zero.
+        """
+        self.time = 0.
+        self._target = 0.
+        current, previous = self._current, self._previous
+        current[...] = displacement
+        current[0, :] = current[-1, :] = current[:, 0] = current[:, -1] = 0.
+        # The virtual step before t=0 by a Taylor expansion of second order
+        previous[...] = current
+        if velocity is not None:
+            previous -= self.step_size * np.asarray(velocity)
+        previous[1:-1, 1:-1] += 0.5 * self._stencil(current)
+        previous[0, :] = previous[-1, :] = previous[:, 0] = \
+                previous[:, -1] = 0.
+
+    def step(self):
+        current, previous = self._current, self._previous
+        laplace = self._stencil(current)
+        # u(t + dt) = 2 u(t) - u(t - dt) + laplace, written into the buffer of
+        # u(t - dt) which is no longer needed
+        np.subtract(current, previous, out=previous)
+        previous += current
+        previous[1:-1, 1:-1] += laplace
+        self._current, self._previous = previous, current
+        self.time += self.step_size
+
+    def advance(self, duration):
+        """
+        Takes all steps within the next duration (the remainder is carried over
+        to the next call). Returns the number of steps taken.
+        """
+        self._target += duration
+        steps = 0
+        while self.time + self.step_size <= self._target + 1e-12:
+            self.step()
+            steps += 1
+        return steps
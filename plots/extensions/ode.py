@@ -0,0 +1,446 @@
+import math
+
+import numpy as np
+
+"""
+Numerical integration of the trajectories in phase plots.
+
+The trajectories of systems of two ODEs of first order without an analytic
+solution are integrated by the adaptive Runge-Kutta method of Dormand and Prince
+of 5th order with step size control. It takes few, long steps where the solution
+is smooth and its dense output interpolates within the steps at 4th order.
+Therefore, the number of points drawn does not depend on the number of steps:
+every step is sampled so that the line segments are about SEGMENT_PIXELS long on
+the screen.
+
+A general purpose integrator (e.g., scipy.integrate.solve_ivp) spends a tenth of
+a millisecond per step on bookkeeping. The steps here are plain float
+arithmetic on the two components (a few microseconds), only the dense output is
+evaluated with numpy for all steps at once.
+
+The integration stops once the trajectory leaves the given bounds (an event,
+located within the step by bisection of the dense output), instead of following
+it far outside of the plot.
+
+    t, u, v = trajectory(lambda u, v: (v, -u), (1., 0.), 10.,
+            scale=(40., 40.), bounds=((-5., 5.), (-5., 5.)))
+
+An ensemble of trajectories (e.g., for a grid of initial values) is integrated
+at once: the state is a matrix with one column per trajectory, the right hand
+side is called with arrays and all trajectories share the steps (the size is
+controlled by the largest error among them). A trajectory leaving the bounds is
+frozen there, its points after the exit are NaN.
+
+    t, u, v = trajectories(lambda u, v: (v, -u), initials, 10.,
+            scale=(40., 40.), bounds=((-5., 5.), (-5., 5.)))
+
+For an animation, a TrajectoryStream keeps the state of the integration and
+only integrates (and returns the points of) the piece of the trajectory that is
+added by the next frame, so every frame costs the same however long the
+animation has been running.
+
+    stream = TrajectoryStream(lambda u, v: (v, -u), (1., 0.), scale=(40., 40.))
+    t, u, v = stream.advance(0.1)
+"""
+
+# Tolerances of the step size control, the error of a trajectory over many
+# periods stays well below a pixel
+DEFAULT_RTOL = 1e-5
+DEFAULT_ATOL = 1e-8
+
+# Upper bound on the number of steps, e.g., if the solution blows up
+MAX_STEPS = 100000
+
+# Length (in pixels) of the line segments the trajectory is drawn with
+SEGMENT_PIXELS = 2.
+
+# Number of points per step used to estimate the length of its piece of the
+# trajectory on the screen
+ESTIMATE_POINTS = 8
+
+# Upper bound on the number of points of a trajectory, and of all trajectories
+# of an ensemble together
+MAX_POINTS = 5000
+MAX_ENSEMBLE_POINTS = 40000
+
+# The Butcher tableau of the method (the systems are autonomous, so the nodes
+# are not needed), the last row are the weights of the solution of 5th order
+# (first same as last)
+_A = (
+        (),
+        (1/5, ),
+        (3/40, 9/40),
+        (44/45, -56/15, 32/9),
+        (19372/6561, -25360/2187, 64448/6561, -212/729),
+        (9017/3168, -355/33, 46732/5247, 49/176, -5103/18656),
+        (35/384, 0., 500/1113, 125/192, -2187/6784, 11/84),
+        )
+(_A21, ), (_A31, _A32), (_A41, _A42, _A43), (_A51, _A52, _A53, _A54), \
+        (_A61, _A62, _A63, _A64, _A65), \
+        (_B1, _B2, _B3, _B4, _B5, _B6) = _A[1:]
+# Difference of the weights of 5th and 4th order, i.e., the error estimate
+_E = (71/57600, 0., -71/16695, 71/1920, -17253/339200, 22/525, -1/40)
+_E1, _E2, _E3, _E4, _E5, _E6, _E7 = _E
+# The same as arrays for the ensembles
+_A_ROWS = [np.array(row) for row in _A]
+_E_ROW = np.array(_E)
+# The coefficients of the dense output, y(t + theta h) = y(t) + h sum_i k_i
+# sum_j P[i][j] theta^(j+1)
+_P = np.array([
+        [1, -8048581381/2820520608, 8663915743/2820520608,
+            -12715105075/11282082432],
+        [0, 0, 0, 0],
+        [0, 131558114200/32700410799, -68118460800/10900136933,
+            87487479700/32700410799],
+        [0, -1754552775/470086768, 14199869525/1410260304,
+            -10690763975/1880347072],
+        [0, 127303824393/49829197408, -318862633887/49829197408,
+            701980252875/199316789632],
+        [0, -282668133/205662961, 2019193451/616988883,
+            -1453857185/822651844],
+        [0, 40617522/29380423, -110615467/29380423, 69997945/29380423],
+        ])
+
+
+class DenseOutput(object):
+    """
+    The solution between the steps as a vectorized function of the time. For
+    an ensemble, u and v get an additional last axis over the trajectories.
+    """
+    def __init__(self, times, steps, values, stages):
+        # The start times and sizes of the steps, the values at their start
+        # (steps by 2 by trajectories) and the coefficients of the interpolation
+        # polynomials
+        self.times = times
+        self.steps = steps
+        self.values = values
+        self.coefficients = np.einsum("ni...,ij->nj...", stages, _P)
+
+    def __call__(self, t):
+        t = np.asarray(t, dtype=float)
+        shape = t.shape
+        t = t.ravel()
+        index = np.clip(np.searchsorted(self.times, t, side="right") - 1, 0,
+                len(self.times) - 1)
+        theta = (t - self.times[index]) / self.steps[index]
+        powers = theta[:, None] ** np.arange(1, 5)
+        increment = np.einsum("kj,kj...->k...", powers,
+                self.coefficients[index])
+        steps = self.steps[index].reshape((-1, ) + (1, ) * (increment.ndim - 1))
+        y = self.values[index] + steps * increment
+        return y[:, 0].reshape(shape + y.shape[2:]), \
+                y[:, 1].reshape(shape + y.shape[2:])
+
+
+def _step(rhs, u, v, k1u, k1v, h):
+    """
+    One step of the method written out, returns the solution, the error
+    estimate and the stages.
+    """
+    k2u, k2v = rhs(u + h * _A21 * k1u, v + h * _A21 * k1v)
+    k3u, k3v = rhs(u + h * (_A31 * k1u + _A32 * k2u),
+            v + h * (_A31 * k1v + _A32 * k2v))
+    k4u, k4v = rhs(u + h * (_A41 * k1u + _A42 * k2u + _A43 * k3u),
+            v + h * (_A41 * k1v + _A42 * k2v + _A43 * k3v))
+    k5u, k5v = rhs(u + h * (_A51 * k1u + _A52 * k2u + _A53 * k3u + _A54 * k4u),
+            v + h * (_A51 * k1v + _A52 * k2v + _A53 * k3v + _A54 * k4v))
+    k6u, k6v = rhs(u + h * (_A61 * k1u + _A62 * k2u + _A63 * k3u + _A64 * k4u +
+            _A65 * k5u), v + h * (_A61 * k1v + _A62 * k2v + _A63 * k3v +
+            _A64 * k4v + _A65 * k5v))
+    # The last stage is evaluated at the solution of 5th order (_B2 is zero)
+    u_new = u + h * (_B1 * k1u + _B3 * k3u + _B4 * k4u + _B5 * k5u + _B6 * k6u)
+    v_new = v + h * (_B1 * k1v + _B3 * k3v + _B4 * k4v + _B5 * k5v + _B6 * k6v)
+    k7u, k7v = rhs(u_new, v_new)
+    error_u = h * (_E1 * k1u + _E3 * k3u + _E4 * k4u + _E5 * k5u + _E6 * k6u +
+            _E7 * k7u)
+    error_v = h * (_E1 * k1v + _E3 * k3v + _E4 * k4v + _E5 * k5v + _E6 * k6v +
+            _E7 * k7v)
+    return u_new, v_new, error_u, error_v, \
+            (k1u, k2u, k3u, k4u, k5u, k6u, k7u), \
+            (k1v, k2v, k3v, k4v, k5v, k6v, k7v)
+
+
+def _outside(bounds, u, v):
+    (left, right), (bottom, top) = bounds
+    return not (left <= u <= right and bottom <= v <= top)
+
+
+def integrate(rhs, initial, end_time, bounds=None, rtol=DEFAULT_RTOL,
+        atol=DEFAULT_ATOL):
+    """
+    Integrates (u, v)' = rhs(u, v) from t=0 with the initial values until the
+    end time or until (u, v) leaves the bounds ((left, right), (bottom, top)).
+    Returns the times of the steps (including the final time) and the dense
+    output.
+    """
+    t = 0.
+    u, v = float(initial[0]), float(initial[1])
+    ku, kv = rhs(u, v)
+
+    # Initial step size similar to the one of Hairer, Norsett and Wanner
+    scale_u = atol + rtol * abs(u)
+    scale_v = atol + rtol * abs(v)
+    norm_y = math.hypot(u / scale_u, v / scale_v)
+    norm_f = math.hypot(ku / scale_u, kv / scale_v)
+    if norm_y < 1e-5 or norm_f < 1e-5:
+        h = 1e-6
+    else:
+        h = 0.01 * norm_y / norm_f
+    h = min(h, end_time)
+
+    times, steps, values, stages = [], [], [], []
+    final_time = None
+    while t < end_time and len(steps) < MAX_STEPS:
+        h = min(h, end_time - t)
+        u_new, v_new, error_u, error_v, k_u, k_v = _step(rhs, u, v, ku, kv, h)
+        scale_u = atol + rtol * max(abs(u), abs(u_new))
+        scale_v = atol + rtol * max(abs(v), abs(v_new))
+        error = math.sqrt(((error_u / scale_u)**2 + (error_v / scale_v)**2) / 2)
+
+        if not math.isfinite(error):
+            h *= 0.2
+            if h < 1e-12 * max(end_time, 1.):
+                break
+            continue
+        if error > 1:
+            h *= max(0.2, 0.9 * error**-0.2)
+            continue
+
+        times.append(t)
+        steps.append(h)
+        values.append((u, v))
+        stages.append((k_u, k_v))
+        t += h
+        u, v = u_new, v_new
+        ku, kv = k_u[6], k_v[6]
+        h *= min(10., 0.9 * error**-0.2) if error > 0 else 10.
+
+        if bounds is not None and _outside(bounds, u, v):
+            # Locate the crossing of the bounds within the last step
+            dense = DenseOutput(np.array(times[-1:]), np.array(steps[-1:]),
+                    np.array(values[-1:]),
+                    np.array(stages[-1:]).transpose(0, 2, 1))
+            inside, outside = times[-1], t
+            for _ in range(40):
+                middle = (inside + outside) / 2
+                if _outside(bounds, *(float(ele) for ele in dense(middle))):
+                    outside = middle
+                else:
+                    inside = middle
+            final_time = inside
+            break
+
+    if final_time is None:
+        final_time = t
+
+    if not times:
+        times, steps, values = [0.], [1.], [(u, v)]
+        stages = [([0.] * 7, [0.] * 7)]
+    times = np.array(times)
+    dense = DenseOutput(times, np.array(steps), np.array(values),
+            np.array(stages).transpose(0, 2, 1))
+    return np.append(times, final_time), dense
+
+
+def _initial_step(u, v, ku, kv, end_time, rtol, atol):
+    """
+    Initial step size similar to the one of Hairer, Norsett and Wanner (the
+    largest norm over an ensemble).
+    """
+    scale_u = atol + rtol * np.abs(u)
+    scale_v = atol + rtol * np.abs(v)
+    norm_y = np.max(np.hypot(u / scale_u, v / scale_v))
+    norm_f = np.max(np.hypot(ku / scale_u, kv / scale_v))
+    if norm_y < 1e-5 or norm_f < 1e-5 or not np.isfinite(norm_f):
+        return min(1e-6, end_time)
+    return min(0.01 * norm_y / norm_f, end_time)
+
+
+def integrate_ensemble(rhs, initials, end_time, bounds=None, rtol=DEFAULT_RTOL,
+        atol=DEFAULT_ATOL):
+    """
+    Integrates (u, v)' = rhs(u, v) for all initial values (a sequence of (u, v)
+    pairs) together. Returns the times of the steps (including the final time),
+    the dense output and the times at which the trajectories left the bounds
+    (infinite if they did not).
+    """
+    # The state has one column per trajectory, the stages of a step are
+    # combined by one matrix product each
+    y = np.array(initials, dtype=float).reshape(-1, 2).T.copy()
+    exits = np.full(y.shape[1], np.inf)
+    active = np.ones(y.shape[1], dtype=bool)
+
+    def inside(y):
+        (left, right), (bottom, top) = bounds
+        return (left <= y[0]) & (y[0] <= right) & (bottom <= y[1]) & \
+                (y[1] <= top)
+
+    if bounds is not None:
+        active = inside(y)
+        exits[~active] = 0.
+
+    def frozen(y):
+        derivative = np.empty_like(y)
+        derivative[0], derivative[1] = rhs(y[0], y[1])
+        derivative[:, ~active] = 0.
+        return derivative
+
+    t = 0.
+    times, steps, values, stages = [], [], [], []
+    with np.errstate(all="ignore"):
+        k = np.empty((7, ) + y.shape)
+        # The stages as rows of a matrix
+        k_rows = k.reshape(7, -1)
+        k[0] = frozen(y)
+        h = _initial_step(y[0], y[1], k[0, 0], k[0, 1], end_time, rtol, atol)
+        while t < end_time and len(steps) < MAX_STEPS and active.any():
+            h = min(h, end_time - t)
+            for i in range(1, 6):
+                k[i] = frozen(y + h * (_A_ROWS[i] @ k_rows[:i]).reshape(
+                        y.shape))
+            # The last stage is evaluated at the solution of 5th order
+            y_new = y + h * (_A_ROWS[6] @ k_rows[:6]).reshape(y.shape)
+            k[6] = frozen(y_new)
+            scale = atol + rtol * np.maximum(np.abs(y), np.abs(y_new))
+            relative = (h * (_E_ROW @ k_rows)).reshape(y.shape) / scale
+            error = np.sqrt(np.max(relative[0]**2 + relative[1]**2) / 2)
+
+            if not np.isfinite(error):
+                h *= 0.2
+                if h < 1e-12 * max(end_time, 1.):
+                    break
+                continue
+            if error > 1:
+                h *= max(0.2, 0.9 * error**-0.2)
+                continue
+
+            times.append(t)
+            steps.append(h)
+            values.append(y)
+            stages.append(k.copy())
+            t += h
+            y = y_new
+            k[0] = k[6]
+            h *= min(10., 0.9 * error**-0.2) if error > 0 else 10.
+
+            if bounds is not None:
+                # The trajectories outside are frozen at the end of the step
+                left_now = active & ~inside(y)
+                exits[left_now] = t
+                active &= ~left_now
+                k[0][:, left_now] = 0.
+
+    if not times:
+        times, steps, values = [0.], [1.], [y]
+        stages = [np.zeros((7, ) + y.shape)]
+    times = np.array(times)
+    dense = DenseOutput(times, np.array(steps), np.array(values),
+            np.array(stages))
+    return np.append(times, t), dense, exits
+
+
+def _sample_times(steps, solution, scale, max_points):
+    """
+    Times dividing every step so that the pieces of the trajectory (of the
+    fastest trajectory of an ensemble) are about SEGMENT_PIXELS long.
+    """
+    if len(steps) > max_points:
+        # Already the ends of the steps are too many points
+        return np.linspace(0., steps[-1], max_points)
+    durations = np.diff(steps)
+
+    # Length of the pieces of the trajectory on the screen
+    fractions = np.linspace(0, 1, ESTIMATE_POINTS + 1)
+    u, v = solution(steps[:-1, None] + durations[:, None] * fractions)
+    with np.errstate(invalid="ignore"):
+        pixels = np.hypot(np.diff(u, axis=1) * scale[0],
+                np.diff(v, axis=1) * scale[1]).sum(axis=1)
+    # E.g., close to a singularity
+    pixels[~np.isfinite(pixels)] = 0.
+    pixels = pixels.reshape(len(durations), -1).max(axis=1)
+
+    counts = np.clip(np.ceil(pixels / SEGMENT_PIXELS), 1, max_points
+            ).astype(int)
+    if counts.sum() >= max_points:
+        counts = np.maximum(counts * (max_points - 1) // counts.sum(), 1)
+    # Every step is divided evenly, the end point of the last step is added
+    step = np.repeat(np.arange(len(counts)), counts)
+    position = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+            counts)
+    return np.append(steps[step] + durations[step] * position / counts[step],
+            steps[-1])
+
+
+def trajectory(rhs, initial, end_time, scale=(1., 1.), bounds=None,
+        rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL):
+    """
+    The trajectory of (u, v)' = rhs(u, v) as times t and coordinates u and v
+    for a plot with scale = (pixels per unit of u, pixels per unit of v).
+    """
+    if end_time <= 0:
+        return np.zeros(1), np.full(1, initial[0], dtype=float), \
+                np.full(1, initial[1], dtype=float)
+    steps, solution = integrate(rhs, initial, end_time, bounds, rtol, atol)
+    t = _sample_times(steps, solution, scale, MAX_POINTS)
+    u, v = solution(t)
+    return t, u, v
+
+
+def trajectories(rhs, initials, end_time, scale=(1., 1.), bounds=None,
+        rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL):
+    """
+    The trajectories of an ensemble, u and v have one column per initial value
+    (see trajectory). All trajectories together have at most
+    MAX_ENSEMBLE_POINTS points.
+    """
+    initials = np.array(initials, dtype=float).reshape(-1, 2)
+    if end_time <= 0 or len(initials) == 0:
+        return np.zeros(1), initials[None, :, 0], initials[None, :, 1]
+    steps, solution, exits = integrate_ensemble(rhs, initials, end_time,
+            bounds, rtol, atol)
+    t = _sample_times(steps, solution, scale,
+            max(MAX_ENSEMBLE_POINTS // len(initials), 2))
+    u, v = solution(t)
+    after_exit = t[:, None] > exits
+    u[after_exit] = np.nan
+    v[after_exit] = np.nan
+    return t, u, v
+
+
+class TrajectoryStream(object):
+    """
+    A trajectory (see trajectory) integrated piece by piece from t=0. Once it
+    left the bounds (or the integration failed), no further points are added.
+    """
+    def __init__(self, rhs, initial, scale=(1., 1.), bounds=None,
+            rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL):
+        self.rhs = rhs
+        self.scale = scale
+        self.bounds = bounds
+        self.rtol = rtol
+        self.atol = atol
+        self.time = 0.
+        self.state = (float(initial[0]), float(initial[1]))
+        self.finished = bounds is not None and _outside(bounds, *self.state)
+
+    def advance(self, duration):
+        """
+        Integrates the trajectory for the duration and returns the times and
+        coordinates of the new points (without the current one).
+        """
+        if self.finished or duration <= 0:
+            return np.empty(0), np.empty(0), np.empty(0)
+        steps, solution = integrate(self.rhs, self.state, duration,
+                self.bounds, self.rtol, self.atol)
+        t = _sample_times(steps, solution, self.scale, MAX_POINTS)[1:]
+        u, v = solution(t)
+        if steps[-1] < duration:
+            self.finished = True
+        elif not (np.isfinite(u[-1]) and np.isfinite(v[-1])):
+            self.finished = True
+            return np.empty(0), np.empty(0), np.empty(0)
+        else:
+            self.state = (float(u[-1]), float(v[-1]))
+        t = self.time + t
+        self.time += steps[-1]
+        return t, u, v
@@ -0,0 +1,75 @@
+import numpy as np
+
+"""
+Conversion of the value pairs into the form bokeh sends most efficiently.
+
+Bokeh sends numeric numpy arrays as binary buffers, while python lists (and
+lists of lists as used by multi_line) are JSON encoded element by element,
+which makes the messages about three times as large and costs much more CPU on
+the server. The helpers below therefore always return contiguous numpy arrays.
+
+By default the arrays are float32 (SCREEN_DTYPE). Its precision of about seven
+digits is far more than the pixels of a plot can resolve and halves the message
+size compared to float64. Use float64 for data that is not only drawn, e.g.,
+values that are read back or shown as numbers.
+
+Several lines are drawn by a single line glyph by joining them into one flat
+array with NaNs in between. Bokeh leaves a gap at every NaN.
+"""
+
+# The precision of values that are only drawn
+SCREEN_DTYPE = np.float32
+
+
+def screen_array(values, dtype=SCREEN_DTYPE):
+    """
+    Values (list, tuple or array) as a contiguous numpy array of the same shape,
+    e.g., one frame per row for the animations.
+    """
+    return np.ascontiguousarray(values, dtype=dtype)
+
+
+def screen_columns(data, dtype=SCREEN_DTYPE):
+    """
+    Converts all columns of a ColumnDataSource dict into screen arrays.
+
+        source.data = screen_columns({"x": x, "y": y})
+    """
+    return {name: screen_array(column, dtype)
+            for name, column in data.items()}
+
+
+def nan_separated(lines, dtype=SCREEN_DTYPE):
+    """
+    Joins a list of lines (each one a sequence of coordinates, as for
+    multi_line) into one flat array with a NaN between two lines. The x and the
+    y coordinates have to be joined separately, empty lines are dropped.
+    """
+    separator = np.full(1, np.nan, dtype=dtype)
+    parts = []
+    for line in lines:
+        if len(line) == 0:
+            continue
+        if parts:
+            parts.append(separator)
+        parts.append(np.asarray(line, dtype=dtype).ravel())
+    if not parts:
+        return np.empty(0, dtype=dtype)
+    return np.concatenate(parts)
+
+
+def nan_separated_rows(lines, dtype=SCREEN_DTYPE):
+    """
+    Vectorized version of nan_separated for lines of equal length given as the
+    rows of a two-dimensional array (e.g., the straight segments of a vector
+    field with the start points in the first and the end points in the second
+    column).
+    """
+    lines = np.asarray(lines, dtype=dtype)
+    if lines.size == 0:
+        return np.empty(0, dtype=dtype)
+    separated = np.empty((lines.shape[0], lines.shape[1] + 1), dtype=dtype)
+    separated[:, :-1] = lines
+    separated[:, -1] = np.nan
+    # The trailing NaN of the last line is not needed
+    return separated.ravel()[:-1]
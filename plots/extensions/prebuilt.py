@@ -0,0 +1,91 @@
+import hashlib
+import io
+import json
+import logging
+import os
+
+import bokeh
+from bokeh.util.compiler import AttrDict, get_cache_hook, set_cache_hook
+
+"""
+Serves the custom BokehJS extensions (LatexLabel, Surface3d, Vector3d) from a
+precompiled bundle instead of compiling their TypeScript implementation with
+nodejs on the serving host.
+
+The bundle is created by the build step (run from within the plots folder)
+
+    python3 -m extensions.build
+
+and stored in extensions/dist. Every compiled model is stored together with the
+hash of its TypeScript source and the bokeh version it was compiled against.
+When bokeh asks for the compiled code of a model, the hook installed below
+returns the precompiled code if both still match. Otherwise (e.g., the .ts file
+has been edited but the bundle has not been rebuilt) it falls back to the
+regular compilation with nodejs.
+"""
+
+log = logging.getLogger(__name__)
+
+DIST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dist")
+
+
+def bundle_path(bokeh_version=bokeh.__version__):
+    """
+    The bundle is specific to the bokeh version since the compiled code imports
+    the BokehJS modules of exactly this version.
+    """
+    return os.path.join(DIST_DIR,
+            "expmath-extensions-bokeh-%s.json" % bokeh_version)
+
+
+def implementation_hash(code):
+    return hashlib.sha256(
+            (bokeh.__version__ + "\n" + code).encode("utf-8")).hexdigest()
+
+
+def load_bundle(path=None):
+    """
+    Returns the dictionary of precompiled models by their full name or an empty
+    dictionary if no bundle has been built.
+    """
+    path = path or bundle_path()
+    if not os.path.exists(path):
+        return {}
+    with io.open(path, encoding="utf-8") as bundle_file:
+        bundle = json.load(bundle_file)
+    return bundle["models"]
+
+
+_models = None
+
+def _prebuilt_cache_hook(model, implementation):
+    """
+    Cache hook in the form bokeh expects it. Returning None makes bokeh compile
+    the implementation itself.
+    """
+    global _models
+    if _models is None:
+        _models = load_bundle()
+        if not _models:
+            log.warning("No prebuilt extension bundle found at %s, custom "
+                    "models are compiled with nodejs. Run 'python3 -m "
+                    "extensions.build' to create it.", bundle_path())
+
+    compiled = _models.get(model.full_name)
+    if compiled is None:
+        return None
+    if compiled["hash"] != implementation_hash(implementation.code):
+        log.warning("Prebuilt extension %s is outdated, it is compiled with "
+                "nodejs instead. Rebuild the extension bundle.",
+                model.full_name)
+        return None
+    return AttrDict(code=compiled["code"], deps=compiled["deps"])
+
+
+def use_prebuilt_bundle():
+    """
+    Installs the cache hook. Called by every extension module on import, it is
+    only installed once per process.
+    """
+    if get_cache_hook() is not _prebuilt_cache_hook:
+        set_cache_hook(_prebuilt_cache_hook)
@@ -0,0 +1,90 @@
+import numpy as np
+
+from extensions.payload import screen_columns
+
+"""
+Vector fields (quiver plots) drawn by native bokeh glyphs.
+
+Bokeh has no glyph for arrows with data dependent lengths. An arrow is therefore
+drawn as a segment (the body) and a triangle marker (the head) rotated into the
+direction of the body. quiver calculates both for all arrows of a grid at once,
+the results are the data of the two ColumnDataSources:
+
+    bodies, heads = quiver(X, Y, U, V)
+    plot.segment(x0="x0", y0="y0", x1="x1", y1="y1", source=body_source)
+    plot.triangle(x="x", y="y", angle="angle", source=head_source, size=7)
+
+The triangle marker is sized in pixels and rotated on the screen. If the axes
+are not equally scaled (match_aspect), the ratio of the pixels per unit of the
+y to the x axis has to be given as the aspect, so that the heads point along
+the bodies.
+
+The columns are float32 arrays (see extensions/payload.py), a grid of 100 by 100
+arrows takes about a millisecond.
+"""
+
+# How to treat the lengths of the vectors
+# "scale": the longest vector gets the given length, the others are scaled
+#          accordingly
+# "normalize": all vectors get the given length
+# "none": the vectors keep their length
+VECTOR_TREATMENTS = ("scale", "normalize", "none")
+
+# Where the arrow is placed relative to its grid point
+# "tail": the arrow starts at the grid point
+# "mid": the grid point is the midpoint of the arrow
+PIVOTS = ("tail", "mid")
+
+# Vectors shorter than this are not enlarged by "normalize" (and do not blow up
+# the others in "scale")
+MIN_MAGNITUDE = 0.01
+
+
+def arrow_vectors(u, v, treatment="scale", length=1.0):
+    """
+    The components of the vectors with the lengths treated as described above.
+    """
+    if treatment not in VECTOR_TREATMENTS:
+        raise ValueError("Unknown vector treatment %r" % (treatment, ))
+    if treatment == "none":
+        return u, v
+    magnitude = np.hypot(u, v)
+    if treatment == "normalize":
+        factor = length / np.maximum(magnitude, MIN_MAGNITUDE)
+    else:
+        largest = magnitude.max() if magnitude.size else 0.
+        factor = length / max(largest, MIN_MAGNITUDE)
+    return u * factor, v * factor
+
+
+def quiver(x, y, u, v, treatment="scale", length=1.0, pivot="tail",
+        head_offset=0., aspect=1.):
+    """
+    Bodies and heads of the arrows (u, v) at the points (x, y), any arrays of
+    the same shape (e.g., from a meshgrid). The head is moved head_offset data
+    units along the arrow beyond its end point.
+
+    Returns the data of the segment ({"x0", "y0", "x1", "y1"}) and of the
+    triangle glyph ({"x", "y", "angle"}).
+    """
+    if pivot not in PIVOTS:
+        raise ValueError("Unknown pivot %r" % (pivot, ))
+    x, y, u, v = (np.asarray(ele, dtype=float).ravel()
+            for ele in np.broadcast_arrays(x, y, u, v))
+    u, v = arrow_vectors(u, v, treatment, length)
+
+    if pivot == "mid":
+        x = x - u / 2
+        y = y - v / 2
+    x_end = x + u
+    y_end = y + v
+
+    direction = np.arctan2(v, u)
+    bodies = screen_columns({"x0": x, "y0": y, "x1": x_end, "y1": y_end})
+    heads = screen_columns({
+            "x": x_end + np.cos(direction) * head_offset,
+            "y": y_end + np.sin(direction) * head_offset,
+            # The triangle points upwards, bokeh rotates counterclockwise
+            "angle": np.arctan2(v * aspect, u) - np.pi / 2,
+            })
+    return bodies, heads
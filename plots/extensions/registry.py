@@ -0,0 +1,139 @@
+import ast
+import io
+import logging
+import os
+import time
+
+from bokeh.application import Application
+from bokeh.application.handlers import ScriptHandler
+
+from extensions.cache import drop_caches
+
+"""
+Registry of the plot apps served by the bokeh server (see extensions/server.py).
+
+With 'bokeh serve plots/*.py' every script in the plots folder is turned into an
+app at startup, including all of its imports (scipy, the custom extensions,
+...), even though most of the plots are not linked on the website.
+Instead, the registry only knows the apps that are enabled in the topic
+dictionaries of the website (website/__init__.py) and creates an app only once
+its first session is requested. An app without sessions that has not been used
+for a while is unloaded again and created anew on its next request.
+"""
+
+log = logging.getLogger(__name__)
+
+PLOTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The website the plots are embedded in. Its topic dictionaries define which
+# plots are enabled.
+DEFAULT_TOPICS_PATH = os.path.join(os.path.dirname(PLOTS_DIR), "website",
+        "__init__.py")
+
+# Seconds an app without sessions is kept loaded after its last use
+DEFAULT_UNLOAD_AFTER = 30 * 60
+
+
+def read_topics(path=DEFAULT_TOPICS_PATH):
+    """
+    Reads the topic dictionaries ({plot_name: displayed name}) from the source
+    of the website without importing it, so the bokeh server neither needs
+    flask nor fuzzywuzzy. Returns the list of plot names in the order of the
+    topics (commented out plots are not part of the dictionaries).
+    """
+    with io.open(path, encoding="utf-8") as topics_file:
+        tree = ast.parse(topics_file.read(), filename=path)
+
+    plot_names = []
+    for node in tree.body:
+        if not isinstance(node, ast.Assign) or \
+                not isinstance(node.value, ast.Dict):
+            continue
+        topic = ast.literal_eval(node.value)
+        for plot_name in topic:
+            if plot_name not in plot_names:
+                plot_names.append(plot_name)
+    return plot_names
+
+
+class LazyApplication(Application):
+    """
+    Application whose script is only read and compiled when the first document
+    is requested. The handlers the server adds on its own (e.g., the document
+    lifecycle handler) are kept and run after the script.
+    """
+    def __init__(self, name, filename):
+        super().__init__()
+        self.name = name
+        self.filename = filename
+        self._script_handler = None
+        self._sessions = 0
+        self._last_used = time.time()
+
+    @property
+    def loaded(self):
+        return self._script_handler is not None
+
+    @property
+    def idle_time(self):
+        if self._sessions > 0:
+            return 0.0
+        return time.time() - self._last_used
+
+    def load(self):
+        if self._script_handler is not None:
+            return
+        started = time.time()
+        handler = ScriptHandler(filename=self.filename)
+        if handler.failed:
+            log.error("Loading app %s failed: %s", self.name,
+                    handler.error_detail)
+        self._script_handler = handler
+        self._handlers.insert(0, handler)
+        log.info("Loaded app %s in %.3fs", self.name, time.time() - started)
+
+    def unload(self):
+        if self._script_handler is None:
+            return
+        self._handlers.remove(self._script_handler)
+        self._script_handler = None
+        drop_caches(os.path.basename(self.filename))
+        log.info("Unloaded app %s after %.0fs without sessions", self.name,
+                self.idle_time)
+
+    def initialize_document(self, doc):
+        self.load()
+        self._last_used = time.time()
+        super().initialize_document(doc)
+
+    def on_session_created(self, session_context):
+        self._sessions += 1
+        self._last_used = time.time()
+        return super().on_session_created(session_context)
+
+    def on_session_destroyed(self, session_context):
+        self._sessions = max(self._sessions - 1, 0)
+        self._last_used = time.time()
+        return super().on_session_destroyed(session_context)
+
+
+def create_applications(plot_names, plots_dir=PLOTS_DIR):
+    """
+    One lazy application per plot name, keyed by its url as expected by the
+    bokeh server. Plot names without a script in the plots folder are skipped.
+    """
+    applications = {}
+    for plot_name in plot_names:
+        filename = os.path.join(plots_dir, plot_name + ".py")
+        if not os.path.exists(filename):
+            log.warning("Plot %s is enabled but %s does not exist", plot_name,
+                    filename)
+            continue
+        applications["/" + plot_name] = LazyApplication(plot_name, filename)
+    return applications
+
+
+def unload_idle_applications(applications, unload_after=DEFAULT_UNLOAD_AFTER):
+    for application in applications.values():
+        if application.loaded and application.idle_time > unload_after:
+            application.unload()
@@ -0,0 +1,211 @@
+import numpy as np
+
+"""
+Adaptive sampling of the curves of functions.
+
+Instead of evaluating a function on a fixed grid of some hundred points (and
+splitting the grid by hand around kinks and jumps), sample_function starts with
+a coarse grid and only refines the intervals whose midpoint deviates from the
+straight line between its ends by more than DEFAULT_TOLERANCE pixels of the
+plot. Smooth parts of the curve therefore get few points, kinks and regions of
+high curvature get many.
+
+Values are compared as pixels of the viewport, clipped to half a viewport above
+and below of it, so that the parts far outside of the viewport are not refined.
+An interval that is still not resolved once it is narrower than RESOLUTION
+pixels contains a jump or a pole (e.g., of tan), unless it only crosses the
+clipping bound and changes by less than the height of the plot (a steep but
+continuous part outside of the viewport). A NaN is inserted there, which makes
+bokeh interrupt the line instead of drawing a vertical line from plus to minus
+infinity. Values outside of the domain of the function (e.g., of log or
+artanh) are NaN as well and their edges are refined the same way.
+
+The same algorithm is available in javascript (SAMPLER_CODE) for apps whose
+functions are calculated in the browser (see extensions/jsexpr.py).
+"""
+
+# Maximum deviation (in pixels) of the drawn line from the curve
+DEFAULT_TOLERANCE = 0.5
+
+# Number of points of the initial uniform grid
+INITIAL_POINTS = 33
+
+# Intervals narrower than this (in pixels) are not refined any further
+RESOLUTION = 1 / 16
+
+# Upper bound on the number of points, the refinement stops once it is reached
+MAX_POINTS = 5000
+
+
+def _evaluate(function, x):
+    with np.errstate(all="ignore"):
+        y = np.array(np.broadcast_to(function(x), x.shape), dtype=float)
+    y[~np.isfinite(y)] = np.nan
+    return y
+
+
+def sample_function(function, x_left, x_right, x_range, y_range, width,
+        height, tolerance=DEFAULT_TOLERANCE, initial_points=INITIAL_POINTS,
+        max_points=MAX_POINTS):
+    """
+    Samples the vectorized function on [x_left, x_right] for a plot of width
+    times height pixels showing x_range times y_range. Returns the x and y
+    values, with NaNs at jumps, poles and outside of the domain.
+
+        x, y = sample_function(np.tan, -10, 10, [-5, 5], [-4, 4], 600, 400)
+    """
+    x_scale = width / (x_range[1] - x_range[0])
+    y_scale = height / (y_range[1] - y_range[0])
+    margin = 0.5 * (y_range[1] - y_range[0])
+    lower = y_range[0] - margin
+    upper = y_range[1] + margin
+    min_width = RESOLUTION / x_scale
+
+    def screen(y):
+        return np.clip(y, lower, upper) * y_scale
+
+    x = np.linspace(x_left, x_right, initial_points)
+    y = _evaluate(function, x)
+    # Per interval: whether it still has to be checked and whether it contains
+    # a jump or a pole
+    active = np.ones(len(x) - 1, dtype=bool)
+    breaks = np.zeros(len(x) - 1, dtype=bool)
+
+    while active.any() and len(x) < max_points:
+        index = np.flatnonzero(active)
+        x_middle = (x[index] + x[index + 1]) / 2
+        y_middle = _evaluate(function, x_middle)
+
+        left = screen(y[index])
+        right = screen(y[index + 1])
+        middle = screen(y_middle)
+        number_finite = np.isfinite(left).astype(int) + \
+                np.isfinite(right) + np.isfinite(middle)
+        domain_edge = (number_finite > 0) & (number_finite < 3)
+        narrow = (x[index + 1] - x[index]) / 2 < min_width
+        with np.errstate(invalid="ignore"):
+            refine = (np.abs(middle - (left + right) / 2) > tolerance) | \
+                    domain_edge
+            clipped = (left != y[index] * y_scale) | \
+                    (right != y[index + 1] * y_scale)
+            jump = ~clipped | \
+                    (np.abs(y[index + 1] - y[index]) * y_scale > height)
+        breaks[index[refine & narrow & ~domain_edge & jump]] = True
+        refine &= ~narrow
+
+        refined = np.zeros_like(active)
+        refined[index[refine]] = True
+        x = np.insert(x, index[refine] + 1, x_middle[refine])
+        y = np.insert(y, index[refine] + 1, y_middle[refine])
+        # A refined interval is replaced by its two halves
+        counts = 1 + refined
+        active = np.repeat(refined, counts)
+        breaks = np.repeat(breaks, counts)
+
+    index = np.flatnonzero(breaks)
+    x = np.insert(x, index + 1, (x[index] + x[index + 1]) / 2)
+    y = np.insert(y, index + 1, np.nan)
+    return x, y
+
+
+# The javascript version of sample_function, the function f is called with a
+# Float64Array of x values and has to return their y values
+SAMPLER_CODE = """
+    function sample_function(f, x_left, x_right, x_range, y_range, width,
+            height) {
+        var tolerance = %(tolerance)r;
+        var initial_points = %(initial_points)d;
+        var max_points = %(max_points)d;
+        var x_scale = width / (x_range[1] - x_range[0]);
+        var y_scale = height / (y_range[1] - y_range[0]);
+        var margin = 0.5 * (y_range[1] - y_range[0]);
+        var lower = y_range[0] - margin;
+        var upper = y_range[1] + margin;
+        var min_width = %(resolution)r / x_scale;
+
+        function evaluate(x) {
+            var y = f(Float64Array.from(x));
+            return Array.from(x, function (_, i) {
+                return isFinite(y[i]) ? y[i] : NaN;
+            });
+        }
+
+        function screen(y) {
+            return Math.min(Math.max(y, lower), upper) * y_scale;
+        }
+
+        var x = [];
+        for (var i = 0; i < initial_points; i++) {
+            x.push(x_left + i * (x_right - x_left) / (initial_points - 1));
+        }
+        x[initial_points - 1] = x_right;
+        var y = evaluate(x);
+        var active = x.slice(1).map(function () { return true; });
+        var breaks = x.slice(1).map(function () { return false; });
+
+        while (active.indexOf(true) >= 0 && x.length < max_points) {
+            var x_middle = [];
+            for (var i = 0; i < active.length; i++) {
+                if (active[i]) {
+                    x_middle.push((x[i] + x[i + 1]) / 2);
+                }
+            }
+            var y_middle = evaluate(x_middle);
+
+            var new_x = [x[0]], new_y = [y[0]];
+            var new_active = [], new_breaks = [];
+            var k = 0;
+            for (var i = 0; i < active.length; i++) {
+                var refine = false;
+                if (active[i]) {
+                    var left = screen(y[i]), right = screen(y[i + 1]);
+                    var middle = screen(y_middle[k]);
+                    var number_finite = isFinite(left) + isFinite(right) +
+                        isFinite(middle);
+                    var domain_edge = number_finite > 0 && number_finite < 3;
+                    refine = Math.abs(middle - (left + right) / 2) >
+                        tolerance || domain_edge;
+                    var narrow = (x[i + 1] - x[i]) / 2 < min_width;
+                    var clipped = left != y[i] * y_scale ||
+                        right != y[i + 1] * y_scale;
+                    var jump = !clipped ||
+                        Math.abs(y[i + 1] - y[i]) * y_scale > height;
+                    if (refine && narrow && !domain_edge && jump) {
+                        breaks[i] = true;
+                    }
+                    refine = refine && !narrow;
+                }
+                if (refine) {
+                    new_x.push(x_middle[k]);
+                    new_y.push(y_middle[k]);
+                    new_active.push(true, true);
+                    new_breaks.push(false, false);
+                } else {
+                    new_active.push(false);
+                    new_breaks.push(breaks[i]);
+                }
+                if (active[i]) {
+                    k++;
+                }
+                new_x.push(x[i + 1]);
+                new_y.push(y[i + 1]);
+            }
+            x = new_x;
+            y = new_y;
+            active = new_active;
+            breaks = new_breaks;
+        }
+
+        var result_x = [x[0]], result_y = [y[0]];
+        for (var i = 0; i < breaks.length; i++) {
+            if (breaks[i]) {
+                result_x.push((x[i] + x[i + 1]) / 2);
+                result_y.push(NaN);
+            }
+            result_x.push(x[i + 1]);
+            result_y.push(y[i + 1]);
+        }
+        return {x: Float64Array.from(result_x), y: Float64Array.from(result_y)};
+    }
+    """ % {"tolerance": DEFAULT_TOLERANCE, "initial_points": INITIAL_POINTS,
+            "max_points": MAX_POINTS, "resolution": RESOLUTION}
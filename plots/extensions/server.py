@@ -0,0 +1,89 @@
+import argparse
+import logging
+
+from bokeh.server.server import Server
+from tornado.ioloop import PeriodicCallback
+
+from extensions import instrumentation
+from extensions.registry import (DEFAULT_TOPICS_PATH, DEFAULT_UNLOAD_AFTER,
+        create_applications, read_topics, unload_idle_applications)
+
+"""
+Entry point of the bokeh server for the plots. Replaces 'bokeh serve *.py' and
+only serves the plots that are enabled on the website, each one created on its
+first request and unloaded after it has been idle for a while (see
+extensions/registry.py). The callbacks of the apps are instrumented and their
+metrics are served under /metrics (see extensions/instrumentation.py). Run it
+from within the plots folder:
+
+    python3 -m extensions.server --port 9001 --allow-websocket-origin=*:9001
+
+Plot names given as arguments are served instead of the enabled ones, e.g.,
+
+    python3 -m extensions.server phasen_plot richtungsfeld
+"""
+
+log = logging.getLogger(__name__)
+
+# Milliseconds between two checks for idle apps
+UNLOAD_CHECK_INTERVAL = 60 * 1000
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(prog="python3 -m extensions.server",
+            description="Serves the enabled plots of the website with bokeh.")
+    parser.add_argument("plots", nargs="*", metavar="PLOT",
+            help="names of the plots to serve (default: all plots enabled in "
+            "the topic dictionaries of the website)")
+    parser.add_argument("--topics", default=DEFAULT_TOPICS_PATH,
+            help="python file containing the topic dictionaries "
+            "(default: %(default)s)")
+    parser.add_argument("--port", type=int, default=5006)
+    parser.add_argument("--address", default=None)
+    parser.add_argument("--allow-websocket-origin", action="append",
+            default=None, metavar="HOST[:PORT]")
+    parser.add_argument("--num-procs", type=int, default=1,
+            help="number of worker processes, 0 uses all cores")
+    parser.add_argument("--unload-after", type=float,
+            default=DEFAULT_UNLOAD_AFTER, metavar="SECONDS",
+            help="unload an app after it has been without sessions for this "
+            "many seconds (default: %(default)s)")
+    parser.add_argument("--log-level", default="info",
+            choices=["debug", "info", "warning", "error"])
+    return parser.parse_args(argv)
+
+
+def create_server(arguments, **server_kwargs):
+    instrumentation.install()
+    plot_names = arguments.plots or read_topics(arguments.topics)
+    applications = create_applications(plot_names)
+    log.info("Serving %d plots: %s", len(applications),
+            ", ".join(sorted(name.lstrip("/") for name in applications)))
+
+    server = Server(applications,
+            port=arguments.port,
+            address=arguments.address,
+            allow_websocket_origin=arguments.allow_websocket_origin,
+            num_procs=arguments.num_procs,
+            extra_patterns=[("/metrics", instrumentation.MetricsHandler)],
+            **server_kwargs)
+
+    # Registered after forking so that every worker process checks its own apps
+    PeriodicCallback(
+            lambda: unload_idle_applications(applications,
+                arguments.unload_after),
+            UNLOAD_CHECK_INTERVAL).start()
+    return server
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    logging.basicConfig(level=arguments.log_level.upper(),
+            format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    server = create_server(arguments)
+    server.start()
+    server.io_loop.start()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import numpy as np
+
+from extensions.cache import memoize
+
+"""
+Spectral solution of the heat equation u_t = k u_xx on a bar with homogeneous
+Dirichlet boundary conditions.
+
+The eigenfunctions of the problem on a bar of length L are the sine modes
+sin(n pi x / L), each one decays by its own factor exp(-k (n pi / L)^2 t). An
+arbitrary initial temperature profile (given at the points of a uniform grid
+including both ends) is projected onto the first N modes by a fast sine
+transform, which is an FFT of the profile extended to an odd, periodic
+function:
+
+    coefficients = sine_coefficients(profile, N)
+
+The evolution for many points in time (e.g., all the values of a time slider)
+is then one matrix product of the decayed coefficients (one row per point in
+time) with the sampled modes (one row per mode):
+
+    frames = evolve(coefficients, decay_factors(L, k, N, t), sine_basis(50, N))
+
+The sampled modes only depend on the number of points and modes, the decay
+factors on the length, the conductivity and the number of modes. Both are
+cached for all sessions.
+"""
+
+
+def sine_coefficients(profile, modes):
+    """
+    The coefficients of the first modes of the sine series of the profile. The
+    values at both ends of the grid are taken as zero.
+    """
+    interior = np.asarray(profile, dtype=float)[1:-1]
+    intervals = len(interior) + 1
+    # The odd extension 0, f_1, ..., f_n, 0, -f_n, ..., -f_1
+    extended = np.zeros(2 * intervals)
+    extended[1:intervals] = interior
+    extended[intervals + 1:] = -interior[::-1]
+    coefficients = -np.fft.rfft(extended).imag[1:intervals] / intervals
+    if modes > len(coefficients):
+        coefficients = np.append(coefficients,
+                np.zeros(modes - len(coefficients)))
+    return coefficients[:modes]
+
+
+@memoize()
+def sine_basis(points, modes):
+    """
+    The sine modes at the points of the uniform grid, one mode per row.
+    """
+    n = np.arange(1, modes + 1)
+    return np.sin(np.pi * np.outer(n, np.linspace(0, 1, points)))
+
+
+@memoize()
+def decay_factors(length, conductivity, modes, times):
+    """
+    The factors the amplitudes of the modes have decayed by at the times (one
+    row per point in time).
+    """
+    n = np.arange(1, modes + 1)
+    times = np.reshape(times, (-1, 1))
+    return np.exp(-conductivity * (n * np.pi / length)**2 * times)
+
+
+def evolve(coefficients, decay, basis):
+    """
+    The sine series with the decayed coefficients at the grid points, one row
+    per row of the decay factors.
+    """
+    return (decay * coefficients) @ basis
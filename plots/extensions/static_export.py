@@ -0,0 +1,471 @@
+import argparse
+import base64
+import hashlib
+import io
+import itertools
+import json
+import logging
+import os
+import sys
+
+import numpy as np
+
+from bokeh.application import Application
+from bokeh.application.handlers import ScriptHandler
+from bokeh.document import Document
+from bokeh.document.events import (ColumnDataChangedEvent, ColumnsPatchedEvent,
+        ColumnsStreamedEvent, ModelChangedEvent)
+from bokeh.embed import file_html
+from bokeh.io.doc import curdoc, set_curdoc
+from bokeh.models import ColumnDataSource, CustomJS
+from bokeh.models.widgets import RadioButtonGroup, Slider
+from bokeh.resources import CDN, INLINE
+
+from extensions.payload import SCREEN_DTYPE
+
+"""
+Static export of plots with few discrete controls into standalone html pages
+that need no bokeh server at all.
+
+Plots like variationsformulierung (one slider) or finite_elemente (two radio
+buttons times 25 slider steps) only reach a few hundred different states. The
+exporter runs the script of such a plot once, enumerates every combination of
+its sliders (from start to end in steps of step) and radio button groups and
+sets the widgets accordingly, so that the python callbacks of the plot calculate
+the value pairs as usual. Everything the callbacks change (the columns of the
+ColumnDataSources and properties like the text of a label) is recorded and
+packed into one binary table:
+
+    - an index of (kind, offset, length) triples (uint32) for every state and
+      every recorded slot, where kind is 0 for a numeric column, 1 for a list of
+      numeric columns (e.g., of a multi_line, stored with NaNs in between) and
+      2 for any other value (offset is the position in a JSON list of values),
+    - all numeric values as float32, identical columns are stored once.
+
+The table is embedded (base64 encoded) in a standalone html page of the plot.
+A javascript callback on the widgets looks up the current state in the table
+and replaces the data of the plot, hence the page can be served as a static file
+(e.g., by Apache next to the website):
+
+    python3 -m extensions.static_export variationsformulierung.py \\
+        finite_elemente.py trigonometrische_funktionen.py --output-dir static
+
+Widgets other than sliders and radio button groups with python callbacks, and
+callbacks that change the range or step of a slider (e.g., the switch between
+the cartesian and the polar representation in komplexes_wurzelziehen) can not be
+exported. Neither can plots with more than --max-states states.
+"""
+
+log = logging.getLogger(__name__)
+
+# Plots with more states are rejected, their table would be too large to be
+# loaded with the page
+DEFAULT_MAX_STATES = 10000
+
+KIND_ARRAY = 0
+KIND_NESTED = 1
+KIND_JSON = 2
+
+# Looks up the current state in the table and sets all recorded slots. The
+# decoded table is kept per page, since the callback runs for every change.
+_LOOKUP_CODE = """
+    var tables = window._expmath_static_tables =
+        window._expmath_static_tables || {};
+    var key = controls[0].id;
+    var table = tables[key];
+    if (table == null) {
+        var binary = atob(packed);
+        var bytes = new Uint8Array(binary.length);
+        for (var i = 0; i < binary.length; i++) {
+            bytes[i] = binary.charCodeAt(i);
+        }
+        var index_length = number_of_states * slot_models.length * 3;
+        table = tables[key] = {
+            index: new Uint32Array(bytes.buffer, 0, index_length),
+            values: new Float32Array(bytes.buffer, index_length * 4),
+        };
+    }
+
+    var state = 0;
+    controls.forEach(function (control, position) {
+        var step;
+        if (control.active !== undefined) {
+            step = control.active;
+        } else {
+            step = Math.round((control.value - starts[position]) /
+                steps[position]);
+        }
+        step = Math.min(Math.max(step, 0), counts[position] - 1);
+        state += step * strides[position];
+    });
+
+    function split_at_nan(values) {
+        var lines = [];
+        var start = 0;
+        for (var i = 0; i <= values.length; i++) {
+            if (i == values.length || isNaN(values[i])) {
+                lines.push(values.slice(start, i));
+                start = i + 1;
+            }
+        }
+        return lines;
+    }
+
+    var changed_sources = [];
+    slot_models.forEach(function (model, slot) {
+        var entry = (state * slot_models.length + slot) * 3;
+        var kind = table.index[entry];
+        var offset = table.index[entry + 1];
+        var length = table.index[entry + 2];
+        var value;
+        if (kind == 2) {
+            value = json_values[offset];
+        } else {
+            value = table.values.subarray(offset, offset + length);
+            if (kind == 1) {
+                value = split_at_nan(value);
+            }
+        }
+
+        if (slot_columns[slot] != null) {
+            // Changed in place followed by a single emit per source
+            model.data[slot_columns[slot]] = value;
+            if (changed_sources.indexOf(model) < 0) {
+                changed_sources.push(model);
+            }
+        } else {
+            model[slot_attributes[slot]] = value;
+        }
+    });
+    changed_sources.forEach(function (source) {
+        source.change.emit();
+    });
+    """
+
+
+class ExportError(ValueError):
+    pass
+
+
+def load_document(filename):
+    """
+    Runs the script of a plot like the bokeh server does and returns its
+    document.
+    """
+    handler = ScriptHandler(filename=filename)
+    document = Document()
+    Application(handler).initialize_document(document)
+    if handler.failed:
+        raise ExportError("Running %s failed: %s" % (filename, handler.error))
+    return document
+
+
+def _has_python_callbacks(model):
+    return len(model._callbacks) > 0 or len(model._event_callbacks) > 0
+
+
+def find_controls(document):
+    """
+    The widgets with python callbacks, i.e., the ones the state of the plot
+    depends on.
+    """
+    controls = []
+    for model in document._all_models.values():
+        if not _has_python_callbacks(model):
+            continue
+        if isinstance(model, (Slider, RadioButtonGroup)):
+            controls.append(model)
+        elif model.__view_model__ != "ColumnDataSource":
+            raise ExportError("%s has python callbacks and can not be "
+                    "exported" % model.__view_model__)
+    # A stable order of the controls (the order of the layout is not known)
+    controls.sort(key=lambda model: (model.__view_model__,
+            getattr(model, "title", "") or "", model.id))
+    return controls
+
+
+def control_values(control):
+    """
+    All values a slider can reach or all buttons of a radio button group.
+    """
+    if isinstance(control, RadioButtonGroup):
+        return list(range(len(control.labels)))
+    number_of_steps = int(round((control.end - control.start) / control.step))
+    # Rounded like the values the browser sends
+    return [round(control.start + step * control.step, 10)
+            for step in range(number_of_steps + 1)]
+
+
+def _slider_configuration(control):
+    if isinstance(control, RadioButtonGroup):
+        return (len(control.labels),)
+    return (control.start, control.end, control.step)
+
+
+def _set_control(control, value):
+    if isinstance(control, RadioButtonGroup):
+        control.active = value
+    else:
+        control.value = value
+
+
+def _packed_value(value):
+    """
+    The kind of a recorded value and its numeric values (or the value itself).
+    """
+    if isinstance(value, np.ndarray) and value.dtype.kind in "biuf":
+        return KIND_ARRAY, np.ravel(value).astype(SCREEN_DTYPE)
+    if isinstance(value, (list, tuple)):
+        try:
+            array = np.asarray(value, dtype=SCREEN_DTYPE)
+        except (TypeError, ValueError):
+            array = None
+        if array is not None and array.ndim == 1:
+            return KIND_ARRAY, array
+        if value and all(isinstance(line, (list, tuple, np.ndarray))
+                for line in value):
+            try:
+                lines = [np.ravel(np.asarray(line, dtype=SCREEN_DTYPE))
+                        for line in value]
+            except (TypeError, ValueError):
+                lines = None
+            if lines is not None:
+                separator = np.full(1, np.nan, dtype=SCREEN_DTYPE)
+                parts = []
+                for line in lines:
+                    if parts:
+                        parts.append(separator)
+                    parts.append(line)
+                return KIND_NESTED, np.concatenate(parts)
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    return KIND_JSON, value
+
+
+class _Recorder(object):
+    """
+    Records which sources and properties the callbacks change.
+    """
+    def __init__(self, controls):
+        self.controls = set(controls)
+        # Slot (model, column or None, attribute or None) to its initial value
+        self.slots = {}
+
+    def __call__(self, event):
+        if isinstance(event, (ColumnDataChangedEvent, ColumnsStreamedEvent,
+                ColumnsPatchedEvent)):
+            self.add_source(event.column_source)
+        elif isinstance(event, ModelChangedEvent):
+            if event.model in self.controls:
+                return
+            if isinstance(event.model, ColumnDataSource) and \
+                    event.attr == "data":
+                self.add_source(event.model)
+            else:
+                key = (event.model, None, event.attr)
+                self.slots.setdefault(key, event.old)
+
+    def add_source(self, source):
+        # The columns are read for every state, so their initial values are not
+        # needed
+        self.slots.setdefault((source, "", None), None)
+
+
+def record_states(document, controls, max_states=DEFAULT_MAX_STATES):
+    """
+    Sets the controls to every combination of their values and records the
+    values of all slots after the callbacks ran. Returns the slots and the
+    values of every state (in the order of itertools.product, i.e., the last
+    control changes fastest).
+    """
+    values = [control_values(control) for control in controls]
+    number_of_states = int(np.prod([len(value) for value in values]))
+    if number_of_states > max_states:
+        raise ExportError("%d states exceed the limit of %d" %
+                (number_of_states, max_states))
+    configurations = [_slider_configuration(control) for control in controls]
+    initial = [control.active if isinstance(control, RadioButtonGroup) else
+            control.value for control in controls]
+
+    recorder = _Recorder(controls)
+    document.on_change(recorder)
+    previous_document = curdoc()
+    set_curdoc(document)
+    states = []
+    try:
+        for combination in itertools.product(*values):
+            for control, value in zip(controls, combination):
+                _set_control(control, value)
+            if [_slider_configuration(control) for control in controls] != \
+                    configurations:
+                raise ExportError("The callbacks change the range of the "
+                        "sliders, which can not be exported")
+            state = {}
+            for model, column, attribute in recorder.slots:
+                if column is not None:
+                    for name, data in model.data.items():
+                        state[(model, name, None)] = data
+                else:
+                    state[(model, None, attribute)] = getattr(model, attribute)
+            states.append(state)
+
+        for control, value in zip(controls, initial):
+            _set_control(control, value)
+    finally:
+        set_curdoc(previous_document)
+        document.remove_on_change(recorder)
+
+    # Properties that were first changed in a later state still had their
+    # initial value in the states before
+    slots = []
+    for model, column, attribute in recorder.slots:
+        if column is not None:
+            slots += [(model, name, None) for name in model.data]
+        else:
+            slots.append((model, None, attribute))
+    for state in states:
+        for slot in slots:
+            if slot not in state:
+                state[slot] = recorder.slots.get(slot)
+    return slots, states
+
+
+def pack_states(slots, states):
+    """
+    Packs the recorded states into the binary table (see above). Slots that have
+    the same value in all states are dropped, the document already contains
+    them. Returns the kept slots, the table and the list of JSON values.
+    """
+    packed = [[_packed_value(state[slot]) for slot in slots]
+            for state in states]
+
+    def fingerprint(kind, value):
+        if kind == KIND_JSON:
+            return (kind, json.dumps(value, sort_keys=True, default=str))
+        return (kind, hashlib.sha1(value.tobytes()).hexdigest())
+
+    kept = [position for position, slot in enumerate(slots)
+            if len(set(fingerprint(*state[position])
+                for state in packed)) > 1]
+
+    index = np.zeros((len(states), len(kept), 3), dtype=np.uint32)
+    arrays = []
+    offsets = {}
+    size = 0
+    json_values = []
+    json_offsets = {}
+    for state_number, state in enumerate(packed):
+        for slot_number, position in enumerate(kept):
+            kind, value = state[position]
+            key = fingerprint(kind, value)
+            if kind == KIND_JSON:
+                if key not in json_offsets:
+                    json_offsets[key] = len(json_values)
+                    json_values.append(value)
+                index[state_number, slot_number] = (kind, json_offsets[key], 0)
+                continue
+            if key not in offsets:
+                offsets[key] = size
+                arrays.append(value)
+                size += len(value)
+            index[state_number, slot_number] = (kind, offsets[key], len(value))
+
+    values = np.concatenate(arrays) if arrays else \
+            np.empty(0, dtype=SCREEN_DTYPE)
+    table = index.tobytes() + values.astype(SCREEN_DTYPE).tobytes()
+    return [slots[position] for position in kept], table, json_values
+
+
+def attach_lookup(controls, slots, table, json_values):
+    """
+    Replaces the python callbacks of the controls by the javascript lookup in
+    the table.
+    """
+    strides = []
+    stride = 1
+    for control in reversed(controls):
+        strides.insert(0, stride)
+        stride *= len(control_values(control))
+
+    lookup = CustomJS(args={
+            "controls": list(controls),
+            "counts": [len(control_values(control)) for control in controls],
+            "starts": [getattr(control, "start", 0) for control in controls],
+            "steps": [getattr(control, "step", 1) for control in controls],
+            "strides": strides,
+            "number_of_states": stride,
+            "slot_models": [model for model, _, _ in slots],
+            "slot_columns": [column for _, column, _ in slots],
+            "slot_attributes": [attribute for _, _, attribute in slots],
+            "json_values": json_values,
+            "packed": base64.b64encode(table).decode("ascii"),
+            },
+            code=_LOOKUP_CODE)
+
+    for control in controls:
+        control._callbacks.clear()
+        control._event_callbacks.clear()
+        if isinstance(control, RadioButtonGroup):
+            control.js_on_change("active", lookup)
+        else:
+            control.js_on_change("value", lookup)
+
+
+def export_plot(filename, output_dir, max_states=DEFAULT_MAX_STATES,
+        resources=CDN):
+    """
+    Exports the plot to a standalone html page in output_dir, named like the
+    script. Returns the path of the page and the number of states.
+    """
+    document = load_document(filename)
+    controls = find_controls(document)
+    if not controls:
+        raise ExportError("No sliders or radio button groups with python "
+                "callbacks found")
+    slots, states = record_states(document, controls, max_states)
+    slots, table, json_values = pack_states(slots, states)
+    attach_lookup(controls, slots, table, json_values)
+
+    for model in document._all_models.values():
+        if _has_python_callbacks(model):
+            raise ExportError("%s still has python callbacks" %
+                    model.__view_model__)
+
+    name = os.path.splitext(os.path.basename(filename))[0]
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    path = os.path.join(output_dir, name + ".html")
+    with io.open(path, "w", encoding="utf-8") as page:
+        page.write(file_html(document, resources, title=name))
+    log.info("Exported %s with %d states (%d bytes table) to %s", name,
+            len(states), len(table), path)
+    return path, len(states)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            prog="python3 -m extensions.static_export",
+            description="Exports plots with few states into standalone html "
+            "pages that need no bokeh server.")
+    parser.add_argument("scripts", nargs="+", metavar="SCRIPT")
+    parser.add_argument("--output-dir", default="static")
+    parser.add_argument("--max-states", type=int, default=DEFAULT_MAX_STATES)
+    parser.add_argument("--inline", action="store_true",
+            help="include BokehJS in the pages instead of loading it from the "
+            "CDN")
+    arguments = parser.parse_args(argv)
+    logging.basicConfig(level="INFO", format="%(levelname)s %(message)s")
+
+    failed = False
+    for filename in arguments.scripts:
+        try:
+            export_plot(filename, arguments.output_dir, arguments.max_states,
+                    INLINE if arguments.inline else CDN)
+        except ExportError as error:
+            log.error("%s: %s", filename, error)
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,12 @@ from bokeh.core.properties import Instance, String
 from bokeh.models import ColumnDataSource, LayoutDOM
 from bokeh.util.compiler import TypeScript
 
+from extensions.prebuilt import use_prebuilt_bundle
+
+# The TypeScript implementation is only compiled if no prebuilt bundle is
+# available (see extensions/prebuilt.py)
+use_prebuilt_bundle()
+
 
 # This custom extension model will have a DOM view that should layout-able in
 # Bokeh layouts, so use ``LayoutDOM`` as the base class. If you wanted to create
@@ -1,9 +1,15 @@
 import os
 
-from bokeh.core.properties import Instance, String
+from bokeh.core.properties import Float, Instance, Int, String, Tuple
 from bokeh.models import ColumnDataSource, LayoutDOM
 from bokeh.util.compiler import TypeScript
 
+from extensions.prebuilt import use_prebuilt_bundle
+
+# The TypeScript implementation is only compiled if no prebuilt bundle is
+# available (see extensions/prebuilt.py)
+use_prebuilt_bundle()
+
 # General constants for the 3d plot
 plot_width = 400
 plot_height = 400
@@ -17,7 +23,9 @@ z_range = [-5, 5]
 The TypeScript code initializes visJS library to plot a 3d scence. It therefore
 connects the bokeh ColumnDataSource that is sent to the client with the 3d
 plot's input. A listener is set up that will update the plot every time new data
-is sent
+is sent. The geometry of the scene is given by the properties of the model
+(defaulting to the constants above), so that the TypeScript source is the same
+for every plot and can be compiled once in advance.
 """
 
 
@@ -32,9 +40,7 @@ class Vector3d(LayoutDOM):
     # of the custom extension model.
     __implementation__ = TypeScript(
             open(os.path.dirname(os.path.abspath(__file__)) +\
-                    "/vector3d.ts", "r").read() %\
-            (plot_width, plot_height, line_width, x_range[0], x_range[1],
-            y_range[0], y_range[1], z_range[0], z_range[1]))
+                    "/vector3d.ts", "r").read())
 
     # Below are all the "properties" for this model. Bokeh properties are
     # class attributes that define the fields (and their types) that can be
@@ -63,3 +69,17 @@ class Vector3d(LayoutDOM):
     v = String
 
     w = String
+
+    # The size of the 3d scene in pixels and the thickness of the vectors
+    graph_width = Int(default=plot_width)
+
+    graph_height = Int(default=plot_height)
+
+    line_width = Int(default=line_width)
+
+    # The fixed extent of the axes of the 3d scene
+    x_range = Tuple(Float, Float, default=tuple(x_range))
+
+    y_range = Tuple(Float, Float, default=tuple(y_range))
+
+    z_range = Tuple(Float, Float, default=tuple(z_range))
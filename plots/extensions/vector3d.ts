@@ -14,11 +14,10 @@ declare namespace vis {
   }
 }
 
-// This defines some default options for the Graph3d feature of vis.js
+// This defines the options for the Graph3d feature of vis.js that are the same
+// for every plot. The geometry is taken from the model's properties.
 // See: http://visjs.org/graph3d_examples.html for more details.
 const OPTIONS = {
-  width: '%dpx',
-  height: '%dpx',
   style: 'line',
   showPerspective: true,
   showGrid: true,
@@ -30,15 +29,6 @@ const OPTIONS = {
     vertical: 0.5,
     distance: 1.7,
   },
-  dataColor: {
-    strokeWidth: %d,
-  },
-  xMin: %d,
-  xMax: %d,
-  yMin: %d,
-  yMax: %d,
-  zMin: %d,
-  zMax: %d,
 }
 // To create custom model extensions that will render on to the HTML canvas
 // or into the DOM, we must create a View subclass for the model.
@@ -65,7 +55,7 @@ export class Vector3dView extends LayoutDOMView {
     // Many Bokeh views ignore this default <div>, and instead do things like
     // draw to the HTML canvas. In this case though, we use the <div> to attach
     // a Graph3d to the DOM.
-    this._graph = new vis.Graph3d(this.el, this.get_data(), OPTIONS)
+    this._graph = new vis.Graph3d(this.el, this.get_data(), this.get_options())
 
     // Set a listener so that when the Bokeh data source has a change
     // event, we can process the new data
@@ -74,6 +64,30 @@ export class Vector3dView extends LayoutDOMView {
     })
   }
 
+  // Combines the general options with the geometry given by the model
+  get_options(): object {
+    return {
+      width: `${this.model.graph_width}px`,
+      height: `${this.model.graph_height}px`,
+      style: OPTIONS.style,
+      showPerspective: OPTIONS.showPerspective,
+      showGrid: OPTIONS.showGrid,
+      keepAspectRatio: OPTIONS.keepAspectRatio,
+      verticalRatio: OPTIONS.verticalRatio,
+      legendLabel: OPTIONS.legendLabel,
+      cameraPosition: OPTIONS.cameraPosition,
+      dataColor: {
+        strokeWidth: this.model.line_width,
+      },
+      xMin: this.model.x_range[0],
+      xMax: this.model.x_range[1],
+      yMin: this.model.y_range[0],
+      yMax: this.model.y_range[1],
+      zMin: this.model.z_range[0],
+      zMax: this.model.z_range[1],
+    }
+  }
+
   // This is the callback executed when the Bokeh data changed. Its basic
   // function is to adapt the Bokeh data source to the vis.js DataSet format.
   get_data(): vis.DataSet {
@@ -134,6 +148,13 @@ export namespace Vector3d {
     u: p.Property<string>
     v: p.Property<string>
     w: p.Property<string>
+
+    graph_width: p.Property<number>
+    graph_height: p.Property<number>
+    line_width: p.Property<number>
+    x_range: p.Property<number[]>
+    y_range: p.Property<number[]>
+    z_range: p.Property<number[]>
    
     data_source: p.Property<ColumnDataSource>
   }
@@ -169,6 +190,13 @@ export class Vector3d extends LayoutDOM {
       u:            [ p.String   ],
       v:            [ p.String   ],
       w:            [ p.String   ],
+
+      graph_width:  [ p.Number, 400      ],
+      graph_height: [ p.Number, 400      ],
+      line_width:   [ p.Number, 4        ],
+      x_range:      [ p.Array,  [-5, 5]  ],
+      y_range:      [ p.Array,  [-5, 5]  ],
+      z_range:      [ p.Array,  [-5, 5]  ],
       
       data_source:  [ p.Instance ],
     })
@@ -0,0 +1,145 @@
+import math
+from collections import namedtuple
+
+from bokeh.io import curdoc
+
+from extensions.sampling import sample_function
+
+"""
+Level of detail of the function curves depending on the viewport.
+
+Instead of calculating the curves once over a fixed interval, which looks coarse
+when zooming in and ends abruptly when zooming out, the apps calculate them over
+a window around the visible part of the plot at the resolution of the screen.
+
+The window is snapped to a grid whose spacing is a power of two, depending on
+the visible width (the zoom level), and extends one grid cell beyond the visible
+part on both sides. Small pans and zooms therefore stay within the current
+window and do not need any new value pairs, and the windows of different users
+looking at the same part of a plot are the same (hence cached only once, see
+extensions/cache.py). The resolution is the one of the smallest visible width of
+the zoom level.
+
+Zooming with the mouse wheel changes the ranges of the plot many times a second.
+The callbacks of Viewport.on_change are debounced, i.e., they only run once the
+ranges did not change for a while, and a pending run is cancelled whenever the
+ranges change again.
+
+    viewport = Viewport(plot)
+    x, y = sample_window(np.sin, viewport.window)
+    viewport.on_change(lambda window: update_curves())
+
+VIEWPORT_CODE is the same calculation of the window in javascript.
+"""
+
+# Milliseconds the ranges have to stay the same before the curves are
+# recalculated
+DEFAULT_DELAY = 100
+
+# The window around the visible ranges (in data units) and the size of the
+# plot (in pixels) at the resolution of the window
+Window = namedtuple("Window",
+        ["x_left", "x_right", "y_bottom", "y_top", "width", "height"])
+
+
+def _snapped(start, end):
+    """
+    The interval around [start, end] snapped to the grid of its zoom level and
+    the width of the narrowest interval of the zoom level.
+    """
+    span = max(end - start, 1e-12)
+    level = 2.0 ** math.ceil(math.log2(span))
+    grid = level / 4
+    left = math.floor(start / grid) * grid - grid
+    right = math.ceil(end / grid) * grid + grid
+    return left, right, level / 2
+
+
+def window_of(x_start, x_end, y_start, y_end, plot_width, plot_height):
+    x_left, x_right, x_resolution = _snapped(x_start, x_end)
+    y_bottom, y_top, y_resolution = _snapped(y_start, y_end)
+    return Window(x_left, x_right, y_bottom, y_top,
+            plot_width * (x_right - x_left) / x_resolution,
+            plot_height * (y_top - y_bottom) / y_resolution)
+
+
+def sample_window(function, window, **kwargs):
+    """
+    Samples the curve of the function over the window (see
+    extensions/sampling.py).
+    """
+    return sample_function(function, window.x_left, window.x_right,
+            (window.x_left, window.x_right), (window.y_bottom, window.y_top),
+            window.width, window.height, **kwargs)
+
+
+class Viewport(object):
+    """
+    The window of a plot (a figure with numeric x and y ranges).
+    """
+    def __init__(self, plot):
+        self.plot = plot
+        self.current = self.window
+
+    @property
+    def window(self):
+        plot = self.plot
+        return window_of(plot.x_range.start, plot.x_range.end,
+                plot.y_range.start, plot.y_range.end, plot.plot_width,
+                plot.plot_height)
+
+    def on_change(self, callback, delay=DEFAULT_DELAY):
+        """
+        Calls callback(window) whenever pan or zoom moved the plot to another
+        window.
+        """
+        # The pending timeout callback, every session executes the script of the
+        # app anew, so this state is per session
+        state = {"pending": None}
+
+        def run():
+            state["pending"] = None
+            window = self.window
+            if window != self.current:
+                self.current = window
+                callback(window)
+
+        def changed(attr, old, new):
+            document = curdoc()
+            if document.session_context is None:
+                # Not served by a bokeh server, there is no IOLoop
+                run()
+                return
+            if state["pending"] is not None:
+                document.remove_timeout_callback(state["pending"])
+            state["pending"] = document.add_timeout_callback(run, delay)
+
+        for plot_range in (self.plot.x_range, self.plot.y_range):
+            plot_range.on_change("start", changed)
+            plot_range.on_change("end", changed)
+
+
+# The javascript version of window_of, returns an object with the fields of
+# Window
+VIEWPORT_CODE = """
+    function viewport_window(x_start, x_end, y_start, y_end, plot_width,
+            plot_height) {
+        function snapped(start, end) {
+            var span = Math.max(end - start, 1e-12);
+            var level = Math.pow(2, Math.ceil(Math.log2(span)));
+            var grid = level / 4;
+            return [Math.floor(start / grid) * grid - grid,
+                Math.ceil(end / grid) * grid + grid, level / 2];
+        }
+        var x = snapped(x_start, x_end);
+        var y = snapped(y_start, y_end);
+        return {
+            x_left: x[0],
+            x_right: x[1],
+            y_bottom: y[0],
+            y_top: y[1],
+            width: plot_width * (x[1] - x[0]) / x[2],
+            height: plot_height * (y[1] - y[0]) / y[2],
+        };
+    }
+    """
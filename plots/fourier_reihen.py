@@ -1,11 +1,22 @@
 import numpy as np
 
+from bokeh import events
 from bokeh.io import curdoc
-from bokeh.models import ColumnDataSource
-from bokeh.models.widgets import Slider, RadioButtonGroup, Toggle
-from bokeh.layouts import Row, WidgetBox
+from bokeh.models import ColumnDataSource, Span, BoxAnnotation, Range1d, \
+        FreehandDrawTool
+from bokeh.models.widgets import Slider, RadioButtonGroup, Toggle, Button
+from bokeh.layouts import Row, Column, WidgetBox
 from bokeh.plotting import Figure
 
+from extensions.cache import memoize
+from extensions.coalesce import coalesce, on_slider_change
+from extensions.fourier import resample_strokes, fourier_coefficients, \
+        amplitude_spectrum, partial_sum
+from extensions.incremental import update_source
+from extensions.payload import screen_array
+from extensions.sampling import INITIAL_POINTS
+from extensions.viewport import Viewport, sample_window
+
 """
 This plot introduces the user to the idea of Fourier series approximation of
 function of arbitrary periodicity. This topic is useful when projecting
@@ -14,11 +25,20 @@ Eigenfunction fundamental solutions.
 The user selects between representative functions, adjusts the period and the
 amplitude. The original function is drawn as well as the approximation based on
 the order chosen.
+Instead of a representative function the user can also sketch one period of a
+function, whose coefficients are calculated by an FFT (see
+extensions/fourier.py). Below the plot the amplitudes of the harmonics are
+shown, while sketching they follow the stroke.
+The curves are calculated over the visible part of the plot and again whenever
+the user pans or zooms (see extensions/viewport.py). The partial sums of all
+orders are calculated once per function, so changing the order only looks up
+another row of them.
 """
 
 
 # Geometry constants for the plot
 HEIGHT = 400
+HEIGHT_SPECTRUM = 200
 WIDTH_PLOT = 600
 WIDTH_TOTAL = 800
 
@@ -32,125 +52,302 @@ Y_TOP = 2
 LINE_WIDTH_ORIGINAL = 2
 LINE_WIDTH_APPROXIMATION = 1
 
+# Points per period of the highest harmonic in the initial grid of the sampler.
+# According to Shannon's theorem a coarser grid could miss the oscillations at
+# higher order (or the jumps of the original functions) altogether.
+POINTS_PER_PERIOD = 8
+
+# The highest order of the approximation
+MAX_ORDER = 50
+
+# Number of points per period the partial sums are cached at. Between them the
+# approximation is interpolated linearly, at the highest order this deviates
+# from the series by about 2e-4 of the amplitude.
+PERIOD_POINTS = 4096
+
+# Number of samples per period a sketch is resampled to and the highest order of
+# its approximation
+SKETCH_SAMPLES = 1024
+SKETCH_MAX_ORDER = 256
+
+# The index of the sketch in the function selector
+SKETCH = 3
+
 
 """
-Define the original definition as well as the Fourier series approximation
-assuming a general periodicity with period "period" and amplitude "amplitude"
-measuring the distance between the x-axis with the top-most point or bottom-most
-point, respectively. Order is the upper limit for the sumation over the
-components of the Fourier series.
+Define the original definition as well as the Fourier coefficients assuming a
+general periodicity with period "period" and amplitude "amplitude" measuring the
+distance between the x-axis with the top-most point or bottom-most point,
+respectively. The coefficients a_0, a_k and b_k (k = 1, ..., order) are those of
+a function with period 1 and amplitude 1, the series of the other functions
+follow by scaling.
 """
 def RECTANGLE(x, period, amplitude):
-    y = np.piecewise(x, [x % period < period/2, x % period >= period/2],
-            [amplitude, -amplitude])
-    return y
+    return np.where(x % period < period/2, amplitude, -amplitude)
 
-def RECTANGLE_APPROXIMATION(x, period, amplitude, order):
-    y = np.zeros(x.shape)
-    for k in range(1, order+1):
-        if k % 2 == 0:
-            continue
-        else:
-            b_k = 4*amplitude/(np.pi * k)
-            y += b_k * np.sin((2*np.pi*k*x)/(period))
-    return y
+def RECTANGLE_COEFFICIENTS(k):
+    b_k = np.where(k % 2 == 1, 4/(np.pi * k), 0.)
+    return 0., np.zeros(k.shape), b_k
 
 
 def SAW_TOOTH(x, period, amplitude):
     slope = 2*amplitude/period
     offset = -amplitude
-    # The vectorized version can use mulitple cores simultaneously
-    f = np.vectorize(lambda ele: (ele % period) * slope + offset,
-            otypes=[np.float])
-    y = f(x)
-    return y
+    return (x % period) * slope + offset
 
-def SAW_TOOTH_APPROXIMATION(x, period, amplitude, order):
-    y = np.zeros(x.shape)
-    for k in range(1, order+1):
-        b_k = - 2*amplitude/(np.pi*k)
-        y += b_k * np.sin((2*np.pi*k*x)/(period))
-    return y
+def SAW_TOOTH_COEFFICIENTS(k):
+    return 0., np.zeros(k.shape), - 2/(np.pi*k)
 
 
 def ARC_WITH_GAP(x, period, amplitude):
-    return np.piecewise(x, [x % period < period/2, x % period >= period/2],
-            [lambda ele: amplitude * np.sin(2*np.pi*ele/period), 0])
-
-def ARC_WITH_GAP_APPROXIMATION(x, period, amplitude, order):
-    a_0 = 2*amplitude/np.pi
-    y = a_0/2 * np.ones(x.shape)
-    for k in range(1, order+1):
-        if k == 1:  # Sine only contributes to the first summand
-            b_1 = amplitude/2
-            y += b_1 * np.sin(2*np.pi*k*x/period)
+    return np.where(x % period < period/2,
+            amplitude * np.sin(2*np.pi*x/period), 0.)
 
-        if k % 2 == 0:  # even
-            a_n =  2 * amplitude/np.pi * 1/(1 - k**2)
-            y += a_n * np.cos(2*np.pi*k*x/period)
-    return y
+def ARC_WITH_GAP_COEFFICIENTS(k):
+    a_0 = 2/np.pi
+    # The sine only contributes to the first summand, the cosines to the even
+    # ones
+    even = k % 2 == 0
+    a_k = np.zeros(k.shape)
+    a_k[even] = 2/np.pi * 1/(1 - k[even]**2)
+    b_k = np.where(k == 1, 1/2, 0.)
+    return a_0, a_k, b_k
 
 
 # Collect all functions in lists of function pointers
 original_functions = [RECTANGLE, SAW_TOOTH, ARC_WITH_GAP]
-function_approximations = [RECTANGLE_APPROXIMATION, SAW_TOOTH_APPROXIMATION,
-        ARC_WITH_GAP_APPROXIMATION]
+function_coefficients = [RECTANGLE_COEFFICIENTS, SAW_TOOTH_COEFFICIENTS,
+        ARC_WITH_GAP_COEFFICIENTS]
 
 
-# Helper function that are called to calculate the value pairs. At the moment
-# the number of elements in the x-array is arbitrary, but according to Shannon's
-# theorem it has to be high enough to capture all the high frequency components
-# at higher order
-def calculate_original_value_pairs(function_active, period, amplitude):
-    x = np.linspace(X_LEFT, X_RIGHT, 200)
-    y = original_functions[function_active](x, period, amplitude)
-    return x, y
+@memoize(maxsize=len(function_coefficients))
+def partial_sums(function_active):
+    """
+    The partial sums of the Fourier series (period 1, amplitude 1) of all
+    orders up to MAX_ORDER at the points of a uniform grid over one period, one
+    row per order.
+    """
+    k = np.arange(1, MAX_ORDER + 1)
+    a_0, a_k, b_k = function_coefficients[function_active](k)
+    phase = 2*np.pi * np.outer(k, np.arange(PERIOD_POINTS) / PERIOD_POINTS)
+    terms = a_k[:, np.newaxis] * np.cos(phase) + \
+            b_k[:, np.newaxis] * np.sin(phase)
+    return a_0/2 + np.cumsum(terms, axis=0)
+
+
+def original(x, function_active, period, amplitude, samples=None):
+    """
+    The original function, a sketch is interpolated between its samples.
+    """
+    if function_active == SKETCH:
+        return amplitude * np.interp(x, np.arange(SKETCH_SAMPLES) * period /
+                SKETCH_SAMPLES, samples, period=period)
+    return original_functions[function_active](x, period, amplitude)
+
+
+def approximation(x, partial, period, amplitude):
+    """
+    The Fourier series, interpolated between the points of its partial sum (see
+    partial_sums).
+    """
+    return amplitude * np.interp(x / period,
+            np.arange(PERIOD_POINTS) / PERIOD_POINTS, partial, period=1)
+
 
+@memoize(maxsize=len(function_coefficients))
+def spectrum(function_active):
+    """
+    The amplitudes of the harmonics 0, ..., MAX_ORDER (period 1, amplitude 1).
+    """
+    k = np.arange(1, MAX_ORDER + 1)
+    a_0, a_k, b_k = function_coefficients[function_active](k)
+    return np.concatenate(([abs(a_0)/2], np.hypot(a_k, b_k)))
+
+
+# Helper function that are called to calculate the value pairs over the window
+# of the viewport
+def initial_points(window, period, harmonics=1):
+    number = POINTS_PER_PERIOD * harmonics * \
+            (window.x_right - window.x_left) / abs(period)
+    # More than two points per pixel can not be seen anyway
+    return int(min(max(number, INITIAL_POINTS), 2 * window.width)) + 1
+
+def original_value_pairs(function_active, period, amplitude, window,
+        samples=None):
+    x, y = sample_window(lambda x: original(x, function_active, period,
+            amplitude, samples), window,
+            initial_points=initial_points(window, period))
+    return screen_array(x), screen_array(y)
+
+def approximation_value_pairs(partial, period, amplitude, order, window):
+    x, y = sample_window(lambda x: approximation(x, partial, period,
+            amplitude), window,
+            initial_points=initial_points(window, period, order))
+    return screen_array(x), screen_array(y)
+
+# The results for the representative functions are shared by all sessions. A
+# sketch belongs to a single session and changes with every pan event while it
+# is drawn, so its curves are not put into the shared cache.
+@memoize()
+def calculate_original_value_pairs(function_active, period, amplitude, window):
+    return original_value_pairs(function_active, period, amplitude, window)
+
+@memoize()
 def calculate_approximation_value_pairs(function_active, period, amplitude,
-        order):
-    x = np.linspace(X_LEFT, X_RIGHT, 3000)
-    y = function_approximations[function_active](x, period, amplitude, order)
-    return x, y
+        order, window):
+    return approximation_value_pairs(partial_sums(function_active)[order - 1],
+            period, amplitude, order, window)
 
 
 # ColumnDataSource abstract the sending of new value pairs to the client for
 # drawing over the WebSocket protocol
 original_function_source = ColumnDataSource()
 fourier_approximation_source = ColumnDataSource()
+spectrum_source = ColumnDataSource()
+# The strokes of the sketch, edited by the FreehandDrawTool in the browser
+sketch_source = ColumnDataSource(data={"xs": [], "ys": []})
+
+# The sketch of this session, its strokes, the stroke currently drawn (followed
+# by the pan events), the resulting samples and coefficients and the partial
+# sums of the orders calculated so far
+sketch = {
+        "strokes": [],
+        "current": None,
+        "samples": np.zeros(SKETCH_SAMPLES),
+        "coefficients": fourier_coefficients(np.zeros(SKETCH_SAMPLES)),
+        "partial_sums": {},
+        }
 
 
 plot = Figure(plot_height=HEIGHT, plot_width=WIDTH_PLOT,
         x_range=[X_LEFT, X_RIGHT], y_range=[Y_BOT, Y_TOP])
 plot.toolbar.active_drag = None
 
+# The part of the plot the curves are calculated for
+viewport = Viewport(plot)
+
 plot.line(x="x", y="y", source=original_function_source,
         line_width=LINE_WIDTH_ORIGINAL, color="black")
 plot.line(x="x", y="y", source=fourier_approximation_source,
         line_width=LINE_WIDTH_APPROXIMATION, color="red")
 
+# The period the user sketches in and the strokes drawn so far
+period_box = BoxAnnotation(left=0, right=1, fill_color="gray", fill_alpha=0.1,
+        visible=False)
+plot.add_layout(period_box)
+sketch_renderer = plot.multi_line(xs="xs", ys="ys", source=sketch_source,
+        line_width=LINE_WIDTH_ORIGINAL, color="gray", line_alpha=0.5,
+        visible=False)
+sketch_tool = FreehandDrawTool(renderers=[sketch_renderer])
+plot.add_tools(sketch_tool)
+
+spectrum_plot = Figure(plot_height=HEIGHT_SPECTRUM, plot_width=WIDTH_PLOT,
+        x_range=Range1d(-0.5, MAX_ORDER + 0.5),
+        title="Amplitudenspektrum", tools="")
+spectrum_plot.vbar(x="k", top="amplitude", source=spectrum_source, width=0.8,
+        color="red")
+# The harmonics left of the line are part of the approximation
+order_span = Span(location=2.5, dimension="height", line_color="black",
+        line_dash="dashed")
+spectrum_plot.add_layout(order_span)
+
 function_selector = RadioButtonGroup(labels=["Rechteck", "Sägezahn",
-        "Bogen mit Lücke"], active=0)
-order_slider = Slider(title="Ordnung der Approximation", start=1, end=50,
+        "Bogen mit Lücke", "Zeichnung"], active=0)
+order_slider = Slider(title="Ordnung der Approximation", start=1, end=MAX_ORDER,
         step=1, value=2)
 advanced_toggle = Toggle(label="Erweiterte Optionen aktivieren")
 period_slider = Slider(title="Periodenlänge der Originalfunktion", start=0.1,
         end=2, step=0.1, value=1, visible=False)
 amplitude_slider = Slider(title="Amplitude der Originalfunktion", start=-2,
         end=2, step=0.1, value=1, visible=False)
+clear_button = Button(label="Zeichnung löschen", visible=False)
 
 
 # Callback handlers
+def sketch_partial_sum(order):
+    if order not in sketch["partial_sums"]:
+        sketch["partial_sums"][order] = partial_sum(sketch["coefficients"],
+                order, PERIOD_POINTS)
+    return sketch["partial_sums"][order]
+
 def update_approximation(attr, old, new):
-    x, y = calculate_approximation_value_pairs(function_selector.active,
-            period_slider.value, amplitude_slider.value, order_slider.value)
+    if function_selector.active == SKETCH:
+        x, y = approximation_value_pairs(
+                sketch_partial_sum(order_slider.value), period_slider.value,
+                amplitude_slider.value, order_slider.value, viewport.current)
+    else:
+        x, y = calculate_approximation_value_pairs(function_selector.active,
+                period_slider.value, amplitude_slider.value,
+                order_slider.value, viewport.current)
     fourier_approximation_source.data = {"x": x, "y": y}
+    order_span.location = order_slider.value + 0.5
+
+def update_spectrum():
+    if function_selector.active == SKETCH:
+        amplitudes = amplitude_spectrum(sketch["coefficients"],
+                SKETCH_MAX_ORDER)
+    else:
+        amplitudes = spectrum(function_selector.active)
+    # Only the amplitudes are sent as long as the number of harmonics is the same
+    update_source(spectrum_source, {"k": np.arange(len(amplitudes)),
+            "amplitude": abs(amplitude_slider.value) * amplitudes})
 
 def update_original(attr, old, new):
-    x, y = calculate_original_value_pairs(function_selector.active,
-            period_slider.value, amplitude_slider.value)
+    if function_selector.active == SKETCH:
+        resample_sketch()
+        x, y = original_value_pairs(SKETCH, period_slider.value,
+                amplitude_slider.value, viewport.current, sketch["samples"])
+    else:
+        x, y = calculate_original_value_pairs(function_selector.active,
+                period_slider.value, amplitude_slider.value, viewport.current)
     original_function_source.data = {"x": x, "y": y}
+    update_spectrum()
     update_approximation(0, 0, 0)
 
+def resample_sketch():
+    strokes = list(sketch["strokes"])
+    if sketch["current"] is not None:
+        strokes.append(sketch["current"])
+    sketch["samples"] = resample_strokes(strokes, period_slider.value,
+            SKETCH_SAMPLES)
+    sketch["coefficients"] = fourier_coefficients(sketch["samples"])
+    sketch["partial_sums"] = {}
+
+# While a stroke is drawn the curves are updated at most every few pan events
+update_sketch = coalesce(update_original)
+
+def sketch_callback(attr, old, new):
+    """
+    The FreehandDrawTool sends the strokes once a stroke is finished (or
+    deleted), these replace the stroke followed by the pan events.
+    """
+    sketch["strokes"] = list(zip(sketch_source.data["xs"],
+            sketch_source.data["ys"]))
+    sketch["current"] = None
+    update_sketch(0, 0, 0)
+
+def pan_start_callback(event):
+    if function_selector.active == SKETCH:
+        sketch["current"] = ([event.x], [event.y])
+
+def pan_callback(event):
+    if sketch["current"] is not None:
+        sketch["current"][0].append(event.x)
+        sketch["current"][1].append(event.y)
+        update_sketch(0, 0, 0)
+
+def pan_end_callback(event):
+    """
+    The strokes of a finished sketch arrive before the end of the pan, so a
+    stroke that is still followed was no sketch (e.g., the plot was panned).
+    """
+    if sketch["current"] is not None:
+        sketch["current"] = None
+        update_sketch(0, 0, 0)
+
+def clear_callback():
+    sketch_source.data = {"xs": [], "ys": []}
+
 def toggle_callback(source):
     """
     Enables the 'more advanced' options so that the user is not distracted by
@@ -161,23 +358,46 @@ def toggle_callback(source):
     amplitude_slider.visible = True
 
 def selector_callback(source):
+    sketching = function_selector.active == SKETCH
+    sketch_renderer.visible = sketching
+    period_box.visible = sketching
+    clear_button.visible = sketching
+    plot.toolbar.active_drag = sketch_tool if sketching else None
+    order_slider.end = SKETCH_MAX_ORDER if sketching else MAX_ORDER
+    order_slider.value = min(order_slider.value, order_slider.end)
+    spectrum_plot.x_range.end = order_slider.end + 0.5
     update_original(0, 0, 0)
 
+def period_callback(attr, old, new):
+    period_box.right = period_slider.value
+    update_original(attr, old, new)
+
 
 # Call callback in advance to populate the plot
 update_original(0, 0, 0)
 
-# Connect the widgets with their respective callbacks
-order_slider.on_change("value", update_approximation)
+# Connect the widgets with their respective callbacks. While dragging the order
+# slider only the latest order is computed. Changing the period or the amplitude
+# recomputes both functions for a combination of values that is hardly ever
+# cached, so this is only done once the slider is released.
+on_slider_change((order_slider, ), update_approximation)
 
 advanced_toggle.on_click(toggle_callback)
 
-for original_slider in (period_slider, amplitude_slider):
-    original_slider.on_change("value", update_original)
+on_slider_change((period_slider, ), period_callback, throttled=True)
+on_slider_change((amplitude_slider, ), update_original, throttled=True)
 
 function_selector.on_click(selector_callback)
 
+viewport.on_change(lambda window: update_original(0, 0, 0))
+
+sketch_source.on_change("data", sketch_callback)
+plot.on_event(events.PanStart, pan_start_callback)
+plot.on_event(events.Pan, pan_callback)
+plot.on_event(events.PanEnd, pan_end_callback)
+clear_button.on_click(clear_callback)
+
 # Assemble the plot and create the html
-inputs = WidgetBox(function_selector, order_slider, advanced_toggle,
-        period_slider, amplitude_slider)
-curdoc().add_root(Row(plot, inputs, width=WIDTH_TOTAL))
+inputs = WidgetBox(function_selector, order_slider, clear_button,
+        advanced_toggle, period_slider, amplitude_slider)
+curdoc().add_root(Row(Column(plot, spectrum_plot), inputs, width=WIDTH_TOTAL))
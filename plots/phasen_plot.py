@@ -4,10 +4,18 @@ import sys
 
 from bokeh.layouts import row, widgetbox
 from bokeh.io import curdoc
+from bokeh.events import Tap
 from bokeh.models import ColumnDataSource
 from bokeh.models.widgets import Slider, RadioButtonGroup, Toggle, Dropdown
 from bokeh.plotting import figure
 
+from extensions.cache import memoize
+from extensions.incremental import update_source
+from extensions.ode import TrajectoryStream, trajectories, trajectory
+from extensions.payload import screen_array
+from extensions.quiver import quiver
+from extensions.coalesce import on_slider_change
+
 
 HEIGHT = 400
 WIDTH_PLOT = 500
@@ -20,8 +28,13 @@ This plot offers the user the chance to manipulate the vector field of phase
 plot and see the solution of the underlying systems of ordinary differential
 equations being plotted. This plot can then even be animated to see the
 trajectory propagate through the field and tangentially align with the vectors.
+While animating, the integration is continued from the last frame on the server
+and only the new points of the trajectory are streamed to the browser, which
+keeps the latest ANIMATION_ROLLOVER points (see extensions/ode.py).
 
 The values of the initial conditions are adjusted by the help of sliders.
+Additionally, a whole ensemble of trajectories starting on a grid (and at every
+point the user clicks on) shows the flow of the system.
 
 The following ODEs are currently available:
     * Undamped oscillator (adjust stiffness and mass)
@@ -31,8 +44,7 @@ The following ODEs are currently available:
 The vector field of the phase plot is drawn by the help of the system of ODEs.
 The solution is drawn based on a time series trajectory calculated either
 analytically (oscillator) with the general solution or numerically
-(volterra-lotka), currently by the help of fixed time-stepping Euler-foreward
-integrator.
+(volterra-lotka) by an adaptive integrator (see extensions/ode.py).
 
 Example: The ODE of a regular, undamped oscillator with no external forces is
     y'' = - k/m * y
@@ -60,6 +72,14 @@ For more detailed derivations on the oscillator see ../docs/phasen_plot.tex
 N_spread_oscillator = [-5, 5]
 N_spread_volterra = [0, 12]
 
+# Number of initial values per direction of the grid the ensemble starts on
+ENSEMBLE_SEEDS = 8
+
+# Milliseconds between two frames of the animation and the number of points of
+# the animated trajectory kept in the browser
+ANIMATION_INTERVAL = 100
+ANIMATION_ROLLOVER = 2000
+
 # How to treat the vectors' lengths
 # "scale": vectors a representative length between (0...1)
 # "normalize": vectors have the same length of 1
@@ -128,29 +148,24 @@ def volterra_lotka(u, v, parameters):
     v_prime = v * (gamma * u - delta)
     return (u_prime, v_prime)
 
-def volterra_lotka_solution(parameters, u_0, v_0, t):
-    """
-    Since there is no closed solution to the volterra-lotka equation (,i.e., no
-    analytic solution), a numeric integrator has to be used. Here, we apply a
-    simple first-order Euler-forward integrator with fixed time stepping.
-    TODO: a proper integrator could reduce the computational load on the server.
-    """
-    delta_t = t[1] - t[0]  # we assume equal time stepping
-    u = np.zeros(len(t))
-    v = np.zeros(len(t))
-    u[0] = u_0
-    v[0] = v_0
-    for i in range(1, len(t)):
-        u_prime, v_prime = volterra_lotka(u[i-1], v[i-1], parameters)
-        u[i] = u[i-1] + u_prime * delta_t
-        v[i] = v[i-1] + v_prime * delta_t
-        # TODO test more cases, if the numerically calculated trajectory escapes the view.
-        # Therefore, we currently limit the trajectory to be in a 50 by 50 bounding box.
-        # So the user can still see the vectors
-        if np.abs(v[i]) > 25 or np.abs(u[i]) > 25:
-            u[i] = u[i-1]
-            v[i] = v[i-1]
-    return (u, v)
+# Systems of ODEs without an analytic solution are integrated numerically
+odes = {
+        "oscillator": oscillator,
+        "volterra-lotka": volterra_lotka,
+        }
+analytic_solutions = {
+        "oscillator": osciallator_solution,
+        }
+
+# The trajectories are integrated as long as they stay within the vector field
+# extended by its size in every direction. The scale (pixels per unit) is the
+# one of the plot showing the vector field.
+def field_geometry(ode):
+    spread = N_spread_oscillator if ode == "oscillator" else N_spread_volterra
+    size = spread[1] - spread[0]
+    bounds = (spread[0] - size, spread[1] + size)
+    scale = (WIDTH_PLOT / (size + 2), HEIGHT / (size + 2))
+    return (bounds, bounds), scale
 
 
 def extract_parameters(ode_selectorm, slider_1, slider_2, slider_3, slider_4):
@@ -175,27 +190,22 @@ def extract_parameters(ode_selectorm, slider_1, slider_2, slider_3, slider_4):
     return parameters
 
 
-def update_vector(parameters, triangle_source, multi_line_source):
+def update_vector(parameters, triangle_source, segment_source):
     """
     This routine is new for the expmath-project. Until now, bokeh
     did not have the abilities to draw a vector-field similar to
     matplotlib etc.
     This functions updates two ColumnDataSources which are used for
     lines that represent the arrow body and triangles that represent
-    the arrow head. The triangles are rotated in a direction to mimic
-    the appearance of a classical arrow.
+    the arrow head (see extensions/quiver.py).
     """
     if parameters["ode"] == "oscillator":
         # Determin how many arrows to draw in each direction
         N_axis = N_spread_oscillator[1] - N_spread_oscillator[0] + 1
-        # The total number of arrows is the product of the arrows in each
-        # direction
-        N = N_axis**2
         x = np.linspace(N_spread_oscillator[0], N_spread_oscillator[1], N_axis)
         y = np.linspace(N_spread_oscillator[0], N_spread_oscillator[1], N_axis)
     elif parameters["ode"] == "volterra-lotka":
         N_axis = N_spread_volterra[1] - N_spread_volterra[0] + 1
-        N = N_axis**2
         x = np.linspace(N_spread_volterra[0], N_spread_volterra[1], N_axis)
         y = np.linspace(N_spread_volterra[0], N_spread_volterra[1], N_axis)
     else:
@@ -203,67 +213,29 @@ def update_vector(parameters, triangle_source, multi_line_source):
     # The vector field is drawn by the help of X,Y and U,V. Therefore, we need
     # every combination of coordinates possible -> meshgrid
     X, Y = np.meshgrid(x, y)
-    # Dealing with one-dimensional arrays instead of matrices makes consecutive
-    # calculations easier -> flatten
-    X = X.flatten()
-    Y = Y.flatten()
     if parameters["ode"] == "oscillator":
-        # IMPORTANT: Use deep copies when necessary to avoid numpy optimizations
-        U, V = oscillator(np.copy(X), np.copy(Y), parameters) 
+        U, V = oscillator(X, Y, parameters)
     elif parameters["ode"] == "volterra-lotka":
-        U, V = volterra_lotka(np.copy(X), np.copy(Y), parameters)
+        U, V = volterra_lotka(X, Y, parameters)
     else:
         sys.exit(1)
-    angle_pure = np.arctan2(np.copy(V), np.copy(U))
-    # The arrows seem to be slightly wrong as the arrow tip does not align with
-    # the arrow line. However, this is due to bokeh limitations on the ability
-    # to rotate triangles. The available set of angles is too small to represent
-    # all necessary calculated angles
-    angle = np.pi/4 + angle_pure  
 
     # It feels less clumsy if vectors either have the same length or a
     # representative length
-    if VECTOR_TREATMENT == "normalize":
-        magnitude = np.sqrt(U**2 + V**2)
-        for i in range(len(magnitude)):
-            if magnitude[i] < 0.01:
-                magnitude[i] = 0.01
-        U /= magnitude
-        V /= magnitude
-    elif VECTOR_TREATMENT == "scale":
-        magnitude = np.sqrt(U**2 + V**2)
-        max_maxgnitude = max(magnitude)
-        U /= max_maxgnitude
-        V /= max_maxgnitude
-
-    start_x = X
-    start_y = Y
-    end_x = X + U
-    end_y = Y + V
-    xs = []
-    ys = []
-    triangle_x = []
-    triangle_y = []
-    triangle_angle = []
+    bodies, heads = quiver(X, Y, U, V, treatment=VECTOR_TREATMENT,
+            head_offset=0.1)
+
     if parameters["ode"] == "oscillator":
         SIZE = 10
     elif parameters["ode"] == "volterra-lotka":
         SIZE = 7
-    for i in range(N):
-        # IMPORTANT: Create the arrays the ColumnDataSources are filled with
-        # prior to assigning them to them. Since every time you change the
-        # ColumnDataSource, this data is send to the client. This slows down the
-        # overall user experience. 
-        triangle_x.append(end_x[i] + np.cos(angle_pure[i]) * 0.1)
-        triangle_y.append(end_y[i] + np.sin(angle_pure[i]) * 0.1)
-        triangle_angle.append(angle[i])
-        xs.append([start_x[i], end_x[i]])
-        ys.append([start_y[i], end_y[i]])
-
-    # Updating the ColumnDataSources with the data assembled previously
-    multi_line_source.data = {"xs": xs, "ys": ys}
-    triangle_source.data = {"x": triangle_x, "y": triangle_y,
-            "angle": triangle_angle, "size": SIZE*np.ones(N)}
+    heads["size"] = screen_array(np.full(X.size, SIZE))
+    # IMPORTANT: The arrays are assembled as a whole and assigned to the
+    # ColumnDataSources at once. Every change of a ColumnDataSource is sent to
+    # the client. The float32 arrays are sent as binary buffers instead of
+    # element by element JSON lists.
+    update_source(segment_source, bodies)
+    update_source(triangle_source, heads)
 
 
 def update_initial(y_0, y_1, initial_value_source):
@@ -273,29 +245,95 @@ def update_initial(y_0, y_1, initial_value_source):
     """
     initial_value_source.data = {"x": [y_0, ], "y": [y_1, ]}
 
-def update_solution(parameters, y_0, y_1, end_time, solution_source):
+@memoize()
+def calculate_solution(parameters, y_0, y_1, end_time):
     """
-    This function is responsible for updating the dataset upon which the
-    solution trajectory is drawn. It will call the corresponding solution
-    function to calculate the trajectory coordinate tuple at each point in time.
-    The time varies linearly between 0 and the end adjusted by the corresponding
-    slider.
+    This function calls the corresponding solution function to calculate the
+    trajectory coordinate tuple at each point in time. The time varies linearly
+    between 0 and the end adjusted by the corresponding slider. The trajectories
+    are shared by all sessions and must not be modified.
     """
-    if parameters["ode"] == "oscillator":
+    if parameters["ode"] in analytic_solutions:
         t = np.linspace(0, end_time, 100)
-        x, y = osciallator_solution(parameters, y_0, y_1, t)
-    elif parameters["ode"] == "volterra-lotka":
-        # Here a high number of steps is necessary to achieve a comparable
-        # accuracy with the Euler-integrator
-        t = np.linspace(0, end_time, 4000)
-        x, y = volterra_lotka_solution(parameters, y_0, y_1, t)
-        # Only select every 100th solution point so that we reduce the data that
-        # is send to the client
-        x = x[0::100]
-        y = y[0::100]
+        x, y = analytic_solutions[parameters["ode"]](parameters, y_0, y_1, t)
+    elif parameters["ode"] in odes:
+        # The points are sampled at the resolution of the plot, independent of
+        # the steps of the integrator
+        bounds, scale = field_geometry(parameters["ode"])
+        ode = odes[parameters["ode"]]
+        t, x, y = trajectory(lambda u, v: ode(u, v, parameters), (y_0, y_1),
+                end_time, scale=scale, bounds=bounds)
     else:
         sys.exit(1)
-    solution_source.data = {"x": x, "y": y}
+    return screen_array(x), screen_array(y)
+
+def update_solution(parameters, y_0, y_1, end_time, solution_source):
+    """
+    This function is responsible for updating the dataset upon which the
+    solution trajectory is drawn.
+    """
+    x, y = calculate_solution(parameters, y_0, y_1, end_time)
+    update_source(solution_source, {"x": x, "y": y})
+
+def start_stream(parameters, y_0, y_1, solution_source):
+    """
+    Restarts the animated trajectory at the initial values. The oscillator is
+    integrated numerically as well, so that every frame continues the state of
+    the previous one.
+    """
+    bounds, scale = field_geometry(parameters["ode"])
+    ode = odes[parameters["ode"]]
+    solution_source.data = {"x": screen_array([y_0, ]),
+            "y": screen_array([y_1, ])}
+    return TrajectoryStream(lambda u, v: ode(u, v, parameters), (y_0, y_1),
+            scale=scale, bounds=bounds)
+
+def advance_stream(stream, duration, solution_source):
+    """
+    Appends the next piece of the trajectory, the browser drops the oldest
+    points beyond ANIMATION_ROLLOVER.
+    """
+    t, x, y = stream.advance(duration)
+    if len(t):
+        solution_source.stream({"x": screen_array(x), "y": screen_array(y)},
+                rollover=ANIMATION_ROLLOVER)
+
+def ensemble_seeds(ode, grid, clicked):
+    """
+    The initial values of the ensemble: the grid over the vector field (if
+    selected) and the points the user clicked on.
+    """
+    seeds = [np.reshape(clicked, (-1, 2))]
+    if grid:
+        spread = N_spread_oscillator if ode == "oscillator" else \
+                N_spread_volterra
+        axis = np.linspace(spread[0], spread[1], ENSEMBLE_SEEDS)
+        U, V = np.meshgrid(axis, axis)
+        seeds.append(np.column_stack((U.ravel(), V.ravel())))
+    return np.concatenate(seeds)
+
+@memoize()
+def calculate_ensemble(parameters, seeds, end_time):
+    """
+    All trajectories of the ensemble are integrated together (also for the
+    oscillator), one line per trajectory up to the point it left the plot. The
+    WebGL backend can not draw lines interrupted by NaNs, hence the trajectories
+    are drawn as a multi_line.
+    """
+    bounds, scale = field_geometry(parameters["ode"])
+    ode = odes[parameters["ode"]]
+    t, x, y = trajectories(lambda u, v: ode(u, v, parameters), seeds,
+            end_time, scale=scale, bounds=bounds)
+    inside = np.isfinite(x).sum(axis=0)
+    return [screen_array(x[:end, i]) for i, end in enumerate(inside)], \
+            [screen_array(y[:end, i]) for i, end in enumerate(inside)]
+
+def update_ensemble(parameters, seeds, end_time, ensemble_source):
+    if len(seeds) == 0:
+        xs = ys = []
+    else:
+        xs, ys = calculate_ensemble(parameters, seeds, end_time)
+    update_source(ensemble_source, {"xs": xs, "ys": ys})
 
 def switch_ode(ode_selector, slider_1, slider_2, slider_3, slider_4, initial_y,
         initial_y_prime, end_time, plot):
@@ -399,22 +437,26 @@ def switch_ode(ode_selector, slider_1, slider_2, slider_3, slider_4, initial_y,
 # ColumnDataSource is the object abstracting the constant stream of new datasets
 # to the client
 vector_source = ColumnDataSource()
-multi_line_source = ColumnDataSource()
+segment_source = ColumnDataSource()
 initial_value_source = ColumnDataSource()
 solution_source = ColumnDataSource()
+ensemble_source = ColumnDataSource(data={"xs": [], "ys": []})
 
 # WebGL brought some minor performance boosts to the client-side drawing
 plot = figure(plot_width=WIDTH_PLOT, plot_height=HEIGHT, match_aspect=True,
         output_backend = "webgl")
 
-# The new multiline accepts a list of list as datsets. Here, we draw the body of
-# the arrow
-plot.multi_line(xs="xs", ys="ys", source=multi_line_source, color="black",
-        line_width=2)
+# The body of the arrows are straight segments from the start to the end point
+plot.segment(x0="x0", y0="y0", x1="x1", y1="y1", source=segment_source,
+        color="black", line_width=2)
 # The triangle represents an arrow head
 plot.triangle(x="x", y="y", size="size", angle="angle", source=vector_source,
         color="black", fill_color=None)
 
+# Draws the trajectories of the ensemble, one line per trajectory
+plot.multi_line(xs="xs", ys="ys", source=ensemble_source, color="gray",
+        line_width=1)
+
 # Marks the initial condition
 plot.cross(x="x", y="y", source=initial_value_source, color="orange", size=15,
         line_width=5)
@@ -438,73 +480,117 @@ slider_4 = Slider(title="Ohne Funktion", start=0., end=1., value=0., step=0.)
 initial_y = Slider(title="y(t=0)=", start=-5., end=5., value=1., step=0.1)
 initial_y_prime = Slider(title="y'(t=0)=", start=-5., end=5., value=0., step=0.1)
 animate_toggle = Toggle(label="Animieren")
+ensemble_toggle = Toggle(label="Lösungsschar anzeigen")
 end_time = Slider(title="Zeit", start=0., end=30., value=5., step=0.1)
 
 # Calling all functions in advance to populate the plot
 parameters = extract_parameters(ode_selector, slider_1, slider_2, slider_3,
         slider_4)
-update_vector(parameters, vector_source, multi_line_source)
+update_vector(parameters, vector_source, segment_source)
 update_initial(initial_y.value, initial_y_prime.value, initial_value_source)
 update_solution(parameters, initial_y.value, initial_y_prime.value,
         end_time.value, solution_source)
 
 # The widgetbox is just a container for all input objects
 inputs = widgetbox(ode_selector, slider_1, slider_2, slider_3, slider_4,
-        initial_y, initial_y_prime, animate_toggle, end_time)
+        initial_y, initial_y_prime, animate_toggle, end_time, ensemble_toggle)
+
+# Initial values of the ensemble the user clicked on in this session
+clicked_seeds = []
+
+# The state of the integration of the animated trajectory (None if the
+# animation is not running)
+animation = {"stream": None, "callback_id": None}
 
 # Declaration of various callback handlers
 def parameter_sliders_update(attr, old, new):
     parameters = extract_parameters(ode_selector, slider_1, slider_2, slider_3,
             slider_4)
-    update_vector(parameters, vector_source, multi_line_source)
-    update_solution(parameters, initial_y.value, initial_y_prime.value,
-            end_time.value, solution_source)
+    update_vector(parameters, vector_source, segment_source)
+    solution_update(parameters)
+    ensemble_update()
 
 def end_time_update(attr, old, new):
     parameters = extract_parameters(ode_selector, slider_1, slider_2, slider_3,
             slider_4)
-    update_solution(parameters, initial_y.value, initial_y_prime.value,
-            end_time.value, solution_source)
+    solution_update(parameters)
+    ensemble_update()
+
+def solution_update(parameters):
+    """
+    Draws the trajectory up to the end time, or restarts the animated one.
+    """
+    if animation["stream"] is not None:
+        animation["stream"] = start_stream(parameters, initial_y.value,
+                initial_y_prime.value, solution_source)
+    else:
+        update_solution(parameters, initial_y.value, initial_y_prime.value,
+                end_time.value, solution_source)
+
+def ensemble_update():
+    parameters = extract_parameters(ode_selector, slider_1, slider_2, slider_3,
+            slider_4)
+    seeds = ensemble_seeds(parameters["ode"], ensemble_toggle.active,
+            clicked_seeds)
+    update_ensemble(parameters, seeds, end_time.value, ensemble_source)
+
+def tap_callback(event):
+    """
+    Every click into the plot starts another trajectory of the ensemble.
+    """
+    clicked_seeds.append((event.x, event.y))
+    ensemble_update()
 
 def initial_value_update(attr, old, new):
     update_initial(initial_y.value, initial_y_prime.value, initial_value_source)
     parameters = extract_parameters(ode_selector, slider_1, slider_2, slider_3,
             slider_4)
-    update_solution(parameters, initial_y.value, initial_y_prime.value,
-            end_time.value, solution_source)
+    solution_update(parameters)
 
 def animate():
-    if end_time.value >= end_time.end:
-        end_time.value = end_time.start
-    else:
-        end_time.value += end_time.step
+    # Every frame advances the time by one step of the end time slider
+    advance_stream(animation["stream"], end_time.step, solution_source)
 
-# This id is the process_id of the periodic_callback. It is necessary to
-# deactivate it with the toggle button
-callback_id = 0. 
+# The end time has no meaning while the trajectory is animated. Once the
+# animation stops, the trajectory up to the end time is drawn again.
 def toggle_animation(source):
-    global callback_id
-    if animate_toggle.active == 1:
-        callback_id = curdoc().add_periodic_callback(animate, 100)
-    else:
-        curdoc().remove_periodic_callback(callback_id)
+    parameters = extract_parameters(ode_selector, slider_1, slider_2, slider_3,
+            slider_4)
+    if animate_toggle.active and animation["stream"] is None:
+        end_time.disabled = True
+        animation["stream"] = start_stream(parameters, initial_y.value,
+                initial_y_prime.value, solution_source)
+        animation["callback_id"] = curdoc().add_periodic_callback(animate,
+                ANIMATION_INTERVAL)
+    elif not animate_toggle.active and animation["stream"] is not None:
+        curdoc().remove_periodic_callback(animation["callback_id"])
+        animation["stream"] = animation["callback_id"] = None
+        end_time.disabled = False
+        update_solution(parameters, initial_y.value, initial_y_prime.value,
+                end_time.value, solution_source)
 
 def selector_callback(attr, old, new):
     if old != new:
+        del clicked_seeds[:]
         switch_ode(ode_selector, slider_1, slider_2, slider_3, slider_4,
                 initial_y, initial_y_prime, end_time, plot)
 
-# Connect the callback handlers with event loop
-for parameter_slider in (slider_1, slider_2, slider_3, slider_4):
-    parameter_slider.on_change("value", parameter_sliders_update)
+# Connect the callback handlers with event loop. The slider callbacks are
+# coalesced, i.e., while dragging (or when switch_ode resets all sliders at once)
+# only the latest values are computed.
+on_slider_change((slider_1, slider_2, slider_3, slider_4),
+        parameter_sliders_update)
 
-end_time.on_change("value", end_time_update)
+on_slider_change((end_time, ), end_time_update)
 
-for initial_slider in (initial_y, initial_y_prime):
-    initial_slider.on_change("value", initial_value_update)
+on_slider_change((initial_y, initial_y_prime), initial_value_update)
 
 animate_toggle.on_click(toggle_animation)
 
+ensemble_toggle.on_click(lambda active: ensemble_update())
+
+plot.on_event(Tap, tap_callback)
+
 ode_selector.on_change("value", selector_callback)
 # This value has to be called manually since otherwhise a first click on the
 # dopdown container would just yield the standard entry
@@ -6,6 +6,8 @@ from bokeh.models import ColumnDataSource
 from bokeh.models.widgets import Slider, RadioButtonGroup, Toggle
 from bokeh.plotting import Figure
 
+from extensions.payload import screen_columns
+
 """
 This plot compares sequences and their partial sums. It will help the user
 understand the difference and relation between both. The user can also examine
@@ -69,7 +71,7 @@ def update_sequence(sequence_selector, number_slider, parameter_slider,
         a = 1.
 
     y = SEQUENCES[sequence_selector.active](x, a)
-    sequence_source.data = {"x": x, "y": y}
+    sequence_source.data = screen_columns({"x": x, "y": y})
 
 def update_series(sequence_selector, number_slider, parameter_slider,
         series_source, shift_left):
@@ -84,20 +86,16 @@ def update_series(sequence_selector, number_slider, parameter_slider,
     if(sequence_selector.active in (0, 1)):
         a = 1.
 
-    sums = 0.
-    heights = []
-    for pos in x:
-        sums += SEQUENCES[sequence_selector.active](pos, a)
-        heights.append(sums)
+    heights = np.cumsum(SEQUENCES[sequence_selector.active](x, a))
 
     # Shift to left if convergence aid is active so that they fit next to each
     # other
     if shift_left:
         x -= WIDTH_BAR / 2.
 
-    series_source.data = {
+    series_source.data = screen_columns({
             "x_center": x,
-            "height" : heights}
+            "height" : heights})
 
 def update_convergence_aid_sequence(number_slider,
         convergence_aid_selector, convergence_aid_parameter_slider,
@@ -110,7 +108,7 @@ def update_convergence_aid_sequence(number_slider,
     a = convergence_aid_parameter_slider.value
 
     y = CRITERIA[convergence_aid_selector.active](x, a)
-    convergence_aid_sequence_source.data = {"x": x, "y": y}
+    convergence_aid_sequence_source.data = screen_columns({"x": x, "y": y})
 
 def update_convergence_aid_series(number_slider, convergence_aid_selector,
         convergence_aid_parameter_slider, convergence_aid_series_source):
@@ -121,18 +119,14 @@ def update_convergence_aid_series(number_slider, convergence_aid_selector,
     x = np.linspace(1, number_slider.value, number_slider.value)
 
     a_aid = convergence_aid_parameter_slider.value
-    sums = 0.
-    heights = []
-    for pos in x:
-        sums += CRITERIA[convergence_aid_selector.active](pos, a_aid)
-        heights.append(sums)
+    heights = np.cumsum(CRITERIA[convergence_aid_selector.active](x, a_aid))
 
     # Shift to the right so that both bars fit next to each other
     x += WIDTH_BAR / 2.
 
-    convergence_aid_series_source.data = {
+    convergence_aid_series_source.data = screen_columns({
             "x_center": x,
-            "height": heights}
+            "height": heights})
 
 
 # ColumnDataSource represents an abstraction for the data transmission to the
@@ -1,20 +1,39 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import numpy as np
-import holoviews as hv
 
 from bokeh.models.widgets import Panel, Tabs
 from bokeh.layouts import row, widgetbox
 from bokeh.io import curdoc
+from bokeh.events import Tap
 from bokeh.models import ColumnDataSource
+from bokeh.plotting import figure
 
-from bokeh.models.widgets import Slider
+from bokeh.models.widgets import Slider, Toggle
+
+from extensions.payload import nan_separated_rows
+from extensions.quiver import quiver
 
-hv.extension('bokeh')
 HEIGHT = 400
 WIDTH_PLOT = 600
 WIDTH_TOTAL = 800
 
+# The vector field is drawn for each integer pair within this interval, the
+# viewport has some space around it
+N_SPREAD = [-10, 10]
+X_RANGE = [-11, 11]
+Y_RANGE = [-11, 11]
+
+# Length of the arrows (the grid points are one apart) and size of their heads
+# in pixels
+ARROW_LENGTH = 0.7
+HEAD_SIZE = 5
+
+# Number of initial values of the family of solutions and number of points per
+# solution
+ENSEMBLE_SEEDS = 21
+NUMBER_OF_POINTS = 200
+
 '''
 FUNC... defines the explicit ordinary differential equation that is first
 order in the form y'=FUNC(X, Y)
@@ -23,6 +42,11 @@ y = FUNC(X, C) with the integral constant C
 
 To add new fields, declare the ODE and its general solution. Then, add
 the functions to the list below the definitions.
+
+Besides the solution through the initial value of the sliders, a whole family of
+solutions (initial values on a grid along the x position of the sliders and at
+every point the user clicks on) can be drawn. The general solutions are
+evaluated for all initial values at once.
 '''
 
 
@@ -54,34 +78,44 @@ def FUNC_3_SOLUTION(X, x_initial, y_initial):
 functions = [FUNC_1, FUNC_2, FUNC_3]
 solutions = [FUNC_1_SOLUTION, FUNC_2_SOLUTION, FUNC_3_SOLUTION]
 
-x = np.linspace(-10, 10, 21)
-y = np.linspace(-10, 10, 21)
+N_axis = N_SPREAD[1] - N_SPREAD[0] + 1
+x = np.linspace(N_SPREAD[0], N_SPREAD[1], N_axis)
+y = np.linspace(N_SPREAD[0], N_SPREAD[1], N_axis)
 
 # Create the underlying grid for the vector field
 X, Y = np.meshgrid(x, y)
 
-U = np.ones((21, 21))
+# The axes are not equally scaled, the arrow heads have to be rotated on the
+# screen accordingly
+aspect = (HEIGHT / (Y_RANGE[1] - Y_RANGE[0])) / \
+        (WIDTH_PLOT / (X_RANGE[1] - X_RANGE[0]))
 
 plots = []
 
-# Use the holoview library to generate a vector_field plot since this is not
-# yet natively available for bokeh. The holoview render method then turns
-# this into a bokeh figure
+# The direction of the solution at every grid point is (1, y'). All arrows have
+# the same length and are centered at their grid point (see
+# extensions/quiver.py)
 for func in functions:
-    V = func(X, Y)
-    mag = np.sqrt(U**2 + V**2)
-    ang = np.pi/2 - np.arctan2(U/mag, V/mag)
-    vector_field = hv.VectorField((X, Y, ang, 0.5*np.ones((21, 21))))
-    vector_field.opts(magnitude='Magnitude')
-    plots.append(hv.render(vector_field, backend="bokeh"))
+    bodies, heads = quiver(X, Y, np.ones(X.shape), func(X, Y),
+            treatment="normalize", length=ARROW_LENGTH, pivot="mid",
+            aspect=aspect)
+    plot = figure(plot_width=WIDTH_PLOT, plot_height=HEIGHT, x_range=X_RANGE,
+            y_range=Y_RANGE, tools="")
+    plot.segment(x0="x0", y0="y0", x1="x1", y1="y1",
+            source=ColumnDataSource(data=bodies), color="black")
+    plot.triangle(x="x", y="y", angle="angle", source=ColumnDataSource(
+            data=heads), size=HEAD_SIZE, color="black")
+    plots.append(plot)
 
 value_cross = ColumnDataSource()
 values = []
+ensembles = []
 for plot in plots:
-    plot.width = WIDTH_PLOT
-    plot.height = HEIGHT
-    plot.tools = []
     values.append(ColumnDataSource())
+    ensembles.append(ColumnDataSource(data={"x": [], "y": []}))
+
+# Initial values the user clicked on in this session, for every field
+clicked_seeds = [[] for plot in plots]
 
 # The slider controlling the value of the solution function at a certain point
 # This will fix all degress of freedom the general solution to this ODE will
@@ -90,8 +124,33 @@ height = Slider(title="y Position des Anfangswertes", value=1, start=-5, end=5,
         step=0.05)
 x_pos = Slider(title="x Position des Anfangswertes", value=0., start=-5, end=5,
         step=0.05)
+ensemble_toggle = Toggle(label="Lösungsschar anzeigen")
+
+
+def calculate_ensemble(solution, seeds):
+    """
+    The solutions through all initial values (rows of x and y), evaluated in one
+    call and joined into one line with NaNs in between.
+    """
+    x_plot = np.linspace(X_RANGE[0], X_RANGE[1], NUMBER_OF_POINTS)
+    with np.errstate(all="ignore"):
+        y_plot = solution(x_plot[None, :], seeds[:, 0, None], seeds[:, 1, None])
+    return nan_separated_rows(np.broadcast_to(x_plot, y_plot.shape)), \
+            nan_separated_rows(y_plot)
+
 
 # Defining callback handlers
+def update_ensembles():
+    grid = np.empty((0, 2))
+    if ensemble_toggle.active:
+        grid = np.column_stack((np.full(ENSEMBLE_SEEDS, x_pos.value),
+                np.linspace(N_SPREAD[0], N_SPREAD[1], ENSEMBLE_SEEDS)))
+    for i, solution in enumerate(solutions):
+        seeds = np.concatenate((grid, np.reshape(clicked_seeds[i], (-1, 2))))
+        x_ensemble, y_ensemble = calculate_ensemble(solution, seeds)
+        ensembles[i].data = {"x": x_ensemble, "y": y_ensemble}
+
+
 def update_slider(attr, old, new):
     x_plot = np.linspace(-10, 10, 100)
     for i, solution in enumerate(solutions):
@@ -99,6 +158,18 @@ def update_slider(attr, old, new):
         values[i].data = {"x": x_plot, "y": y_plot}
     value_cross.data = {"x": np.array([x_pos.value, ]), "y":
             np.array([height.value, ])}
+    if ensemble_toggle.active:
+        update_ensembles()
+
+
+def tap_callback(index):
+    """
+    Every click into a field adds a solution through this point.
+    """
+    def callback(event):
+        clicked_seeds[index].append((event.x, event.y))
+        update_ensembles()
+    return callback
 
 
 # Initialize the data dictionaries by calling the update handler
@@ -108,20 +179,25 @@ tabs = []
 names = ["Erstes Feld", "Zweites Feld", "Drittes Feld", "Viertes Feld",
         "Fünftes Feld"]
 for i, plot in enumerate(plots):
+    plot.line("x", "y", source=ensembles[i], color="gray")
     plot.line("x", "y", source=values[i], line_width=3)
     plot.cross("x", "y", source=value_cross, color="orange", line_width=12)
     tabs.append(Panel(child=plot, title=names[i]))
 
 
-# Here, we have to use tabs. The user won't be able to choose the ODE in the
-# right column. This might be inconsistent but is necessary since bokeh does
-# not support native vector field plots yet
+# Here, we use tabs. The user won't be able to choose the ODE in the right
+# column. This might be inconsistent but every field is only calculated once
 tabs = Tabs(tabs=tabs, width=WIDTH_PLOT)
 
 # Connect the widgets with their respective callbacks
 for slider in (height, x_pos):
     slider.on_change("value", update_slider)
 
+ensemble_toggle.on_click(lambda active: update_ensembles())
+
+for i, plot in enumerate(plots):
+    plot.on_event(Tap, tap_callback(i))
+
 # Assemble the plot and create the html
-inputs = widgetbox(height, x_pos)
+inputs = widgetbox(height, x_pos, ensemble_toggle)
 curdoc().add_root(row(tabs, inputs))
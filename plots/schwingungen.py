@@ -1,3 +1,5 @@
+from string import Template
+
 import numpy as np
 
 from bokeh.layouts import Row, WidgetBox, Column
@@ -5,15 +7,28 @@ from bokeh.io import curdoc
 from bokeh.models import ColumnDataSource 
 from bokeh.plotting import Figure
 
-from bokeh.models.widgets import Slider, Div, Toggle
+from bokeh.models.widgets import Slider, Div, Toggle, RadioButtonGroup
 
 from extensions.Latex import LatexLabel
+from extensions.cache import memoize
+from extensions.incremental import update_source
+from extensions.payload import screen_array
+from extensions.animation import attach_client_animation, create_frame_source,\
+        frame_times, update_frames
+from extensions.spectral import sine_basis
 
 
 """
 This file creates an interactive chart presenting the oscialltions of a one-
 dimensional string
 
+The oscillation is a superposition of the eigenmodes sin(k x / L) of the string.
+Their amplitudes are either set directly (the first three) or follow from the
+initial shape of a string that is plucked (a triangle) or struck by a hammer (a
+short initial velocity), then many modes are superposed. The sampled eigenmodes
+are cached as a matrix (see extensions/spectral.py), the elongation at a point
+in time is one product of this matrix with the vector of the current amplitudes.
+
 @author: felix
 """
 
@@ -27,79 +42,107 @@ LINE_WIDTH = 2
 
 # How many points are used to discretize the curve(i.e., how many lines+1 are
 # used)
-NUM_POINTS = 100
-
-# Concatenates the string of latex syntax that will be rendered on the client
-def create_latex(length, tension, density, first, second, third):
-    text = "u(t,x) ="
-    if(first != 0.0):
-        text += " " +\
-        str(round(first, 1)) +\
-        " \cdot \cos \left( 1 / " +\
-        str(round(length, 1)) +\
-        " \cdot \sqrt{ " +\
-        str(round(tension, 1)) +\
-        " / " +\
-        str(round(density, 1)) +\
-        "} \cdot t \\right)" +\
-        " \cdot \sin \left( 1 / " +\
-        str(round(length, 1)) +\
-        " \cdot x \\right)"
-
-    if(second != 0.0):
-        if(first != 0.0):
-            # Not necessary if the second Eigenfunction is the first to appear
-            text += " +"
-
-        text += " " +\
-        str(round(second, 1)) +\
-        " \cdot \cos \left( 2 / " +\
-        str(round(length, 1)) +\
-        " \cdot \sqrt{ " +\
-        str(round(tension, 1)) +\
-        " / " +\
-        str(round(density, 1)) +\
-        "} \cdot t \\right)" +\
-        " \cdot \sin \left( 2 / " +\
-        str(round(length, 1)) +\
-        " \cdot x \\right)"
-
-
-    if(third != 0.0):
-        if(first != 0.0 or second != 0.0):
-            # Not necessary if the third Eigenfunction is the first to appear
-            text += " +"
-
-        text += " " +\
-        str(round(third, 1)) +\
-        " \cdot \cos \left( 3 / " +\
-        str(round(length, 1)) +\
-        " \cdot \sqrt{" +\
-        str(round(tension, 1)) +\
-        " / " + str(round(density, 1)) +\
-        "} \cdot  t \\right)" +\
-        " \cdot \sin \left( 3 / " +\
-        str(round(length, 1)) +\
-        " \cdot x \\right)"
-
-    return text
-
-
-def calculate_new_value_pairs(t, length, tension, density, first, second, third):
+NUM_POINTS = 400
+
+# The initial shapes of the string
+SHAPES = ["Eigenschwingungen", "Gezupft", "Angeschlagen"]
+
+# The width of the hammer striking the string (as a fraction of the length)
+STRIKE_WIDTH = 0.1
+
+# The term of one eigenmode and the series of a plucked or struck string as
+# templates of latex syntax that will be rendered on the client
+LATEX_TERM = r"$amplitude \cdot \cos \left( $k / $length \cdot \sqrt{ $tension " \
+        r"/ $density } \cdot t \right) \cdot \sin \left( $k / $length \cdot x " \
+        r"\right)"
+LATEX_SERIES = {
+        1: r"u(t,x) = \sum_{k=1}^{$modes} \frac{2 \cdot $amplitude \cdot \sin "
+            r"\left( k \pi \cdot $position \right)}{k^2 \pi^2 \cdot $position "
+            r"\cdot (1 - $position)} \cdot \cos \left( \omega_k t \right) "
+            r"\cdot \sin \left( k / $length \cdot x \right), \quad \omega_k = "
+            r"k / $length \cdot \sqrt{ $tension / $density }",
+        2: r"u(t,x) = \sum_{k=1}^{$modes} \frac{4 \cdot $amplitude \cdot \sin "
+            r"\left( k \pi \cdot $position \right) \sin \left( k \pi \cdot "
+            r"$width \right)}{k \pi \cdot \omega_k} \cdot \sin \left( \omega_k t "
+            r"\right) \cdot \sin \left( k / $length \cdot x \right), \quad "
+            r"\omega_k = k / $length \cdot \sqrt{ $tension / $density }",
+        }
+
+
+@memoize()
+def latex_template(shape, terms):
+    """
+    The template of the formula for the initial shape, for the eigenmodes the
+    terms are the numbers of the modes with a nonzero amplitude.
+    """
+    if shape != 0:
+        return Template(LATEX_SERIES[shape])
+    return Template("u(t,x) = " + " + ".join(
+            LATEX_TERM.replace("$amplitude", "$amplitude_%d" % k).replace(
+                "$k", str(k)) for k in terms))
+
+
+def create_latex(length, tension, density, shape, first, second, third,
+        position, amplitude, modes):
+    amplitudes = {"amplitude_%d" % (i + 1): round(value, 1)
+            for i, value in enumerate((first, second, third))}
+    terms = tuple(i + 1 for i, value in enumerate((first, second, third))
+            if value != 0.0)
+    return latex_template(shape, terms).substitute(amplitudes,
+            length=round(length, 1), tension=round(tension, 1),
+            density=round(density, 1), position=round(position, 2),
+            amplitude=round(amplitude, 1), modes=modes,
+            width=round(STRIKE_WIDTH / 2, 2))
+
+
+def modal_amplitudes(shape, modes, first, second, third, position, amplitude):
+    """
+    The amplitudes of the eigenmodes in the initial displacement and in the
+    initial velocity (per unit of the angular frequency of the mode). A plucked
+    string is a triangle with its peak at the position (a fraction of the
+    length), a struck string is at rest and gets a constant velocity along the
+    width of the hammer around the position.
+    """
+    if shape == 0:
+        return np.array([first, second, third]), np.zeros(3)
+    k = np.arange(1, modes + 1)
+    if shape == 1:
+        displacement = 2 * amplitude * np.sin(k * np.pi * position) / \
+                (k**2 * np.pi**2 * position * (1 - position))
+        return displacement, np.zeros(modes)
+    velocity = 4 * amplitude / (k * np.pi) * np.sin(k * np.pi * position) * \
+            np.sin(k * np.pi * STRIKE_WIDTH / 2)
+    return np.zeros(modes), velocity
+
+
+@memoize()
+def calculate_new_value_pairs(t, length, tension, density, shape, first,
+        second, third, position, amplitude, modes):
+    """
+    Superposes the eigenmodes of the string. If t is given as a column vector
+    (see frame_times), the elongation for every point in time is calculated at
+    once with one row per point in time.
+    The results are shared by all sessions and must not be modified.
+    """
     x = np.linspace(0, (length*np.pi), NUM_POINTS)
-    # We use a tenth of the time to slow down the oscillatio, making it more pleasing
-    # for the user and reducing the amount of packages needed to be sent
-    y = first * np.cos(1/length * np.sqrt(tension/density) * t) *\
-            np.sin(1/(length) * x) +\
-            second * np.cos(2/length * np.sqrt(tension/density) * t) *\
-            np.sin(2/length * x) +\
-            third * np.cos(3/length * np.sqrt(tension/density) * t) *\
-            np.sin(3/length * x)
-    return x, y
+    displacement, velocity = modal_amplitudes(shape, modes, first, second,
+            third, position, amplitude)
+    k = np.arange(1, len(displacement) + 1)
+    omega = k / length * np.sqrt(tension/density)
+    phase = omega * np.reshape(t, (-1, 1))
+    # The current amplitudes of the modes (one row per point in time) times the
+    # sampled modes
+    weights = displacement * np.cos(phase) + velocity / omega * np.sin(phase)
+    y = weights @ sine_basis(NUM_POINTS, len(k))
+    if np.ndim(t) == 0:
+        y = y[0]
+    return screen_array(x), screen_array(y)
 
 
 # ColumnDataSource abstracts the sending of new value pairs to the client
 source = ColumnDataSource()
+# Holds all frames of the animation which are then played back on the client
+frame_source = create_frame_source()
 
 plot = Figure(x_range=[-1, 2*np.pi+1], y_range=[-2, 2], plot_height=HEIGHT,
               plot_width=WIDTH_PLOT)
@@ -114,11 +157,19 @@ length = Slider(title="Länge der Saite (mal $\pi$)", value=1., start=0.5,
         step=0.5, end=2.)
 tension = Slider(title="Vorspannung", value=1, start=0.1, step=0.1, end=2)
 density = Slider(title="Liniendichte", value=1, start=0.1, step=0.1, end=2)
+shape = RadioButtonGroup(labels=SHAPES, active=0)
 first = Slider(title="Erste Eigenschwingung", value=1, start=0, step=0.1, end=2)
 second = Slider(title="Zweite Eigenschwingung", value=0., start=0., step=0.1,
         end=2.)
 third = Slider(title="Dritte Eigenschwingung", value=0, start=0., step=0.1,
         end=2.)
+# The parameters of a plucked or struck string
+position = Slider(title="Position (Anteil der Länge)", value=0.2, start=0.05,
+        step=0.05, end=0.95, visible=False)
+amplitude = Slider(title="Auslenkung", value=1, start=0, step=0.1, end=2,
+        visible=False)
+modes = Slider(title="Anzahl der Eigenschwingungen", value=50, start=1, step=1,
+        end=200, visible=False)
 
 # Related to the time-dependent behavior
 animation_toggle = Toggle(label="Animieren")
@@ -137,53 +188,80 @@ plot.add_layout(field_solution)
 # Callback handlers
 def update(attr, old, new):
     x, y = calculate_new_value_pairs(time.value, length.value, tension.value,
-            density.value, first.value, second.value, third.value)
-    source.data = {"x": x, "y": y}
+            density.value, shape.active, first.value, second.value,
+            third.value, position.value, amplitude.value, modes.value)
+    update_source(source, {"x": x, "y": y})
 
 
-def animate():
-    if time.value >= time.end:
-        time.value = time.start
-    else:
-        time.value += time.step
+def update_animation_frames():
+    """
+    Calculates the elongation for all points in time of the time slider in one
+    pass and sends them to the client which plays them back. This is only
+    necessary while the animation is running.
+    """
+    if not animation_toggle.active:
+        return
+    x, frames = calculate_new_value_pairs(frame_times(time), length.value,
+            tension.value, density.value, shape.active, first.value,
+            second.value, third.value, position.value, amplitude.value,
+            modes.value)
+    update_frames(frame_source, frames)
 
-callback_id = 0
 def animation_callback(source):
     """
-    Function adds a callback to the function which animates it. The callback_id
-    is the id of the process the bokeh server spawns. It is necessary to
-    remove it later on.
+    The playback itself is handled by the javascript player attached to the
+    toggle. The server only provides the frames (and frees them again once the
+    animation is stopped).
     """
-    global callback_id
     if animation_toggle.active == 1:
-        callback_id = curdoc().add_periodic_callback(animate, 100)
+        update_animation_frames()
     else:
-        curdoc().remove_periodic_callback(callback_id)
+        update_frames(frame_source, None)
 
 def update_parameter_slider(attr, old, new):
-    text = create_latex(length.value, tension.value, density.value, first.value,
-            second.value, third.value)
+    text = create_latex(length.value, tension.value, density.value,
+            shape.active, first.value, second.value, third.value,
+            position.value, amplitude.value, modes.value)
     field_solution.text = text
     time.value = time.start
     duration_of_full_cycle = 2*np.pi*length.value *\
             np.sqrt(density.value/tension.value)
     time.end = duration_of_full_cycle
     update(0, 0, 0)
+    update_animation_frames()
+
+def shape_callback(source):
+    """
+    Shows the sliders belonging to the initial shape.
+    """
+    for slider in (first, second, third):
+        slider.visible = shape.active == 0
+    for slider in (position, amplitude, modes):
+        slider.visible = shape.active != 0
+    if shape.active == 1:
+        amplitude.title = "Auslenkung"
+    else:
+        amplitude.title = "Anschlaggeschwindigkeit"
+    update_parameter_slider(0, 0, 0)
 
 # Call callback in advance to populate the plot
 update_parameter_slider(0, 0, 0)
 
 
 # Connect widgets with their respective callbacks
-for slider in (length, tension, density, first, second, third):
+for slider in (length, tension, density, first, second, third, position,
+        amplitude, modes):
     slider.on_change("value", update_parameter_slider)
 
+shape.on_click(shape_callback)
+
 time.on_change("value", update)
 
 animation_toggle.on_click(animation_callback)
+attach_client_animation(animation_toggle, time, source, frame_source)
 
 # Assemble plot and create html
-inputs = WidgetBox(length, tension, density, first, second, third,
-        animation_toggle, time)
+inputs = WidgetBox(length, tension, density, shape, first, second, third,
+        position, amplitude, modes, animation_toggle, time)
 curdoc().add_root(Column(Row(plot, inputs, width=WIDTH_TOTAL), placeholder,
         height=HEIGHT+100))  
@@ -6,6 +6,8 @@ from bokeh.models import ColumnDataSource, Band
 from bokeh.models.widgets import Slider, RadioButtonGroup, Toggle
 from bokeh.plotting import figure
 
+from extensions.viewport import Viewport, sample_window
+
 '''
 This plot introduces the Taylor-Polynoms for approximating arbitrary continously
 differentiable functions. The user selects a order of approximation and an
@@ -15,6 +17,8 @@ derivatives. The values of the function made up of the Taylor Polynomes up to
 the degree chosen are calculated according to the common rule.
 A left-point based rectangualr quadrature is in use to compute the numerical
 deviation from the true solution.
+The curves are calculated over the visible part of the plot and again whenever
+the user pans or zooms (see extensions/viewport.py).
 '''
 
 # Geometry constants of the plot
@@ -45,9 +49,6 @@ SIZE_CROSS = 15
 # position
 SLIDER_STEPPING = 0.1
 
-# Number of points used to discretize the interval for drawing
-NUMBER_OF_POINTS = 100
-
 def FUNC_1_0(x):
     return np.sin(x)
 def FUNC_1_1(x):
@@ -65,9 +66,8 @@ def FUNC_1_5(x):
 # summation later on
 FUNC_1 = [FUNC_1_0, FUNC_1_1, FUNC_1_2, FUNC_1_3, FUNC_1_4, FUNC_1_5]
 
-def calculate_new_true_function_value_pairs():
-    x = np.linspace(X_LEFT, X_RIGHT, NUMBER_OF_POINTS)
-    y = FUNC_1_0(x)
+def calculate_new_true_function_value_pairs(window):
+    x, y = sample_window(FUNC_1_0, window)
     return x, y
 
 def assemble_taylor_polynomial(order, x_spot):
@@ -84,9 +84,8 @@ def assemble_taylor_polynomial(order, x_spot):
 
     return approximation
 
-def calculate_new_taylor_approximation_value_pairs(approximation):
-    x = np.linspace(X_LEFT, X_RIGHT, NUMBER_OF_POINTS)
-    y = approximation(x)
+def calculate_new_taylor_approximation_value_pairs(approximation, window):
+    x, y = sample_window(approximation, window)
 
     return x, y
 
@@ -110,6 +109,9 @@ plot = figure(plot_height=HEIGHT, plot_width=WIDTH_PLOT,
         x_range=[X_LEFT, X_RIGHT], y_range=[Y_BOTTOM, Y_TOP])
 plot.toolbar.active_drag = None  # Helpful for touchscreen users
 
+# The part of the plot the curves are calculated for
+viewport = Viewport(plot)
+
 plot.line(x="x", y="y", source=curve_values, color="black",
         line_width=LINE_WIDTH_TRUE)
 plot.line(x="x", y="y", source=taylor_values, color="blue",
@@ -131,16 +133,19 @@ advanced_toggle = Toggle(label="Fehlerbalken einblenden")
 error_position_slider = Slider(title="""Vergleich zwischen Funktionswert und Näherung an der Stelle x_0""", value=-1, start=X_TAYLOR_LEFT,
         end=X_TAYLOR_RIGHT, step=SLIDER_STEPPING, visible=False)
 
-# Right now, only one function is availabe, so its values can be statically
-# calculated upfront
-x_true, y_true = calculate_new_true_function_value_pairs()
-curve_values.data = {"x": x_true, "y": y_true}
+# Right now, only one function is availabe, so its values only change with the
+# viewport
+def update_true_function():
+    x_true, y_true = calculate_new_true_function_value_pairs(viewport.current)
+    curve_values.data = {"x": x_true, "y": y_true}
+
+update_true_function()
 
 # Defining callbacks
 def update_slider(attr, old, new):
     approximation = assemble_taylor_polynomial(order.value, x_spot.value)
     x_taylor, y_taylor = calculate_new_taylor_approximation_value_pairs(
-            approximation)
+            approximation, viewport.current)
     taylor_values.data = {"x": x_taylor, "y": y_taylor}
     point_values.data = {"x": [x_spot.value, ], "y": [FUNC_1_0(x_spot.value), ]}
     if advanced_toggle.active:
@@ -154,6 +159,10 @@ def show_advanced(source):
     error_position_slider.visible = True
     update_slider(0, 0, 0)
 
+def update_viewport(window):
+    update_true_function()
+    update_slider(0, 0, 0)
+
 # Use callback in advance to populate the plot
 update_slider(0, 0, 0)
 
@@ -163,6 +172,8 @@ for slider in (order, x_spot, error_position_slider):
 
 advanced_toggle.on_click(show_advanced)
 
+viewport.on_change(update_viewport)
+
 # Assemble plot and create html
 inputs = widgetbox(order, x_spot, advanced_toggle, error_position_slider)
 curdoc().add_root(row(plot, inputs, width=WIDTH_TOTAL))
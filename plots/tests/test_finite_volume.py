@@ -0,0 +1,40 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import extensions.finite_volume as finite_volume
+from extensions.finite_volume import Flux, solve
+
+"""
+The frames of the finite-volume solution (see extensions/finite_volume.py) are
+either calculated up to their time or NaN, never those of an earlier time.
+"""
+
+BURGERS = Flux(lambda u, x: u**2 / 2, lambda u, x: u, 0.)
+
+
+def step(x):
+    return np.where(x < 0, 1., 0.)
+
+
+def test_shock_position():
+    x, frames = solve(BURGERS, step, -5., 5., 400, np.linspace(0, 4, 5))
+    # The shock between 1 and 0 moves at speed 1/2
+    shock = x[np.argmin(np.abs(frames[-1] - 0.5))]
+    assert abs(shock - 2.) < 0.1
+    assert not np.isnan(frames).any()
+
+
+def test_frames_beyond_max_steps(monkeypatch, caplog):
+    monkeypatch.setattr(finite_volume, "MAX_STEPS", 50)
+    times = np.linspace(0, 10, 101)
+    x, frames = solve(BURGERS, step, -5., 5., 400, times)
+    reached = ~np.isnan(frames).any(axis=1)
+    assert reached[0] and not reached[-1]
+    # Frames are either complete or NaN, the reached ones come first
+    assert np.isnan(frames[~reached]).all()
+    assert reached[:reached.sum()].all()
+    assert "Stopped the solution" in caplog.text
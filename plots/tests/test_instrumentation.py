@@ -0,0 +1,49 @@
+import os
+import sys
+
+from bokeh.models.widgets import Button, RadioButtonGroup, Toggle
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extensions.instrumentation import _app_name, _callback_name
+
+"""
+The callbacks of the widgets are told apart by their names in the metrics (see
+extensions/instrumentation.py).
+"""
+
+
+def animation_callback(active):
+    pass
+
+
+def advanced_callback(active):
+    pass
+
+
+def registered(widget):
+    return widget._callbacks["active"][-1]
+
+
+def test_toggle_handlers_have_their_own_names():
+    animation_toggle = Toggle()
+    advanced_toggle = Toggle()
+    animation_toggle.on_click(animation_callback)
+    advanced_toggle.on_click(advanced_callback)
+    assert _callback_name(registered(animation_toggle)) == "animation_callback"
+    assert _callback_name(registered(advanced_toggle)) == "advanced_callback"
+
+
+def test_group_handlers_have_their_own_names():
+    selector = RadioButtonGroup(labels=["a", "b"])
+    selector.on_click(lambda active: None)
+    name = _callback_name(registered(selector))
+    assert name.startswith("test_group_handlers_have_their_own_names")
+    assert _app_name(registered(selector)) == "test_instrumentation"
+
+
+def test_button_handlers_are_named_directly():
+    button = Button()
+    button.on_click(advanced_callback)
+    callback = button._event_callbacks["button_click"][-1]
+    assert _callback_name(callback) == "advanced_callback"
@@ -0,0 +1,45 @@
+import os
+import runpy
+import shutil
+import sys
+
+import numpy as np
+import pytest
+
+PLOTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PLOTS_DIR)
+
+from extensions.jsexpr import check_parity, random_samples
+
+"""
+Parity of the javascript versions of the functions of einfache_funktionen with
+their python versions (see extensions/jsexpr.py). The javascript is evaluated by
+node.js, the tests are skipped if it is not installed.
+"""
+
+NODE = shutil.which("node")
+
+SAMPLES = 50
+
+
+def function_table():
+    namespace = runpy.run_path(os.path.join(PLOTS_DIR,
+            "einfache_funktionen.py"))
+    return namespace["functions"]
+
+
+FUNCTIONS = function_table()
+
+
+@pytest.mark.skipif(NODE is None, reason="node.js is not installed")
+@pytest.mark.parametrize("name", sorted(FUNCTIONS))
+def test_parity(name):
+    function = FUNCTIONS[name]["definition"]
+    random = np.random.default_rng(0)
+    samples = random_samples(function, SAMPLES, (-2, 2),
+            np.linspace(-10, 10, 401), random)
+    mismatches = check_parity(function, samples, node=NODE)
+    if mismatches:
+        args, difference = max(mismatches, key=lambda item: item[1])
+        pytest.fail("%d of %d samples differ, e.g., by %g for %s" % (
+                len(mismatches), len(samples), difference, args[:-1]))
@@ -7,6 +7,11 @@ from bokeh.models import ColumnDataSource
 from bokeh.models.widgets import Slider, RadioButtonGroup, Toggle, Dropdown
 from bokeh.plotting import Figure
 
+from extensions.cache import memoize
+from extensions.coalesce import on_slider_change
+from extensions.finite_volume import Flux, solve
+from extensions.payload import nan_separated_rows, screen_columns, screen_array
+
 """
 This plot presents the characteristics of transport equations drawn below the
 simulation that can evolve over time. The user can select between different
@@ -23,8 +28,15 @@ explore the aspects of transport equations:
 Aside for special case of burgers flux together with IC jump with gap, each
 combination of flux and initial condition is generalized as the solution
 definition u=u(t,x) or the characteristics defintion t=t(x,xi_0) calling the
-definition of the initial condition. For a detailed derivation consult
+definition of the initial condition. All of them are evaluated for whole arrays
+of points (and starting points) at once. For a detailed derivation consult
 ../docs/transport_gleichung.tex
+
+Optionally, the solution is additionally calculated numerically by a
+finite-volume method (see extensions/finite_volume.py) for every flux and
+initial condition, including the shocks and rarefaction waves of the burgers
+flux. The solution at all times of the time slider is calculated at once, the
+time slider and the animation only select one of the stored frames.
 """
 
 # Geometry constants for the plot
@@ -42,6 +54,16 @@ Y_TOP = 2.5
 # determines the endpoint (x=xi_0+offset, t)
 X_CHARACTERISTICS_OFFSET = 5
 
+# Number of points the solution is drawn with, number of characteristics per
+# unit on the x axis and number of points of a curved characteristic
+NUMBER_OF_POINTS = 1000
+CHARACTERISTICS_PER_UNIT = 4
+CURVED_CHARACTERISTICS_POINTS = 50
+
+# Number of cells of the numerical solution within the viewport (fast waves get
+# fewer, see extensions/finite_volume.py)
+NUMERICAL_CELLS = 400
+
 # Proportionality factor "Halber Tacho" in 1/h
 k = 2000
 
@@ -58,36 +80,35 @@ xs_0: a numpy array of points on the x_axis on which the characteristics will
 start (make sure the distance between the points is wide enough so that the
 lines are not cluttered but also not far enough so that there are still a
 representative number of characteristics)
+
+All functions work on whole numpy arrays. The solutions return the arrays x and
+u (NaN where the solution is not defined, e.g., in the gap of JUMP_WITH_GAP).
+The characteristics return two arrays xs and ts with one row per characteristic
+(starting point), they are drawn as one line with NaNs in between.
 """
 
 # Flux F(u, x) = a*u  (in the interface to the user a is the speed of the cars)
 def CONSTANT_CHARACTERISTICS(a, c, d, xs_0, initial_function):
-    xs = []
-    ts = []
-    for x_0 in xs_0:
-        xs.append([x_0, x_0 + X_CHARACTERISTICS_OFFSET])
-        ts.append([0, X_CHARACTERISTICS_OFFSET/a])
+    xs = np.column_stack((xs_0, xs_0 + X_CHARACTERISTICS_OFFSET))
+    ts = np.broadcast_to([0, X_CHARACTERISTICS_OFFSET/a], xs.shape)
     return xs, ts
 
 # Constant speed simply propagates the initial condition to the right
 def CONSTANT_SOLUTION(x, t, a, c, d, initial_function):
-    return initial_function(x - a * t, x, c, d, final_output=True)
+    return x, initial_function(x - a * t, c, d)
 
 
 # Flux F(u, x) = k  (velocity is inverse proportional to the density v(u) = k/u,
 # flux is velocity times density F =  v(u) * u = k/u * u = k)
 def IDEAL_SCHOOL_CHARACTERISTICS(a, c, d, xs_0, initial_function):
-    xs = []
-    ts = []
-    for x_0 in xs_0:
-        xs.append([x_0, x_0])
-        ts.append([0, 10000]) # Just a vertical line
+    xs = np.column_stack((xs_0, xs_0))
+    ts = np.broadcast_to([0, 10000], xs.shape)  # Just vertical lines
     return xs, ts
 
 # If all cars follow the ideal recommendation, then the local higher density
 # keeps at the same location over time
 def IDEAL_SCHOOL_SOLUTION(x, t, a, c, d, initial_function):
-    return initial_function(x, x, c, d, final_output=True)
+    return x, initial_function(x, c, d)
 
 
 # Flux F(u, x) = k - klu (velocity is inverse proportional to the density when
@@ -96,150 +117,93 @@ def IDEAL_SCHOOL_SOLUTION(x, t, a, c, d, initial_function):
 def SCHOOL_CHARACTERISTICS(a, c, d, xs_0, initial_function):
     length = a * 0.001  # Convert to kilometers
 
-    xs = []
-    ts = []
-    for x_0 in xs_0:
-        t_pos = -X_CHARACTERISTICS_OFFSET/(length*k + EPS)
-        if t_pos > 0:
-            xs.append([x_0, x_0 + X_CHARACTERISTICS_OFFSET])
-            ts.append([0, -X_CHARACTERISTICS_OFFSET/(length*k + EPS)])
-        else:
-            xs.append([x_0 - X_CHARACTERISTICS_OFFSET, x_0])
-            ts.append([-t_pos, 0])
+    t_pos = -X_CHARACTERISTICS_OFFSET/(length*k + EPS)
+    if t_pos > 0:
+        xs = np.column_stack((xs_0, xs_0 + X_CHARACTERISTICS_OFFSET))
+        ts = np.broadcast_to([0, t_pos], xs.shape)
+    else:
+        xs = np.column_stack((xs_0 - X_CHARACTERISTICS_OFFSET, xs_0))
+        ts = np.broadcast_to([-t_pos, 0], xs.shape)
     return xs, ts
 
 # The local higher density propagates against the movement direction of the cars
 # (i.e., it moves backwards) by a speed depending on the cars' length
 def SCHOOL_SOLUTION(x, t, a, c, d, initial_function):
     length = a * 0.001  # Convert to kilometers
-    return initial_function(x + length*k*t, x, c, d, final_output=True)
+    return x, initial_function(x + length*k*t, c, d)
 
 
 # Flux F(u, x) = a * u^2 (creates shocks and rarefaction waves)
-# Requires special case for JUMP_WITH_GAP so that no characteristic lines are
-# drawn in positions where the initial condition is not defined
+# No characteristic lines are drawn in positions where the initial condition is
+# not defined (the gap of JUMP_WITH_GAP)
 def BURGERS_CHARACTERISTICS(a, c, d, xs_0, initial_function):
-    xs = []
-    ts = []
-    for x_0 in xs_0:
-        if initial_function == JUMP_WITH_GAP:
-            if 0 < x_0 <= d:
-                continue
-
-        xs.append([x_0, x_0 + X_CHARACTERISTICS_OFFSET])
-        # Value of the initial condition at the current starting point x_0
-        initial = initial_function(x_0, x_0, c, d,
-                final_output=False)[1]
-
-        ts.append([0, X_CHARACTERISTICS_OFFSET/(a * initial + EPS)])
-
+    # Value of the initial condition at the starting points
+    initial = initial_function(xs_0, c, d)
+    defined = ~np.isnan(initial)
+    xs = np.column_stack((xs_0, xs_0 + X_CHARACTERISTICS_OFFSET))[defined]
+    ts = np.zeros(xs.shape)
+    ts[:, 1] = X_CHARACTERISTICS_OFFSET/(a * initial[defined] + EPS)
     return xs, ts
 
 def BURGERS_SOLUTION(x, t, a, c, d, initial_function):
-    # Special treatment for the JUMP_WITH_GAP IC so that the 
+    # Special treatment for the JUMP_WITH_GAP IC, the gap widens with the speed
+    # of the right part
     if initial_function == JUMP_WITH_GAP:
-        x_left = []
-        x_middle = []
-        x_right = []
-        y_left = []
-        y_middle = []
-        y_right = []
-        for ele in x:
-            if ele < 0:
-                x_left.append(ele)
-                y_left.append(0)
-            #elif d <= ele < a*t*c:
-            #    x_middle.append(ele)
-            #    y_middle.append(0)
-            elif ele >= d + a*t*c:
-                x_right.append(ele)
-                y_right.append(c)
-        return [x_left, x_middle, x_right], [y_left, y_middle, y_right]
-    else:
-        # Aside from the case of the jump with gap x_inital is equal to x.
-        x_initial, u_initial = initial_function(x, x, c, d, final_output=False)
-        return initial_function(x_initial - a * u_initial * t, x_initial, c, d,
-                final_output=True)
+        u = np.full(x.shape, np.nan)
+        u[x < 0] = 0
+        u[x >= d + a*t*c] = c
+        return x, u
+    u_initial = initial_function(x, c, d)
+    return x, initial_function(x - a * u_initial * t, c, d)
 
 # Flux F(u, x) = a * x * u
 # TODO Check if the solution line that this function creates is physically
 # accurate
 def LOCATION_DEPENDENT_FLUX_CHARACTERISTICS(a, c, d, xs_0, initial_function):
     # Location dependent flux induces that the characteristics are not straight
-    # lines anymore
-    xs = []
-    ts = []
-    for x_0 in xs_0:
-        # On the negative x-side the function is monotonically decreasing,
-        # therefore it has to be drawn from top to bottom, for the positive
-        # x-side it is the opposite
-        if x_0 < 0:
-            x = np.linspace(x_0 - X_CHARACTERISTICS_OFFSET, x_0)
-            xs.append(x)
-            t = 1/(a + EPS) * np.log(np.abs(x/(x_0 + EPS)) + EPS)
-            ts.append(t)
-        elif x_0 > 0:  # Ignore x_0 == 0 since log is not defined there
-            x = np.linspace(x_0, x_0 + X_CHARACTERISTICS_OFFSET)
-            xs.append(x)
-            t = 1/(a + EPS) * np.log(np.abs(x/(x_0 + EPS)) + EPS)
-            ts.append(t)
+    # lines anymore. On the negative x-side the function is monotonically
+    # decreasing, therefore it is drawn to the left of the starting point, for
+    # the positive x-side to the right. x_0 == 0 is ignored since log is not
+    # defined there.
+    xs_0 = xs_0[xs_0 != 0]
+    left = np.where(xs_0 < 0, xs_0 - X_CHARACTERISTICS_OFFSET, xs_0)
+    xs = left[:, None] + X_CHARACTERISTICS_OFFSET * \
+            np.linspace(0, 1, CURVED_CHARACTERISTICS_POINTS)
+    ts = 1/(a + EPS) * np.log(np.abs(xs/(xs_0[:, None] + EPS)) + EPS)
     return xs, ts
 
 def LOCATION_DEPENDENT_FLUX_SOLUTION(x, t, a, c, d, initial_function):
     xi_0 = x * np.exp(-a * t)
-    xs, ys = initial_function(xi_0, x, c, d, final_output=True)
-    ys[0] = ys[0] * np.exp(-t)
-    try:  # Only necessary for JUMP_WITH_GAP where two lines are drawn
-        ys[1] = ys[1] * np.exp(-t)
-    except:
-        pass
-    return xs, ys
+    return x, initial_function(xi_0, c, d) * np.exp(-t)
     
 
 """
-Define the initial conditions. They require the propagated x-position(x_of_t) as
-well as the non-transformed x-position(x_original).
+Define the initial conditions. They require the propagated x-position (x_of_t),
+a numpy array, and return the values there (NaN where the initial condition is
+not defined).
 c, d: Parameters to the respective intial conditions
-final_output: flag whether the output should be in a list of lists (necessary
-for the multi_line renderer) or in one continous numpy array
 """
 
 # Gaussian bell (normal distribution)
 # c: Mean
 # d: Standard deviation
-def BELL(x_of_t, x_original, c, d, final_output=False):
-    y = 1/(np.sqrt(2*np.pi*d**2)) * np.exp(-(x_of_t - c)**2/(2*d**2))
-    if not final_output:
-        return np.array(x_original), np.array(y)
-    else:
-        return [x_original, []], [y, []]
+def BELL(x_of_t, c, d):
+    return 1/(np.sqrt(2*np.pi*d**2)) * np.exp(-(x_of_t - c)**2/(2*d**2))
 
 # ____
 #     \____
 # c, d: Parameters that respectively control the top and bottom vertex, they
 # change their role depending on which value is greater
-def PIECEWISE_LINEAR(x_of_t, x_original, c, d, final_output=False):
+def PIECEWISE_LINEAR(x_of_t, c, d):
     left = min(c, d)
-    if left == c:
-        right = d
-    else:
-        right = c
+    right = max(c, d)
 
     if right == left:
         right = right + EPS
 
-    # Model linear decreasing part y = slope * x + offset
-    slope = -1/(right - left)
-    offset = - slope * right
-
-    y = np.piecewise(x_of_t,
-        [x_of_t < left, (left <= x_of_t) & (x_of_t <= right), right < x_of_t],
-        [1, lambda element: slope * element + offset, 0])
-    
-    if not final_output:
-        return np.array(x_original), np.array(y)
-    else:
-        return [x_original, []], [y, []]
+    # 1 left of the left vertex, 0 right of the right vertex and linearly
+    # decreasing in between
+    return np.clip((right - x_of_t) / (right - left), 0, 1)
 
 #          ______
 #_______
@@ -247,45 +211,37 @@ def PIECEWISE_LINEAR(x_of_t, x_original, c, d, final_output=False):
 # x=0
 # c: Height of the right lines
 # d: x Starting point of the right lines
-def JUMP_WITH_GAP(x_of_t, x_original, c, d, final_output=False):
-    # If the inputs are a multi-dimensional thay contain the __len__ methods
-    # otherwhise not
-    try:
-        len(x_of_t)
-        is_array = True
-    except TypeError:
-        is_array = False
-
-    # Treatment depending on whether the input is multi-dimensional or not
-    if is_array:
-        x_left = []
-        x_right = []
-        y_left = []
-        y_right = []
-        for i in range(len(x_of_t)):
-            if x_of_t[i] < 0:
-                x_left.append(x_original[i])
-                y_left.append(0)
-            elif d <= x_of_t[i]:
-                x_right.append(x_original[i])
-                y_right.append(c)
-    else:
-        x_left = 0
-        x_right = 0
-        y_left = 0
-        y_right = 0
-        if x_of_t < 0:
-            x_left = x_original
-            y_left = 0
-        elif d <= x_of_t:
-            x_right = x_original 
-            y_right = c
-
-    if not final_output:
-        return np.array(x_left + x_right), np.array(y_left + y_right)
-    else:
-        return [np.array(x_left), np.array(x_right)],\
-                [np.array(y_left), np.array(y_right)]
+def JUMP_WITH_GAP(x_of_t, c, d):
+    y = np.full(np.shape(x_of_t), np.nan)
+    y[x_of_t < 0] = 0
+    y[d <= x_of_t] = c
+    return y
+
+
+"""
+Define the fluxes for the numerical solution as functions of the parameter a.
+The flux of burgers' equation is a * u^2 / 2, so that the speed of the
+characteristics is the same as above. Where an initial condition is not defined
+(the gap of JUMP_WITH_GAP), it is zero (no cars) for the numerical solution.
+"""
+
+def CONSTANT_FLUX(a):
+    return Flux(lambda u, x: a * u, lambda u, x: np.full(np.shape(u), a), None)
+
+def IDEAL_SCHOOL_FLUX(a):
+    return Flux(lambda u, x: np.full(np.shape(u), k),
+            lambda u, x: np.zeros(np.shape(u)), None)
+
+def SCHOOL_FLUX(a):
+    length = a * 0.001  # Convert to kilometers
+    return Flux(lambda u, x: k - k * length * u,
+            lambda u, x: np.full(np.shape(u), -k * length), None)
+
+def BURGERS_FLUX(a):
+    return Flux(lambda u, x: a * u**2 / 2, lambda u, x: a * u, 0.)
+
+def LOCATION_DEPENDENT_FLUX(a):
+    return Flux(lambda u, x: a * x * u, lambda u, x: a * x + 0 * u, None)
 
 
 # None elements will be rendered as seperators in the dropdown menu
@@ -315,6 +271,13 @@ characteristics = {
         "burgers": BURGERS_CHARACTERISTICS,
         "location_dependent": LOCATION_DEPENDENT_FLUX_CHARACTERISTICS
         }
+fluxes = {
+        "constant": CONSTANT_FLUX,
+        "ideal_school": IDEAL_SCHOOL_FLUX,
+        "school": SCHOOL_FLUX,
+        "burgers": BURGERS_FLUX,
+        "location_dependent": LOCATION_DEPENDENT_FLUX
+        }
 slider_names = {
         "constant": "Fahrzeuggeschwindigkeit in km/h",
         "ideal_school": "Ohne Funktion",
@@ -333,18 +296,46 @@ def calculate_solution_value_pairs(type_selected, initial_selected, time, a,
     """
     Calls the respective functions.
     """
-    x = np.linspace(X_LEFT, X_RIGHT, 100)
-    xs, ys = solutions[type_selected](x, time, a, c, d,
+    x = np.linspace(X_LEFT, X_RIGHT, NUMBER_OF_POINTS)
+    x, y = solutions[type_selected](x, time, a, c, d,
             initials[initial_selected])
 
-    return xs, ys
+    return x, y
+
+
+@memoize()
+def calculate_numerical_frames(type_selected, initial_selected, a, c, d,
+        time_start, time_end, time_step):
+    """
+    The numerical solution for all times the time slider can reach as one frame
+    per row. The frames are shared by all sessions and must not be modified.
+    """
+    number_of_frames = int(round((time_end - time_start) / time_step)) + 1
+    times = time_start + time_step * np.arange(number_of_frames)
+    initial_function = initials[initial_selected]
+    x, frames = solve(fluxes[type_selected](a),
+            lambda x: np.nan_to_num(initial_function(x, c, d)), X_LEFT,
+            X_RIGHT, NUMERICAL_CELLS, times)
+    return screen_array(x), screen_array(frames)
+
+
+def calculate_numerical_value_pairs(type_selected, initial_selected, time, a,
+        c, d):
+    """
+    Selects the frame of the current time from the stored numerical solution.
+    """
+    x, frames = calculate_numerical_frames(type_selected, initial_selected, a,
+            c, d, time.start, time.end, time.step)
+    frame = int(round((time.value - time.start) / time.step))
+    return x, frames[min(max(frame, 0), len(frames) - 1)]
 
 
 def calculate_characteristics_endpoints(type_selected, initial_selected, a,
         c, d):
     # The spacing of the characteristics, i.e., the density of lines to be drawn
-    # is arbitrary. Here, 4 in one in integer interval
-    xs_0 = np.linspace(X_LEFT, X_RIGHT, 4*int(X_RIGHT-X_LEFT) + 1)
+    # is arbitrary
+    xs_0 = np.linspace(X_LEFT, X_RIGHT,
+            CHARACTERISTICS_PER_UNIT*int(X_RIGHT-X_LEFT) + 1)
 
     return characteristics[type_selected](a, c, d, xs_0,
             initials[initial_selected])
@@ -353,6 +344,7 @@ def calculate_characteristics_endpoints(type_selected, initial_selected, a,
 # ColumnDataSource abstract the sending of new value pairs to the client to be
 # drawn
 solution_source = ColumnDataSource()
+numerical_source = ColumnDataSource(data={"x": [], "y": []})
 characteristics_source = ColumnDataSource()
 horizontal_time_line_source = ColumnDataSource()
 
@@ -373,11 +365,15 @@ plot_bottom.toolbar.active_drag = None  # Helpful for touchscreen users
 plot_bottom.line(x="x", y="y", source=horizontal_time_line_source,
         color="black")
 
-# The solution is drawn as multiple lines however this is only necessary for
-# JUMP_WITH_GAP IC so properly render the gap
-plot_top.multi_line(xs="xs", ys="ys", source=solution_source)
+# The solution has a gap for the JUMP_WITH_GAP IC and the characteristics are
+# many lines. Both are sent as one array with NaNs in between, the line glyph
+# leaves a gap at every NaN.
+plot_top.line(x="x", y="y", source=solution_source)
+# The numerical solution (if activated)
+plot_top.line(x="x", y="y", source=numerical_source, color="red",
+        line_dash="dashed")
 
-plot_bottom.multi_line(xs="xs", ys="ts", source=characteristics_source)
+plot_bottom.line(x="x", y="t", source=characteristics_source)
 
 type_selector = Dropdown(label="Typ des Flusses auswählen", menu=names,
         button_type ="warning", value="constant")
@@ -388,6 +384,8 @@ slider_1 = Slider(title="Fahrzeuggeschwindigkeit in km/h", start=0.1, end=10,
 animation_toggle = Toggle(label="Animieren")
 # Lets the user adjust the time in the transient simulation on its own
 time = Slider(title="Zeit", value=0, start=0, end=10, step=0.1)
+# Shows the numerical solution in addition to the analytic one
+numerical_toggle = Toggle(label="Numerische Lösung (Finite Volumen)")
 # Enables the visibility for advanced widgets that are collapsed for a better
 # readability of the plot
 advanced_toggle = Toggle(label="Mehr Optionen")
@@ -401,18 +399,31 @@ initial_slider_2 = Slider(title="Skalierung der AB", start=0.1, end=5, step=0.1,
 
 
 # Callback helpers
-def update_top_plot():
-    xs, ys = calculate_solution_value_pairs(type_selector.value,
+def update_top_plot(numerical=True):
+    """
+    Without numerical, the numerical solution (if activated) is hidden instead
+    of solved for the current parameters.
+    """
+    x, y = calculate_solution_value_pairs(type_selector.value,
             initial_selector.active, time.value, slider_1.value,
             initial_slider_1.value, initial_slider_2.value)
 
-    solution_source.data = {"xs": xs, "ys": ys}
+    solution_source.data = screen_columns({"x": x, "y": y})
+
+    if numerical_toggle.active and numerical:
+        x, y = calculate_numerical_value_pairs(type_selector.value,
+                initial_selector.active, time, slider_1.value,
+                initial_slider_1.value, initial_slider_2.value)
+        numerical_source.data = {"x": x, "y": y}
+    elif len(numerical_source.data["x"]):
+        numerical_source.data = {"x": [], "y": []}
 
 def update_bottom_plot():
     xs, ts = calculate_characteristics_endpoints(type_selector.value,
             initial_selector.active, slider_1.value,
             initial_slider_1.value, initial_slider_2.value)
-    characteristics_source.data = {"xs": xs, "ts": ts}
+    characteristics_source.data = {"x": nan_separated_rows(xs),
+            "t": nan_separated_rows(ts)}
 
     horizontal_time_line_source.data = {
             "x": [-20, 20],
@@ -427,10 +438,23 @@ def animate():
 
 
 # Callbacks
-def update_parameter_slider(attr, old, new):
+def update_time_slider(attr, old, new):
     update_top_plot()
     update_bottom_plot()
 
+def update_parameter_slider(attr, old, new):
+    """
+    Every new parameter takes another numerical solution (up to a few tenths
+    of a second), it is only calculated once the slider is released
+    (numerical_callback).
+    """
+    update_top_plot(numerical=False)
+    update_bottom_plot()
+
+def numerical_callback(attr, old, new):
+    if numerical_toggle.active:
+        update_top_plot()
+
 def update_type_selector(attr, old, new):
     update_top_plot()
     update_bottom_plot()
@@ -471,8 +495,12 @@ update_bottom_plot()
 # Connect the widgets with their respective callbacks
 advanced_toggle.on_click(toggle_callback)
 animation_toggle.on_click(animation_callback)
-for parameter_slider in (slider_1, initial_slider_1, initial_slider_2, time):
+numerical_toggle.on_click(lambda active: update_top_plot())
+for parameter_slider in (slider_1, initial_slider_1, initial_slider_2):
     parameter_slider.on_change("value", update_parameter_slider)
+on_slider_change((slider_1, initial_slider_1, initial_slider_2),
+        numerical_callback, throttled=True)
+time.on_change("value", update_time_slider)
 
 type_selector.on_change("value", update_type_selector)
 
@@ -480,5 +508,6 @@ initial_selector.on_click(update_initial_selector)
 
 # Assemble the plot and create the html
 inputs = WidgetBox(type_selector, slider_1, animation_toggle, time,
-        advanced_toggle, initial_selector, initial_slider_1, initial_slider_2)
+        numerical_toggle, advanced_toggle, initial_selector, initial_slider_1,
+        initial_slider_2)
 curdoc().add_root(Row(Column(plot_top, plot_bottom), inputs, width=WIDTH_TOTAL))
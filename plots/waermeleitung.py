@@ -3,10 +3,21 @@ import numpy as np
 
 from bokeh.layouts import Row, WidgetBox
 from bokeh.io import curdoc
-from bokeh.models import ColumnDataSource
+from bokeh.models import ColumnDataSource, LinearColorMapper
 from bokeh.models.widgets import Slider, RadioButtonGroup, Toggle
+from bokeh.palettes import RdBu11
 from bokeh.plotting import Figure
 
+from extensions.cache import memoize
+from extensions.incremental import update_source
+from extensions.payload import screen_array
+from extensions.animation import attach_client_animation, create_frame_source,\
+        frame_times, update_frames
+from extensions.coalesce import on_slider_change
+from extensions.heat_plate import simulate
+from extensions.spectral import decay_factors, evolve, sine_basis,\
+        sine_coefficients
+
 """
 This plot presents the transient behaviour of the analytical solution to a
 simple heat transfer problem in 1D with isotropic and homogeneous temperature
@@ -15,6 +26,24 @@ The user can set the parameters as well as initial and boundary conditions. We
 only consider the more easy Dirichlet boundary conditions, i.e., fixed
 temperature (but possibly non-zero) at both ends.
 
+The initial condition is either given by the coefficients of the first three
+eigenfunctions or by a temperature profile (e.g., a hot block in the middle of
+the bar). Such a profile is projected onto many eigenfunctions by a fast sine
+transform (see extensions/spectral.py). The solution for all times of the time
+slider is calculated at once, the time slider and the animation only select one
+of the frames.
+
+In the second mode, the heat conduction in a square plate is simulated
+numerically (see extensions/heat_plate.py). The left and right edges are held
+at the temperatures of the ends of the bar, along the other two edges the
+temperature changes linearly in between. The initial conditions are the same as
+for the bar, extended to the plate. Every step of the time slider is one
+implicit time step. The time slider only advances the temperature shown by the
+steps up to its time (or goes back to the closest checkpoint before), all frames
+are only calculated once the animation starts and are then played back on the
+client like the ones of the bar. The plate is only recalculated when a parameter
+slider is released.
+
 A toggle allows to activate advanced options so that the first user is not
 distracted by the functionality.
 """
@@ -32,36 +61,109 @@ LINE_WIDTH = 2
 # has to correspond with the boundary conditions)
 DOT_SIZE = 10
 
+# Number of points the bar is discretized with (including both ends), at most
+# two less eigenfunctions can be represented on this grid
+GRID_POINTS = 513
+
+# The initial conditions the user can choose from. Apart from the first one, they
+# are temperature profiles over the bar (parametrized by the position
+# s = x / L between 0 and 1)
+PROFILES = ["Eigenformen", "Rechteck", "Dreieck", "Sprung"]
+
+# Number of points of the plate in each direction (including the edges)
+PLATE_POINTS = 101
+
+# Every how many time steps the temperature of the plate is kept, the time
+# slider moving backwards continues from the closest one
+PLATE_CHECKPOINT_STEPS = 10
+
+
+def initial_profile(profile, amplitude, s):
+    if profile == 1:  # Hot block in the middle
+        return amplitude * ((1/3 < s) & (s < 2/3))
+    elif profile == 2:  # Hot in the middle, linearly cooler to both ends
+        return amplitude * (1 - np.abs(2 * s - 1))
+    else:  # Left half hot
+        return amplitude * (s < 1/2)
 
-def update_data(length_factor, conductivity, first, second, third, left, right,
-        time):
+
+@memoize(maxsize=64)
+def update_data(length_factor, conductivity, profile, amplitude, first, second,
+        third, left, right, modes, times):
     """
     Callback to update the analytical solution. It will therefore superpose the
-    contribution of each eigenfunction (we consider the first three). A
+    contribution of each eigenfunction, either the first three given by their
+    coefficients or as many as chosen for a temperature profile. A
     superposition with the trivial solution is necessary when the temperature at
     the bar ends is unequal to zero.
+    The solution is calculated for all the times (see frame_times) at once with
+    one row per point in time.
+    The results are shared by all sessions and must not be modified.
     """
-    x = np.linspace(0, length_factor*np.pi, 50)
-    # Contribution of the first Eigenfunction
-    y_first = first * np.exp(-conductivity * time/ length_factor**2) *\
-            np.sin(x / length_factor)
-    # Contribution of the second Eigenfunction
-    y_second = second * np.exp(-4 * conductivity * time / length_factor**2) *\
-            np.sin(2 * x / length_factor)
-    # Contribution of the thirs Eigenfunction
-    y_third = third * np.exp(-9 * conductivity * time / length_factor**2) *\
-            np.sin(3 * x / length_factor)
-    y = y_first + y_second + y_third
-
-    # Superposition with the trivial solution (necessary for non-homogeneous
-    # boundary conditions)
-    y_trivial_endpoints = [0, 0]
-    if (left != 0 or right != 0):
-        y_trivial = (right - left)/(length_factor * np.pi) * x + left
-        y += y_trivial
-        y_trivial_endpoints = [y_trivial[0], y_trivial[49]]
-
-    return (x, y, y_trivial_endpoints)
+    x = np.linspace(0, length_factor*np.pi, GRID_POINTS)
+    # Trivial solution (necessary for non-homogeneous boundary conditions)
+    y_trivial = (right - left)/(length_factor * np.pi) * x + left
+
+    if profile == 0:
+        coefficients = np.array([first, second, third])
+    else:
+        # The eigenfunctions only describe the deviation from the trivial
+        # solution
+        initial = initial_profile(profile, amplitude, x / x[-1])
+        coefficients = sine_coefficients(initial - y_trivial, modes)
+
+    decay = decay_factors(length_factor * np.pi, conductivity,
+            len(coefficients), times)
+    y = evolve(coefficients, decay, sine_basis(GRID_POINTS, len(coefficients)))
+    y += y_trivial
+
+    y_trivial_endpoints = [y_trivial[0], y_trivial[-1]]
+    return (screen_array(x), screen_array(y), y_trivial_endpoints)
+
+
+@memoize(maxsize=16)
+def plate_conditions(length_factor, profile, amplitude, first, second, third,
+        left, right):
+    """
+    The grid spacing, the initial temperature of the plate and the fixed
+    temperatures at its edges. The results are shared by all sessions and must
+    not be modified.
+    """
+    x = np.linspace(0, length_factor*np.pi, PLATE_POINTS)
+    X, Y = np.meshgrid(x, x)
+    s_x, s_y = X / x[-1], Y / x[-1]
+    # The fixed temperatures at the edges, linear in between the left and the
+    # right edge
+    edges = (right - left) * s_x + left
+
+    if profile == 0:
+        initial = edges + np.sin(Y / length_factor) * (
+                first * np.sin(X / length_factor) +
+                second * np.sin(2 * X / length_factor) +
+                third * np.sin(3 * X / length_factor))
+    elif profile in (1, 2):
+        initial = initial_profile(profile, amplitude, s_x) * \
+                initial_profile(profile, 1, s_y)
+    else:
+        initial = initial_profile(profile, amplitude, s_x) * np.ones(X.shape)
+    initial[0, :], initial[-1, :] = edges[0, :], edges[-1, :]
+    initial[:, 0], initial[:, -1] = edges[:, 0], edges[:, -1]
+
+    return x[1] - x[0], initial, edges
+
+
+@memoize(maxsize=8)
+def update_plate(length_factor, conductivity, profile, amplitude, first,
+        second, third, left, right, time_step, steps):
+    """
+    The temperature of the plate at t=0 and after every step of the time slider
+    (one frame per point in time), calculated numerically for the animation. The
+    results are shared by all sessions and must not be modified.
+    """
+    spacing, initial, edges = plate_conditions(length_factor, profile,
+            amplitude, first, second, third, left, right)
+    return screen_array(simulate(initial, edges, spacing, conductivity,
+            time_step, steps))
 
 
 # Data source for the analytical solution. Whenever its data is changed, it will
@@ -70,6 +172,9 @@ data_source = ColumnDataSource(data={'x': [], 'y': []})
 # Line for the trivial solution, especially helpful if boundary conditions are
 # not homogeneous
 trivial_line_source = ColumnDataSource(data={'x': [], 'y': []})
+# Holds all frames of the animation which are then played back on the client
+frame_source = create_frame_source()
+plate_frame_source = create_frame_source()
 
 plot = Figure(plot_height=HEIGHT, plot_width=WIDTH_PLOT, x_range=[-1, 2*np.pi+1],
         y_range=[-2, 2], tools="")
@@ -87,7 +192,22 @@ plot.circle(x="x", y="y", source=trivial_line_source, color="black",
 # Line, indicating zero temperature, i.e., the x-axis
 plot.line(x=[-5, 15], y=[0, 0], color="black")
 
+# The temperature of the plate as an image, colored from -2 (blue) to 2 (red)
+plate_source = ColumnDataSource(data={"image": [], "dw": [], "dh": []})
+plate_plot = Figure(plot_height=HEIGHT, plot_width=WIDTH_PLOT,
+        x_range=[-0.5, 2*np.pi+0.5], y_range=[-0.5, 2*np.pi+0.5], tools="",
+        match_aspect=True, visible=False)
+plate_plot.xaxis.axis_label = "Ort x"
+plate_plot.yaxis.axis_label = "Ort y"
+plate_plot.image(image="image", x=0, y=0, dw="dw", dh="dh",
+        source=plate_source, color_mapper=LinearColorMapper(
+            palette=RdBu11[::-1], low=-2, high=2))
+
 # Define all widgets 
+# Select between the bar (1D) and the plate (2D)
+mode_selector = RadioButtonGroup(labels=["Stab (1D)", "Platte (2D)"], active=0)
+# The initial condition, coefficients of eigenfunctions or a temperature profile
+profile = RadioButtonGroup(labels=PROFILES, active=0)
 # The length of the bar
 length = Slider(title="Länge des Stabes (mal pi)", value=1, start=0.5, end=2,
         step=0.5)
@@ -98,6 +218,9 @@ conductivity = Slider(title="Temperaturleifähigkeit", value=1, start=0.1, end=2
 # The coefficient for the first Eigenfunction, determined by the initial
 # condition
 first = Slider(title="Auslenkung der ersten Eigenform", value=1, start=-2, end=2, step=0.1)
+# The temperature of the profiles
+amplitude = Slider(title="Anfangstemperatur", value=1, start=-2, end=2,
+        step=0.1, visible=False)
 # Enables the visibility for advanced widgets that are collapsed for a better
 # readability of the plot
 advanced_toggle = Toggle(label="Mehr Optionen")
@@ -116,8 +239,11 @@ left = Slider(title="Temperatur am linken Rand u(t, x=0)", value=0, start=-2,
         end=2, step=0.1, visible=False)
 right = Slider(title="Temperatur am rechten Rand u(t, x=L)", value=0, start=-2,
         end=2, step=0.1, visible=False)
-# Toggle that adds a periodic callback function, so that the plot seems to be
-# moving
+# The number of eigenfunctions a temperature profile is approximated with
+modes = Slider(title="Anzahl der Eigenformen", value=100, start=1,
+        end=GRID_POINTS - 2, step=1, visible=False)
+# Toggle that starts the client-side playback of the precalculated frames, so
+# that the plot seems to be moving
 animation_toggle = Toggle(label="Animieren")
 # Lets the user adjust the time in the transient simulation on its own
 time = Slider(title="Zeit", value=0, start=0, end=10, step=0.1)
@@ -129,29 +255,125 @@ def toggle_callback(source):
     the functionality in the first place
     """
     advanced_toggle.visible = False
-    second.visible = True
-    third.visible = True
     left.visible = True
     right.visible = True
+    profile_visibility()
+
+def profile_visibility():
+    """
+    Shows the sliders belonging to the chosen initial condition.
+    """
+    eigenfunctions = profile.active == 0
+    first.visible = eigenfunctions
+    second.visible = eigenfunctions and not advanced_toggle.visible
+    third.visible = eigenfunctions and not advanced_toggle.visible
+    amplitude.visible = not eigenfunctions
+    modes.visible = not eigenfunctions and not advanced_toggle.visible
+
+def plate_mode():
+    return mode_selector.active == 1
 
-def animate():
-    if time.value >= time.end:
-        time.value = time.start
+def profile_parameters():
+    """
+    The amplitude, the number of modes and the three coefficients. Only those of
+    the chosen profile are used, the others are fixed so that they do not split
+    the cached solutions.
+    """
+    if profile.active == 0:
+        return 0, 3, first.value, second.value, third.value
+    return amplitude.value, modes.value, 0, 0, 0
+
+def calculate_plate_frames():
+    steps = len(frame_times(time)) - 1
+    amplitude_value, _, first_value, second_value, third_value = \
+            profile_parameters()
+    return update_plate(length.value, conductivity.value, profile.active,
+            amplitude_value, first_value, second_value, third_value,
+            left.value, right.value, time.step, steps)
+
+# The temperature of the plate shown in this session, the parameters and the
+# number of steps it was calculated with and the checkpoints every
+# PLATE_CHECKPOINT_STEPS steps
+plate_state = {"parameters": None, "step": 0, "temperature": None,
+        "checkpoints": {}}
+
+def calculate_plate_frame(step):
+    """
+    The temperature of the plate after the number of time steps, continued from
+    the temperature shown before (or the closest checkpoint before the step).
+    """
+    amplitude_value, _, first_value, second_value, third_value = \
+            profile_parameters()
+    conditions = (length.value, profile.active, amplitude_value, first_value,
+            second_value, third_value, left.value, right.value)
+    parameters = conditions + (conductivity.value, time.step)
+    spacing, initial, edges = plate_conditions(*conditions)
+    if plate_state["parameters"] != parameters:
+        plate_state.update(parameters=parameters, step=0, temperature=initial,
+                checkpoints={0: initial})
+    if plate_state["step"] > step:
+        start = max(checkpoint for checkpoint in plate_state["checkpoints"]
+                if checkpoint <= step)
+        temperature = plate_state["checkpoints"][start]
     else:
-        time.value += time.step
+        start, temperature = plate_state["step"], plate_state["temperature"]
+
+    if step > start:
+        frames = simulate(temperature, edges, spacing, conductivity.value,
+                time.step, step - start, start=start)
+        for index in range(1, len(frames)):
+            if (start + index) % PLATE_CHECKPOINT_STEPS == 0:
+                plate_state["checkpoints"][start + index] = frames[index].copy()
+        temperature = frames[-1].copy()
+    plate_state.update(step=step, temperature=temperature)
+    return temperature
+
+def calculate_frames():
+    amplitude_value, modes_value, first_value, second_value, third_value = \
+            profile_parameters()
+    return update_data(length.value, conductivity.value, profile.active,
+            amplitude_value, first_value, second_value, third_value,
+            left.value, right.value, modes_value, frame_times(time))
+
+def update_animation_frames():
+    """
+    Calculates the solution for all points in time of the time slider in one
+    pass and sends them to the client which plays them back. This is only
+    necessary while the animation is running.
+    """
+    if not animation_toggle.active:
+        return
+    if plate_mode():
+        update_frames(plate_frame_source, calculate_plate_frames())
+    else:
+        x, frames, y_trivial = calculate_frames()
+        update_frames(frame_source, frames)
 
-callback_id = 0
 def animation_callback(source):
     """
-    Function adds a callback to the function which animates it. The callback_id
-    is the id of the process the bokeh server spawns. It is necessary to
-    remove it later on.
+    The playback itself is handled by the javascript players attached to the
+    toggle, one for the bar and one for the plate. The server only provides the
+    frames of the current mode (and frees them again once the animation is
+    stopped).
     """
-    global callback_id
     if animation_toggle.active == 1:
-        callback_id = curdoc().add_periodic_callback(animate, 100)
+        update_animation_frames()
     else:
-        curdoc().remove_periodic_callback(callback_id)
+        update_frames(frame_source, None)
+        update_frames(plate_frame_source, None)
+
+def mode_callback(source):
+    """
+    Shows the bar or the plate. A running animation is stopped.
+    """
+    animation_toggle.active = False
+    plot.visible = not plate_mode()
+    plate_plot.visible = plate_mode()
+    if plate_mode():
+        length.title = "Seitenlänge der Platte (mal pi)"
+    else:
+        length.title = "Länge des Stabes (mal pi)"
+    slider_callback(0, 0, 0)
 
 def slider_callback(attr, old, new):
     """
@@ -159,11 +381,47 @@ def slider_callback(attr, old, new):
     new value pairs and then outfits the ColumnDataSources with this
     information.
     """
-    x, y, y_trivial = update_data(length.value, conductivity.value, first.value,
-            second.value, third.value, left.value, right.value, time.value)
-    
-    data_source.data = {'x': x, 'y': y}
-    trivial_line_source.data = {'x': [0, length.value * np.pi], 'y': y_trivial}
+    if plate_mode():
+        frame = int(round((time.value - time.start) / time.step))
+        temperature = calculate_plate_frame(min(max(frame, 0),
+                len(frame_times(time)) - 1))
+        side = length.value * np.pi
+        plate_source.data = {"image": [screen_array(temperature)],
+                "dw": [side], "dh": [side]}
+        return
+
+    x, frames, y_trivial = calculate_frames()
+    frame = int(round((time.value - time.start) / time.step))
+    y = frames[min(max(frame, 0), len(frames) - 1)]
+
+    # Unless the length changes, the grid stays the same and only y is sent
+    update_source(data_source, {'x': x, 'y': y})
+    update_source(trivial_line_source,
+            {'x': [0, length.value * np.pi], 'y': y_trivial})
+
+def update_parameters():
+    """
+    In addition to the currently displayed solution, the frames of a running
+    animation have to be recalculated.
+    """
+    slider_callback(0, 0, 0)
+    update_animation_frames()
+
+def parameter_callback(attr, old, new):
+    """
+    Callback associated with a change in every slider but the time slider. The
+    plate is only recalculated once the slider is released (plate_callback).
+    """
+    if not plate_mode():
+        update_parameters()
+
+def plate_callback(attr, old, new):
+    if plate_mode():
+        update_parameters()
+
+def profile_callback(source):
+    profile_visibility()
+    update_parameters()
 
 # Populate the plot by calling the callback manually
 slider_callback(0,0,0)
@@ -172,12 +430,25 @@ slider_callback(0,0,0)
 advanced_toggle.on_click(toggle_callback)
 
 animation_toggle.on_click(animation_callback)
+attach_client_animation(animation_toggle, time, data_source, frame_source)
+attach_client_animation(animation_toggle, time, plate_source,
+        plate_frame_source, y="image", image=True)
+
+parameter_sliders = (length, conductivity, first, second, third, left, right,
+        amplitude, modes)
+for slider in parameter_sliders:
+    slider.on_change("value", parameter_callback)
+# Every change of a parameter of the plate takes a new simulation
+on_slider_change(parameter_sliders, plate_callback, throttled=True)
+
+profile.on_click(profile_callback)
+mode_selector.on_click(mode_callback)
 
-for slider in (length, conductivity, first, second, third, left, right, time):
-    slider.on_change("value", slider_callback)
+on_slider_change((time, ), slider_callback)
 
 # Assemble the plot
-inputs = WidgetBox(length, conductivity, first, advanced_toggle, second, third,
-        left, right, animation_toggle, time)
+inputs = WidgetBox(mode_selector, profile, length, conductivity, first, amplitude,
+        advanced_toggle, second, third, modes, left, right, animation_toggle,
+        time)
 
-curdoc().add_root(Row(plot, inputs, width=WIDTH_TOTAL))
+curdoc().add_root(Row(plot, plate_plot, inputs, width=WIDTH_TOTAL))
@@ -6,12 +6,26 @@ from bokeh.models import ColumnDataSource
 from bokeh.models.widgets import Slider, RadioButtonGroup, Toggle
 from bokeh.plotting import Figure
 
+from extensions.cache import memoize
+from extensions.incremental import update_source
+from extensions.payload import screen_array
+from extensions.animation import attach_client_animation, create_frame_source,\
+        frame_times, update_frames
+from extensions.membrane import Membrane
+from extensions.surface3d import Surface3d
+
 """
 This plot visualizes how waves propagate by simulating the right-going and
 left-going wave. The user can choose the initial condition, which will determine
 the shape of both waves.
 An advanced option is used to enable the intial condition on the first
 derivative with respect to time.
+
+In the second mode, a rectangular membrane with fixed edges is displaced by the
+zeroth initial condition (rotated around the center) and then simulated by
+finite differences (see extensions/membrane.py). While the membrane is animated,
+the simulation is advanced on the server and a frame is pushed to the 3d surface
+plot every MEMBRANE_FRAME_INTERVAL milliseconds.
 """
 
 # Define sizing constants for the plot to neatly fit in the website
@@ -25,6 +39,19 @@ RIGHT_X = 10
 
 LINE_WIDTH = 2
 
+# The membrane spans [LEFT_MEMBRANE, RIGHT_MEMBRANE] in both directions and is
+# simulated on a grid of MEMBRANE_POINTS by MEMBRANE_POINTS points. Only every
+# MEMBRANE_DISPLAY_STRIDE-th point in every direction is displayed.
+LEFT_MEMBRANE = -5
+RIGHT_MEMBRANE = 5
+MEMBRANE_POINTS = 201
+MEMBRANE_DISPLAY_STRIDE = 4
+
+# Milliseconds between two frames of the membrane (at most 20 frames per second)
+# and the simulated time per second of the animation
+MEMBRANE_FRAME_INTERVAL = 50
+MEMBRANE_TIME_PER_SECOND = 1.
+
 # The zeroth initial condition (elongation at time zero)
 INIT_0_1_indicator = "Glocke"
 def INIT_0_1(x):
@@ -56,6 +83,7 @@ initials_1_integrated = [INIT_1_1_integrated, INIT_1_2_integrated,
         INIT_1_3_integrated]
 
 
+@memoize()
 def update_data(init_0_active, speed, scale_0, time, init_1_active, scale_1):
     """
     This function calculates the value pairs for the plotted line to be drawn
@@ -74,6 +102,10 @@ def update_data(init_0_active, speed, scale_0, time, init_1_active, scale_1):
     condition:
         u_0 = scale_0 * u_0_original
         u_1 = scale_1 * u_1_original
+
+    If time is given as a column vector (see frame_times), the solution for every
+    point in time is calculated at once with one row per point in time.
+    The results are shared by all sessions and must not be modified.
     """
     x = np.linspace(LEFT_X, RIGHT_X, 200)
     u_left_going = scale_0 * initials_0[init_0_active](x + speed * time)
@@ -89,19 +121,38 @@ def update_data(init_0_active, speed, scale_0, time, init_1_active, scale_1):
                 U_momentum_left_going - U_momentum_right_going
             ))
 
-    return x, u
+    return screen_array(x), screen_array(u)
 
 
 # The ColumnDataSource abstracts the transmission of data to the client over the
 # Websocket Protocol. Whenever its data member variable is updated the new
 # information is send to be displayed.
 data_source = ColumnDataSource(data={'x': [], 'y': []})
+# Holds all frames of the animation which are then played back on the client
+frame_source = create_frame_source()
 
 plot = Figure(plot_height=HEIGHT, plot_width=WIDTH_PLOT, x_range=[-5, 5],
         y_range=[-0.5, 2.5])
 
 plot.line("x", "y", source=data_source, color="blue", line_width=LINE_WIDTH)
 
+# The grid of the membrane and the part of it that is displayed
+x_membrane = np.linspace(LEFT_MEMBRANE, RIGHT_MEMBRANE, MEMBRANE_POINTS)
+X_membrane, Y_membrane = np.meshgrid(x_membrane, x_membrane)
+display = (slice(None, None, MEMBRANE_DISPLAY_STRIDE), ) * 2
+X_display = screen_array(X_membrane[display].ravel())
+Y_display = screen_array(Y_membrane[display].ravel())
+
+surface_source = ColumnDataSource(data={"X": [], "Y": [], "Z": []})
+surface = Surface3d(x="X", y="Y", z="Z", data_source=surface_source,
+        visible=False)
+
+# The simulation is created once the membrane is shown first
+membrane_state = {"membrane": None, "callback_id": None}
+
+# Select between the string (1D) and the membrane (2D)
+mode_selector = RadioButtonGroup(labels=["Saite (1D)", "Membran (2D)"],
+        active=0)
 # Select the zeroth initial condition
 init_0_selector = RadioButtonGroup(labels=indicators_0, active=0)
 # Select the speed at which the wave propagates
@@ -110,11 +161,13 @@ speed = Slider(title="Ausbreitungsgeschwindigkeit", start=0.1, end=2, step=0.1,
 # Manipulate the influence of the zeroth initial condition
 scale_0 = Slider(title="Skalierung der 1. Anfangsbedingung", start=0.1, end=2,
         step=0.1, value=1)
-# Toggle that adds a periodic callback function, so that the plot seems to be
-# moving
+# Toggle that starts the client-side playback of the precalculated frames, so
+# that the plot seems to be moving
 animation_toggle = Toggle(label="Animieren")
 # Lets the user adjust the time in the transient simulation on its own
 time = Slider(title="Zeit", value=0, start=0, end=10, step=0.1)
+# Starts the simulation of the membrane on the server
+membrane_toggle = Toggle(label="Membran animieren", visible=False)
 
 # Allow the initial speed to be considered (This is deactivated up front since
 # the bevahiour might seem slightly unphysical)
@@ -126,24 +179,82 @@ scale_1 = Slider(title="Skalierung der 2. Anfangsbedingung", start=0, end=2,
         step=0.1, value=0, visible=False)
 
 
-def animate():
-    if time.value >= time.end:
-        time.value = time.start
+def reset_membrane():
+    """
+    Restarts the simulation of the membrane with the current initial condition
+    and speed.
+    """
+    if membrane_state["membrane"] is None:
+        membrane_state["membrane"] = Membrane(x_membrane, x_membrane,
+                speed.value)
+    membrane = membrane_state["membrane"]
+    membrane.set_speed(speed.value)
+    membrane.reset(scale_0.value * initials_0[init_0_selector.active](
+            np.hypot(X_membrane, Y_membrane)))
+    push_membrane_frame()
+
+def push_membrane_frame():
+    Z = screen_array(membrane_state["membrane"].displacement[display].ravel())
+    if len(surface_source.data["X"]) == 0:
+        surface_source.data = {"X": X_display, "Y": Y_display, "Z": Z}
     else:
-        time.value += time.step
+        # Only the displacement changes, the grid is not sent again. The column
+        # is replaced as a whole (not patched by update_source), the surface
+        # only redraws on changes of the data.
+        surface_source.data["Z"] = Z
+
+def advance_membrane():
+    membrane_state["membrane"].advance(
+            MEMBRANE_TIME_PER_SECOND * MEMBRANE_FRAME_INTERVAL / 1000)
+    push_membrane_frame()
+
+def membrane_callback(source):
+    if membrane_toggle.active and membrane_state["callback_id"] is None:
+        membrane_state["callback_id"] = curdoc().add_periodic_callback(
+                advance_membrane, MEMBRANE_FRAME_INTERVAL)
+    elif not membrane_toggle.active and \
+            membrane_state["callback_id"] is not None:
+        curdoc().remove_periodic_callback(membrane_state["callback_id"])
+        membrane_state["callback_id"] = None
+
+def mode_callback(source):
+    """
+    Shows the plot and the widgets of the chosen mode.
+    """
+    membrane_mode = mode_selector.active == 1
+    if not membrane_mode:
+        membrane_toggle.active = False
+    plot.visible = not membrane_mode
+    surface.visible = membrane_mode
+    membrane_toggle.visible = membrane_mode
+    for widget in (animation_toggle, time):
+        widget.visible = not membrane_mode
+    if membrane_mode:
+        animation_toggle.active = False
+        reset_membrane()
+
+def update_animation_frames():
+    """
+    Calculates the solution for all points in time of the time slider in one
+    pass and sends them to the client which plays them back. This is only
+    necessary while the animation is running.
+    """
+    if not animation_toggle.active:
+        return
+    x, frames = update_data(init_0_selector.active, speed.value, scale_0.value,
+            frame_times(time), init_1_selector.active, scale_1.value)
+    update_frames(frame_source, frames)
 
-callback_id = 0
 def animation_callback(source):
     """
-    Function adds a callback to the function which animates it. The callback_id
-    is the id of the process the bokeh server spawns. It is necessary to
-    remove it later on.
+    The playback itself is handled by the javascript player attached to the
+    toggle. The server only provides the frames (and frees them again once the
+    animation is stopped).
     """
-    global callback_id
     if animation_toggle.active == 1:
-        callback_id = curdoc().add_periodic_callback(animate, 100)
+        update_animation_frames()
     else:
-        curdoc().remove_periodic_callback(callback_id)
+        update_frames(frame_source, None)
 
 def toggle_callback(source):
     """
@@ -166,31 +277,47 @@ def slider_callback(attr, old, new):
     x, u = update_data(init_0_selector.active, speed.value, scale_0.value,
             time.value, init_1_selector.active, scale_1.value)
 
-    data_source.data = {'x': x, 'y': u}
+    update_source(data_source, {'x': x, 'y': u})
+
+def parameter_callback(attr, old, new):
+    """
+    Callback for all widgets but the time slider. In addition to the currently
+    displayed solution, the frames of a running animation are recalculated.
+    """
+    slider_callback(attr, old, new)
+    update_animation_frames()
+    if mode_selector.active == 1:
+        reset_membrane()
 
 def init_0_selector_callback(source):
     scale_0.value = 1 
-    slider_callback(0, 0, 0)
+    parameter_callback(0, 0, 0)
 
 def init_1_selector_callback(source):
     scale_1.value = 0.2 
-    slider_callback(0, 0, 0)
+    parameter_callback(0, 0, 0)
 
 # Call callback once upfront to populate the plot
 slider_callback(0,0,0)
 
 # Connect the widgets with their respective callbacks
 animation_toggle.on_click(animation_callback)
+membrane_toggle.on_click(membrane_callback)
+mode_selector.on_click(mode_callback)
+attach_client_animation(animation_toggle, time, data_source, frame_source)
 advanced_toggle.on_click(toggle_callback)
 
-for slider in (speed, scale_0, time, scale_1):
-    slider.on_change("value", slider_callback)
+for slider in (speed, scale_0, scale_1):
+    slider.on_change("value", parameter_callback)
+
+time.on_change("value", slider_callback)
 
 init_0_selector.on_click(init_0_selector_callback)
 init_1_selector.on_click(init_1_selector_callback)
 
 # Assemble the plot
-inputs = WidgetBox(init_0_selector, speed, scale_0, animation_toggle, time,
-        advanced_toggle, init_1_selector, scale_1)
+inputs = WidgetBox(mode_selector, init_0_selector, speed, scale_0,
+        animation_toggle, time, membrane_toggle, advanced_toggle,
+        init_1_selector, scale_1)
 
-curdoc().add_root(Row(plot, inputs, width=WIDTH_TOAL))
+curdoc().add_root(Row(plot, surface, inputs, width=WIDTH_TOAL))